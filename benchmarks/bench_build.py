@@ -0,0 +1,91 @@
+'''Compares the wall time of building a generated tree of images serially and
+concurrently, using a fake Docker client whose builds take a fixed time.
+
+Usage: python benchmarks/bench_build.py [--images=N] [--jobs=N] [--latency=S]
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from decking.runner import Decking
+
+
+class FakeBuildClient(object):
+    def __init__(self, latency):
+        self.latency = latency
+
+    def containers(self, **kwargs):
+        return []
+
+    def inspect_image(self, name):
+        return {'Id': name}
+
+    def build(self, fileobj, tag, **kwargs):
+        for chunk in fileobj:
+            pass
+        time.sleep(self.latency)
+        return [json.dumps({'stream': 'built {}'.format(tag)}).encode()]
+
+
+def make_images(base_path, count):
+    '''Writes a Dockerfile for each of 'count' images, where each image is
+    built from the image half its index, giving a tree of FROM dependencies.
+    '''
+    images = {}
+    for i in range(count):
+        name = 'bench/image{}'.format(i)
+        path = os.path.join(base_path, 'image{}'.format(i))
+        os.mkdir(path)
+        parent = 'bench/image{}'.format(i // 2) if i else 'ubuntu'
+        with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+            f.write('FROM {}\nRUN true\n'.format(parent))
+        images[name] = path
+    return images
+
+
+def time_build(config, base_path, latency, jobs):
+    decking = Decking(config, base_path, FakeBuildClient(latency))
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start_time = time.time()
+        # Otherwise the second run would find nothing to build:
+        decking.build('all', jobs=jobs, force=True)
+        return time.time() - start_time
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=31)
+    parser.add_argument('--jobs', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.1)
+    args = parser.parse_args()
+
+    base_path = tempfile.mkdtemp()
+    os.environ['DECKING_CACHE_DIR'] = os.path.join(base_path, 'cache')
+    try:
+        config = {
+            'images': make_images(base_path, args.images),
+            'containers': {},
+            'clusters': {}}
+        serial = time_build(config, base_path, args.latency, 1)
+        concurrent = time_build(config, base_path, args.latency, args.jobs)
+    finally:
+        shutil.rmtree(base_path)
+    print('{} images, {:.2f}s per build'.format(args.images, args.latency))
+    print('serial: {:7.2f}s'.format(serial))
+    print('{} jobs: {:7.2f}s ({:.1f}x)'.format(
+        args.jobs, concurrent, serial / concurrent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''Compares the peak memory used to produce a generated build context as a
+tar archive all at once in memory, and by streaming it in chunks as decking
+now sends it to the Docker daemon.
+
+Usage: python benchmarks/bench_build_context.py [--megabytes=N] [--files=N]
+    [--gzip]
+'''
+from __future__ import print_function
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+from decking.context import iter_context_files, iter_context_tar
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python <3.4
+    tracemalloc = None
+
+
+def make_context(base_path, megabytes, count):
+    '''Writes a build context of 'count' files totalling 'megabytes', along
+    with some ignored files that shouldn't be sent.
+    '''
+    os.makedirs(os.path.join(base_path, 'ignored'))
+    with open(os.path.join(base_path, 'Dockerfile'), 'w') as f:
+        f.write('FROM ubuntu\nCOPY . /data\n')
+    with open(os.path.join(base_path, '.dockerignore'), 'w') as f:
+        f.write('ignored\n')
+    size = megabytes * 2 ** 20 // count
+    for i in range(count):
+        with open(os.path.join(base_path, 'file{}'.format(i)), 'wb') as f:
+            f.write(os.urandom(size))
+    with open(os.path.join(base_path, 'ignored', 'file'), 'wb') as f:
+        f.write(os.urandom(size))
+
+
+def tar_in_memory(path, gzip):
+    '''Builds the whole archive in memory, as older docker-py versions do
+    when given a path.
+    '''
+    fileobj = io.BytesIO()
+    archive = tarfile.open(mode='w:gz' if gzip else 'w', fileobj=fileobj)
+    for relative_path, absolute_path in iter_context_files(path):
+        archive.add(absolute_path, arcname=relative_path, recursive=False)
+    archive.close()
+    return len(fileobj.getvalue())
+
+
+def tar_streamed(path, gzip):
+    return sum(len(chunk) for chunk in iter_context_tar(path, gzip=gzip))
+
+
+def measure(func, *args):
+    ''':returns: the (peak bytes allocated, size, seconds) of calling
+        'func'.
+    '''
+    tracemalloc.start()
+    try:
+        start_time = time.time()
+        size = func(*args)
+        elapsed = time.time() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megabytes', type=int, default=256)
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
+    if tracemalloc is None:
+        sys.exit('measuring memory needs Python 3.4 or later')
+
+    base_path = tempfile.mkdtemp()
+    try:
+        make_context(base_path, args.megabytes, args.files)
+        print('{} MB context in {} files{}'.format(
+            args.megabytes, args.files, ', gzipped' if args.gzip else ''))
+        for label, func in ('in memory', tar_in_memory), (
+                'streamed', tar_streamed):
+            peak, size, elapsed = measure(func, base_path, args.gzip)
+            print('{:>9}: peak {:8.1f} MB for {:8.1f} MB in {:.2f}s'.format(
+                label, peak / 2.0 ** 20, size / 2.0 ** 20, elapsed))
+    finally:
+        shutil.rmtree(base_path)
+
+
+if __name__ == '__main__':
+    main()
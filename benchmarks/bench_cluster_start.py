@@ -0,0 +1,74 @@
+'''Compares starting a generated cluster one dependency level at a time with
+starting each container as soon as its own dependencies are up, when
+container start times vary.
+
+Usage: python benchmarks/bench_cluster_start.py [--containers=N] [--jobs=N]
+'''
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from decking.components import Cluster
+
+
+class FakeContainer(object):
+    def __init__(self, name, start_time, dependencies):
+        self.name = name
+        self.start_time = start_time
+        self.dependencies = dependencies
+
+    def run(self, group=None):
+        time.sleep(self.start_time)
+
+
+def make_containers(count, max_start_time, seed=0):
+    rng = random.Random(seed)
+    containers = []
+    for i in range(count):
+        dependencies = {}
+        if i:
+            for _ in range(rng.randrange(3)):
+                dependencies[containers[rng.randrange(i)]] = 'alias'
+        containers.append(FakeContainer(
+            'container{:04}'.format(i), rng.uniform(0, max_start_time),
+            dependencies))
+    return containers
+
+
+def critical_path(containers):
+    finish = {}
+    for container in containers:
+        finish[container] = container.start_time + max(
+            [finish[d] for d in container.dependencies] or [0])
+    return max(finish.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--containers', type=int, default=40)
+    parser.add_argument('--jobs', type=int, default=8)
+    parser.add_argument('--max-start-time', type=float, default=0.2)
+    args = parser.parse_args()
+
+    containers = make_containers(args.containers, args.max_start_time)
+    cluster = Cluster(None, 'bench', containers)
+    run = lambda container: container.run()
+
+    start_time = time.time()
+    cluster._do_by_level(run, args.jobs)
+    levels = time.time() - start_time
+
+    start_time = time.time()
+    cluster._do_by_dependency(run, args.jobs)
+    dependencies = time.time() - start_time
+
+    print('{} containers, {} jobs'.format(args.containers, args.jobs))
+    print('critical path:       {:6.2f}s'.format(critical_path(containers)))
+    print('by dependency level: {:6.2f}s'.format(levels))
+    print('as dependencies run: {:6.2f}s'.format(dependencies))
+
+
+if __name__ == '__main__':
+    main()
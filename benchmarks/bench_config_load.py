@@ -0,0 +1,110 @@
+'''Times loading generated decking files of increasing size: with the json
+module and each of the YAML loaders, then validating the result, or instead
+loading it from the configuration cache.
+
+Usage: python benchmarks/bench_config_load.py [--max-containers=N]
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from decking.cache import ConfigCache
+from decking.main import _load_config_data, _read_config, _validate_config
+
+
+def make_config(count):
+    '''Returns decking configuration with 'count' containers, each depending
+    on a few earlier ones, spread across clusters of ten.
+    '''
+    containers = {}
+    for i in range(count):
+        containers['container{}'.format(i)] = {
+            'image': 'bench/image{}'.format(i % 10),
+            'port': ['{0}:{0}'.format(8000 + i)],
+            'env': ['INDEX={}'.format(i), 'NAME=container{}'.format(i)],
+            'dependencies': [
+                'container{0}:alias{0}'.format(j)
+                for j in range(max(0, i - 3), i)],
+            'mount': ['data/{0}:/data/{0}'.format(i)],
+        }
+    clusters = {
+        'cluster{}'.format(i): [
+            'container{}'.format(j) for j in range(min(i + 10, count))]
+        for i in range(0, count, 10)}
+    return {
+        'images': {
+            'bench/image{}'.format(i): './image{}'.format(i)
+            for i in range(10)},
+        'containers': containers,
+        'clusters': clusters,
+    }
+
+
+def best_time(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.time()
+        func()
+        best = min(best, time.time() - start_time)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-containers', type=int, default=3000)
+    args = parser.parse_args()
+
+    loaders = [
+        ('json', None),
+        ('yaml (C safe)', getattr(yaml, 'CSafeLoader', None)),
+        ('yaml (safe)', yaml.SafeLoader),
+        ('yaml (unsafe)', yaml.Loader)]
+    headings = [name for name, _ in loaders] + ['validate', 'cached']
+    print('{:>10} {:>8}'.format('containers', 'KB') + ''.join(
+        '{:>15}'.format(heading) for heading in headings))
+    print('{:>19}'.format('') + '{:>15}'.format('(ms)') * len(headings))
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        sizes = [
+            size for size in (10, 100, 1000, 3000, 10000)
+            if size <= args.max_containers]
+        for count in sizes:
+            config = make_config(count)
+            json_content = json.dumps(config, indent=4).encode('utf-8')
+            yaml_content = yaml.safe_dump(
+                config, default_flow_style=False).encode('utf-8')
+            times = []
+            for name, loader in loaders:
+                if name == 'json':
+                    times.append(best_time(
+                        lambda: _load_config_data(json_content)))
+                elif loader is None:
+                    times.append(None)
+                else:
+                    times.append(best_time(
+                        lambda: yaml.load(yaml_content, Loader=loader)))
+            times.append(best_time(lambda: _validate_config(config)))
+            filename = os.path.join(temp_dir, 'decking{}.json'.format(count))
+            with open(filename, 'wb') as config_file:
+                config_file.write(json_content)
+            cache = ConfigCache(os.path.join(temp_dir, 'cache'))
+            _read_config(filename, cache)
+            times.append(best_time(lambda: _read_config(filename, cache)))
+            print('{:10} {:8.0f}'.format(count, len(json_content) / 1024.) +
+                  ''.join(
+                      '{:15.1f}'.format(t) if t is not None else
+                      '{:>15}'.format('n/a') for t in times))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+'''Times displaying the progress stream of pulling a generated image of
+several gigabytes, with tens of thousands of progress messages: one message
+to a chunk, as the daemon sends them when it isn't busy; many to a chunk,
+as when they are coalesced under load; and split across small chunks.
+Optionally compares against the old consume_stream, which assumed one
+message to a chunk, and so can only handle the first.
+
+Usage: python benchmarks/bench_consume_stream.py [--gigabytes=N]
+    [--layers=N] [--update-every=KB] [--compare]
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from decking.terminal import Terminal
+from decking.util import consume_stream
+
+
+def old_consume_stream(stream, term):
+    '''The consume_stream decking used to use, for comparison.'''
+    prev_status_id = None
+    for item in stream:
+        item = json.loads(item.decode('utf-8'))
+        if 'stream' in item:
+            for line in item['stream'].strip().splitlines():
+                term.print_line(line)
+        elif 'status' in item:
+            status = item.pop('status')
+            status_id = item.pop('id', None)
+            msg = status
+            if status_id:
+                msg += ' ({})'.format(status_id)
+            if prev_status_id == status_id:
+                call = term.replace_line
+            else:
+                call = term.print_line
+            if 'progress' in item:
+                msg += ': ' + item['progress']
+            else:
+                msg += ' ' + ' '.join(
+                    '{}: {}'.format(k, v)
+                    for k, v in item.items()
+                    if v)
+            call(msg)
+            prev_status_id = status_id
+        elif 'error' in item:
+            raise RuntimeError(item['error'])
+
+
+def _progress_bar(current, total, width=50):
+    done = width * current // total
+    return '[{}>{}] {:.1f} MB/{:.1f} MB'.format(
+        '=' * done, ' ' * (width - done), current / 1e6, total / 1e6)
+
+
+def make_pull_messages(size, layers, update_every):
+    ''':returns: list of the encoded messages the daemon would send while
+        pulling an image of 'size' bytes in 'layers' layers, downloaded one
+        after another with an update every 'update_every' bytes, then
+        extracted.
+    '''
+    messages = [{'status': 'Pulling from bench/image', 'id': 'latest'}]
+    layer_size = size // layers
+    for layer in range(layers):
+        layer_id = '{:012x}'.format(layer * 7919 + 1)
+        messages.append({'status': 'Pulling fs layer', 'id': layer_id})
+        for status in 'Downloading', 'Extracting':
+            for current in range(0, layer_size + 1, update_every):
+                messages.append({
+                    'status': status, 'id': layer_id,
+                    'progressDetail': {
+                        'current': current, 'total': layer_size},
+                    'progress': _progress_bar(current, layer_size)})
+        messages.append({'status': 'Pull complete', 'id': layer_id})
+    messages.append({'status': 'Status: Downloaded newer image'})
+    return [
+        json.dumps(message).encode('utf-8') + b'\r\n'
+        for message in messages]
+
+
+def chunk(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def time_consume(func, chunks, repeat=3):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        best = float('inf')
+        for _ in range(repeat):
+            start_time = time.time()
+            func(chunks, Terminal())
+            best = min(best, time.time() - start_time)
+        return best
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--gigabytes', type=float, default=4)
+    parser.add_argument('--layers', type=int, default=8)
+    parser.add_argument('--update-every', type=int, default=256,
+                        help='kilobytes downloaded between updates')
+    parser.add_argument(
+        '--compare', action='store_true',
+        help='also time the old consume_stream')
+    args = parser.parse_args()
+
+    messages = make_pull_messages(
+        int(args.gigabytes * 1e9), args.layers, args.update_every * 1024)
+    stream = b''.join(messages)
+    print('{:.1f} GB pull: {} messages, {:.1f} MB of JSON'.format(
+        args.gigabytes, len(messages), len(stream) / 1e6))
+    cases = [
+        ('one message per chunk', messages),
+        ('coalesced 64 KB chunks', chunk(stream, 2 ** 16)),
+        ('split 100 byte chunks', chunk(stream, 100)),
+    ]
+    print('{:24} {:>10} {:>14} {:>10}'.format(
+        '', 'seconds', 'messages/s', 'old (s)'))
+    for name, chunks in cases:
+        elapsed = time_consume(consume_stream, chunks)
+        old = '-'
+        if args.compare:
+            try:
+                old = '{:10.3f}'.format(
+                    time_consume(old_consume_stream, chunks))
+            except ValueError:
+                old = 'fails'
+        print('{:24} {:10.3f} {:14.0f} {:>10}'.format(
+            name, elapsed, len(messages) / elapsed, old))
+
+
+if __name__ == '__main__':
+    main()
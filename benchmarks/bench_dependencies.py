@@ -0,0 +1,88 @@
+'''Times dependency resolution on generated graphs of increasing size, to
+check that it scales linearly. Optionally compares against the old resolver,
+which rescanned every unprocessed item on each pass.
+
+Usage: python benchmarks/bench_dependencies.py [--max-size=N] [--compare]
+'''
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from decking.util import iter_dependencies, iter_dependency_levels
+
+
+def make_graph(size, max_dependencies=3, seed=0):
+    '''Returns a random DAG of 'size' nodes, each depending on up to
+    'max_dependencies' nodes with lower indexes, plus a long chain so that
+    there are many levels.
+    '''
+    rng = random.Random(seed)
+    graph = {}
+    for i in range(size):
+        dependencies = set()
+        if i:
+            dependencies.add(i - 1 if i % 2 else rng.randrange(i))
+            for _ in range(rng.randrange(max_dependencies)):
+                dependencies.add(rng.randrange(i))
+        graph[i] = sorted(dependencies)
+    return graph
+
+
+def quadratic_iter_dependencies(to_process, get_item_dependencies):
+    '''The resolver decking used to use, for comparison.'''
+    to_process = set(to_process)
+    processed = set()
+    while to_process:
+        pending = set()
+        for item in list(to_process):
+            if all(dep in processed for dep in get_item_dependencies(item)):
+                to_process.remove(item)
+                pending.add(item)
+                yield item
+        if not pending:
+            raise RuntimeError('Missing or circular dependencies')
+        processed |= pending
+
+
+def time_resolver(resolver, graph, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.time()
+        for _ in resolver(graph, graph.__getitem__):
+            pass
+        best = min(best, time.time() - start_time)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-size', type=int, default=10000)
+    parser.add_argument(
+        '--compare', action='store_true',
+        help='also time the old resolver (slow on large graphs)')
+    args = parser.parse_args()
+
+    sizes = []
+    size = 100
+    while size <= args.max_size:
+        sizes.append(size)
+        size *= 10
+    print('{:>8} {:>12} {:>12} {:>12}'.format(
+        'nodes', 'items (ms)', 'levels (ms)', 'old (ms)'))
+    for size in sizes:
+        graph = make_graph(size)
+        items = time_resolver(iter_dependencies, graph)
+        levels = time_resolver(iter_dependency_levels, graph)
+        if args.compare:
+            old = '{:12.1f}'.format(
+                time_resolver(quadratic_iter_dependencies, graph, 1) * 1000)
+        else:
+            old = '{:>12}'.format('-')
+        print('{:8} {:12.1f} {:12.1f} {}'.format(
+            size, items * 1000, levels * 1000, old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+'''Runs decking's operations end to end against the fake Docker daemon in
+fakedocker.py, on generated clusters of increasing size, reporting the wall
+time, Docker API calls and peak memory of each operation.
+
+Each operation uses a new Decking, as each invocation of the command line
+does. Peak memory is traced with tracemalloc, which slows everything down
+and includes the fake daemon's own allocations, so pass --no-memory for
+representative times.
+
+Usage: python benchmarks/bench_end_to_end.py [--sizes=N,...] [--jobs=N]
+    [--latency=ENDPOINT=S,...] [--log-lines=N] [--no-memory] [--output=FILE]
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+try:
+    import tracemalloc
+except ImportError:
+    # Python <3.4
+    tracemalloc = None
+
+from decking.runner import Decking
+from decking.transport import PooledClient, DEFAULT_POOL_SIZE
+
+from fakedocker import FakeDocker, parse_latency
+
+OPERATIONS = 'build', 'run', 'status', 'stop', 'start', 'attach'
+
+
+def make_config(base_path, count):
+    '''Writes a Dockerfile for each of a tenth as many images as 'count'
+    containers, where each container depends on the container half its
+    index, giving a tree of dependencies.
+    '''
+    images = {}
+    for i in range(max(1, count // 10)):
+        path = os.path.join(base_path, 'image{}'.format(i))
+        os.mkdir(path)
+        with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+            f.write('FROM ubuntu\nRUN echo {}\n'.format(i))
+        images['bench/image{}'.format(i)] = path
+    image_names = sorted(images)
+    containers = {}
+    for i in range(count):
+        container = {'image': image_names[i % len(image_names)]}
+        if i:
+            container['dependencies'] = ['c{:04}:parent'.format(i // 2)]
+        containers['c{:04}'.format(i)] = container
+    return {
+        'images': images, 'containers': containers,
+        'clusters': {'bench': sorted(containers)}}
+
+
+def run_operation(server, config, base_path, operation, jobs, memory):
+    ''':returns: tuple of (seconds, calls by endpoint, peak bytes or None) for
+        the operation.
+    '''
+    server.reset_counts()
+    if memory:
+        tracemalloc.start()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start_time = time.time()
+        decking = Decking(config, base_path, PooledClient(
+            base_url=server.base_url, version='1.19',
+            pool_size=max(jobs, DEFAULT_POOL_SIZE)))
+        if operation == 'build':
+            decking.build('all', jobs=jobs)
+        elif operation in ('status', 'attach'):
+            getattr(decking, operation)('bench')
+        else:
+            getattr(decking, operation)('bench', jobs=jobs)
+        elapsed = time.time() - start_time
+        decking.client.close()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        peak = None
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return elapsed, dict(server.calls), peak
+
+
+def bench_size(count, args):
+    temp_dir = tempfile.mkdtemp()
+    server = FakeDocker(
+        os.path.join(temp_dir, 'docker.sock'), args.latency, args.log_lines)
+    server.start()
+    # Nothing has been built yet:
+    os.environ['DECKING_CACHE_DIR'] = os.path.join(temp_dir, 'cache')
+    try:
+        base_path = os.path.join(temp_dir, 'context')
+        os.mkdir(base_path)
+        config = make_config(base_path, count)
+        results = {}
+        for operation in OPERATIONS:
+            results[operation] = run_operation(
+                server, config, base_path, operation, args.jobs, args.memory)
+        return results
+    finally:
+        server.stop()
+        shutil.rmtree(temp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes', default='10,100,1000',
+        type=lambda value: [int(size) for size in value.split(',')])
+    parser.add_argument('--jobs', type=int, default=10)
+    parser.add_argument('--latency', type=parse_latency, default={})
+    parser.add_argument('--log-lines', type=int, default=10)
+    parser.add_argument(
+        '--no-memory', dest='memory', action='store_false',
+        default=tracemalloc is not None)
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    all_results = {}
+    for count in args.sizes:
+        print('{} containers, {} jobs'.format(count, args.jobs))
+        results = bench_size(count, args)
+        for operation in OPERATIONS:
+            elapsed, calls, peak = results[operation]
+            print('  {:7} {:8.3f}s {:6} calls {:>10}  {}'.format(
+                operation, elapsed, sum(calls.values()),
+                '{:.1f}MB'.format(peak / 2.0 ** 20) if peak else '',
+                ', '.join(
+                    '{} {}'.format(count, endpoint)
+                    for endpoint, count in sorted(calls.items()))))
+        all_results[count] = {
+            operation: {'seconds': elapsed, 'calls': calls, 'peak': peak}
+            for operation, (elapsed, calls, peak) in results.items()}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
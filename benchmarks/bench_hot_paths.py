@@ -0,0 +1,217 @@
+'''Times the pure Python hot paths of processing decking configuration on
+generated configurations of increasing size, and flags any that have got
+slower than the stored baseline, or scale worse than expected.
+
+The scaling of each hot path is the exponent of a power law fitted to its
+times, which is about 1 for a linear one and 2 for a quadratic one. Since
+the exponent doesn't depend on the machine, it is the more reliable check;
+times are only comparable with a baseline saved on the same machine, with
+--save.
+
+Exits with status 1 if anything is flagged.
+
+Usage: python benchmarks/bench_hot_paths.py [--sizes=N,...] [--save]
+    [--baseline=FILE] [--tolerance=F] [--scaling-tolerance=F]
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+from decking.main import _validate_config
+from decking.runner import Decking
+from decking.util import iter_dependencies, undelimit_mapping
+
+from bench_config_load import make_config
+from bench_dependencies import make_graph
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_grouped_config(count):
+    '''Returns the configuration from :func:`make_config`, plus a group
+    overriding the environment of each of the containers, and a cluster of
+    them all using it.
+    '''
+    config = make_config(count)
+    names = sorted(config['containers'])
+    config['groups'] = {'everything': {
+        'options': {'env': ['GROUPED=1']},
+        'containers': {
+            name: {'env': ['OVERRIDDEN={}'.format(name)]} for name in names}}}
+    config['clusters']['everything'] = {
+        'group': 'everything', 'containers': names}
+    return config
+
+
+def make_decking(count):
+    # We never talk to the daemon:
+    return Decking(make_grouped_config(count), docker_client=object())
+
+
+def _undelimit_mapping(count):
+    items = ['key{0}:value{0}'.format(i) for i in range(count)]
+    return lambda: undelimit_mapping(items)
+
+
+def _iter_dependencies(count):
+    graph = make_graph(count)
+    return lambda: list(iter_dependencies(graph, graph.__getitem__))
+
+
+def _make_containers(count):
+    decking = make_decking(count)
+    config = make_grouped_config(count)['containers']
+    return lambda: decking._make_containers(config)
+
+
+def _make_groups(count):
+    decking = make_decking(count)
+    config = make_grouped_config(count)['groups']
+    return lambda: decking._make_groups(config)
+
+
+def _group_modified_environment(count):
+    decking = make_decking(count)
+    cluster = decking.clusters['everything']
+
+    def get_environments():
+        for container in cluster:
+            container._get_group_modified_dict_attribute(
+                cluster.group, 'environment')
+    return get_environments
+
+
+def _validate(count):
+    config = make_grouped_config(count)
+    return lambda: _validate_config(config)
+
+
+# name: (expected scaling exponent, function taking a size and returning the
+# function to time):
+CASES = OrderedDict([
+    ('util.undelimit_mapping', (1, _undelimit_mapping)),
+    ('util.iter_dependencies', (1, _iter_dependencies)),
+    ('Decking._make_containers', (1, _make_containers)),
+    ('Decking._make_groups', (1, _make_groups)),
+    ('Container._get_group_modified_dict_attribute',
+     (1, _group_modified_environment)),
+    ('schema.ConfigValidator', (1, _validate)),
+])
+
+
+def time_call(func, min_time=0.05, repeat=3):
+    ''':returns: the best time in seconds that a call to 'func' took, over
+        'repeat' runs of as many calls as take at least 'min_time'.
+    '''
+    number = 1
+    while True:
+        start_time = time.time()
+        for _ in range(number):
+            func()
+        elapsed = time.time() - start_time
+        if elapsed >= min_time:
+            break
+        number *= 10
+    best = elapsed
+    for _ in range(repeat - 1):
+        start_time = time.time()
+        for _ in range(number):
+            func()
+        best = min(best, time.time() - start_time)
+    return best / number
+
+
+def fit_exponent(times):
+    ''':returns: the exponent of the power law best fitting the mapping of
+        sizes to 'times', by least squares on their logarithms.
+    '''
+    points = [(math.log(size), math.log(t)) for size, t in times.items()]
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    return (
+        sum((x - mean_x) * (y - mean_y) for x, y in points) /
+        sum((x - mean_x) ** 2 for x, _ in points))
+
+
+def check(name, expected, times, exponent, baseline, args):
+    ''':returns: list of the reasons to flag the named hot path.'''
+    problems = []
+    if exponent > expected + args.scaling_tolerance:
+        problems.append('scales as n^{:.2f}, expected n^{}'.format(
+            exponent, expected))
+    for size, seconds in sorted(baseline.get('times', {}).items()):
+        size = int(size)
+        if size in times and times[size] > seconds * (1 + args.tolerance):
+            problems.append('{:.1f}x slower than the baseline at {}'.format(
+                times[size] / seconds, size))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes', default='250,1000,4000',
+        type=lambda value: [int(size) for size in value.split(',')])
+    parser.add_argument(
+        '--baseline', default=os.path.join(here, 'hot_paths_baseline.json'))
+    parser.add_argument(
+        '--save', action='store_true',
+        help='save the times and scaling as the new baseline')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.5,
+        help='fraction by which a time may exceed the baseline')
+    parser.add_argument(
+        '--scaling-tolerance', type=float, default=0.25,
+        help='amount by which an exponent may exceed the expected one')
+    parser.add_argument('cases', nargs='*', help='only time these cases')
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline) as baseline_file:
+            baselines = json.load(baseline_file)['cases']
+    except IOError:
+        baselines = {}
+
+    print('{:46}'.format('hot path (ms per call)') + ''.join(
+        '{:>10}'.format(size) for size in args.sizes) + '{:>10}'.format('n^'))
+    results = OrderedDict()
+    flagged = OrderedDict()
+    for name, (expected, setup) in CASES.items():
+        if args.cases and name not in args.cases:
+            continue
+        times = OrderedDict(
+            (size, time_call(setup(size))) for size in args.sizes)
+        exponent = fit_exponent(times)
+        print('{:46}'.format(name) + ''.join(
+            '{:10.3f}'.format(t * 1000) for t in times.values()) +
+            '{:10.2f}'.format(exponent))
+        results[name] = {'times': times, 'exponent': exponent}
+        problems = check(
+            name, expected, times, exponent, baselines.get(name, {}), args)
+        if problems:
+            flagged[name] = problems
+
+    for name, problems in flagged.items():
+        print('FLAGGED {}: {}'.format(name, '; '.join(problems)))
+    if args.save:
+        baselines.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cases': baselines,
+            }, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print('saved baseline to {}'.format(args.baseline))
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+'''Measures the per-request overhead of talking to the fake Docker daemon in
+fakedocker.py from several threads at once, with a connection pool too
+small for them and with one big enough for them all.
+
+Usage: python benchmarks/bench_transport.py [--threads=N] [--requests=N]
+    [--latency=S]
+'''
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from decking.transport import PooledClient
+
+from fakedocker import FakeDocker
+
+
+def time_requests(server, pool_size, threads, requests):
+    ''':returns: the (seconds, connections made) for 'threads' threads to
+        each inspect a container 'requests' times.
+    '''
+    client = PooledClient(
+        base_url=server.base_url, version='1.19', pool_size=pool_size)
+    server.reset_counts()
+
+    def work():
+        for _ in range(requests):
+            client.inspect_container('bench')
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start_time = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start_time
+    client.close()
+    return elapsed, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    server = FakeDocker(
+        os.path.join(temp_dir, 'docker.sock'), {'inspect': args.latency})
+    server.start()
+    server.create_container('bench', {})
+    try:
+        total = args.threads * args.requests
+        print('{} threads making {} requests each'.format(
+            args.threads, args.requests))
+        for pool_size in 1, args.threads:
+            elapsed, connections = time_requests(
+                server, pool_size, args.threads, args.requests)
+            print(
+                'pool of {:3}: {:6.0f} us per request, {:5} connections, '
+                '{:7.0f} requests/s'.format(
+                    pool_size, elapsed / total * 1e6, connections,
+                    total / elapsed))
+    finally:
+        server.stop()
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
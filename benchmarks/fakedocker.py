@@ -0,0 +1,428 @@
+'''A fake Docker daemon, serving enough of the Engine API on a unix socket for
+decking to build images and to create, start, stop, inspect, remove and
+attach to containers, all held in memory. Each endpoint can be given a
+latency, standing in for the work a real daemon would do, and the server
+counts the calls made to each endpoint and the connections made to it.
+
+Use it from other benchmarks, or on its own to point decking at:
+
+Usage: python benchmarks/fakedocker.py SOCKET [--latency=ENDPOINT=S,...]
+'''
+from __future__ import print_function
+
+import argparse
+import hashlib
+import itertools
+import json
+import re
+import struct
+import threading
+import time
+from collections import Counter, OrderedDict
+try:
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import parse_qs, urlparse
+    from queue import Queue
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import parse_qs, urlparse
+    from Queue import Queue
+
+# (method, path pattern, endpoint), where the endpoint names the handler
+# method and the latency and call count that apply:
+_ROUTES = [(method, re.compile('^' + pattern + '$'), endpoint) for
+           method, pattern, endpoint in [
+    ('GET', '/version', 'version'),
+    ('GET', '/containers/json', 'containers'),
+    ('POST', '/containers/create', 'create'),
+    ('GET', '/containers/([^/]+)/json', 'inspect'),
+    ('POST', '/containers/([^/]+)/start', 'start'),
+    ('POST', '/containers/([^/]+)/stop', 'stop'),
+    ('POST', '/containers/([^/]+)/attach', 'attach'),
+    ('DELETE', '/containers/([^/]+)', 'remove'),
+    ('POST', '/build', 'build'),
+    ('GET', '/images/(.+)/json', 'inspect_image'),
+    ('GET', '/events', 'events'),
+]]
+
+ENDPOINTS = [endpoint for _, _, endpoint in _ROUTES]
+
+
+class NotFound(Exception):
+    pass
+
+
+class Conflict(Exception):
+    pass
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _route(self):
+        url = urlparse(self.path)
+        # Ignore the API version:
+        path = re.sub(r'^/v[0-9.]+/', '/', url.path)
+        self.query = {
+            key: values[-1] for key, values in parse_qs(url.query).items()}
+        for method, pattern, endpoint in _ROUTES:
+            match = pattern.match(path)
+            if method == self.command and match:
+                return endpoint, match.groups()
+        return None, ()
+
+    def _handle(self):
+        endpoint, args = self._route()
+        body = self._read_body()
+        if endpoint is None:
+            return self._send_json(404, {'message': 'no such endpoint'})
+        self.server.count(endpoint)
+        time.sleep(self.server.latency.get(endpoint, 0))
+        try:
+            getattr(self, 'do_' + endpoint)(body, *args)
+        except NotFound as error:
+            self._send_json(404, {'message': 'no such {}'.format(error)})
+        except Conflict as error:
+            self._send_json(409, {'message': str(error)})
+
+    do_GET = do_POST = do_DELETE = _handle
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            # Trailers:
+            while self.rfile.readline().strip():
+                pass
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _start_chunks(self, content_type='application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _send_chunk(self, data):
+        size = '{:x}\r\n'.format(len(data)).encode()
+        self.wfile.write(size + data + b'\r\n')
+        self.wfile.flush()
+
+    def do_version(self, body):
+        self._send_json(200, {'Version': '1.7.1', 'ApiVersion': '1.19'})
+
+    def do_containers(self, body):
+        filters = json.loads(self.query.get('filters') or '{}')
+        show_all = self.query.get('all') in ('1', 'True', 'true')
+        self._send_json(200, [
+            self.server.get_listing(container) for container in
+            self.server.find_containers(filters)
+            if show_all or container['running']])
+
+    def do_create(self, body):
+        config = json.loads(body.decode('utf-8') or '{}')
+        container = self.server.create_container(
+            self.query.get('name'), config)
+        self._send_json(201, {'Id': container['Id'], 'Warnings': None})
+
+    def do_inspect(self, body, name):
+        container = self.server.get_container(name)
+        self._send_json(200, {
+            'Id': container['Id'], 'Name': '/' + container['name'],
+            'Config': container['config'],
+            'State': {'Running': container['running']},
+            'NetworkSettings': {'IPAddress': container['ip_address']}})
+
+    def do_start(self, body, name):
+        self.server.set_running(self.server.get_container(name), True)
+        self._send_empty()
+
+    def do_stop(self, body, name):
+        self.server.set_running(self.server.get_container(name), False)
+        self._send_empty()
+
+    def do_remove(self, body, name):
+        self.server.remove_container(self.server.get_container(name))
+        self._send_empty()
+
+    def do_attach(self, body, name):
+        container = self.server.get_container(name)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.end_headers()
+        self.wfile.flush()
+        # docker-py takes the socket from beneath the response, so anything
+        # read into the response's buffer along with the headers is lost.
+        # The real daemon only writes as the container produces output:
+        time.sleep(0.01)
+        for i in range(self.server.log_lines):
+            line = '{} line {}\n'.format(container['name'], i).encode()
+            # Multiplexed, on stdout:
+            self.wfile.write(struct.pack('>BxxxL', 1, len(line)) + line)
+        self.wfile.flush()
+        # Having written its output, the container exits:
+        self.server.set_running(container, False)
+        self.close_connection = True
+
+    def do_build(self, body):
+        tag = self.query.get('t')
+        image_id = self.server.build_image(tag, body)
+        self._start_chunks()
+        for message in (
+                'Step 0 : FROM ...\n', ' ---> Running in fake\n',
+                'Successfully built {}\n'.format(image_id[:12])):
+            self._send_chunk(json.dumps({'stream': message}).encode())
+        self._send_chunk(b'')
+
+    def do_inspect_image(self, body, name):
+        self._send_json(200, self.server.get_image(name))
+
+    def do_events(self, body):
+        filters = json.loads(self.query.get('filters') or '{}')
+        events = self.server.subscribe()
+        self._start_chunks()
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    break
+                if self.server.matches(event['container'], filters):
+                    self._send_chunk(json.dumps(event['event']).encode())
+            self._send_chunk(b'')
+        except (IOError, OSError):
+            # The client has gone away.
+            pass
+        finally:
+            self.server.unsubscribe(events)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeDocker(ThreadingMixIn, UnixStreamServer):
+    '''Serves the fake daemon on a unix socket at 'path'.
+
+    :parameter latency: mapping of endpoint names, from ENDPOINTS, to the
+        seconds each call to them should take.
+    :parameter log_lines: how many lines each container writes to an
+        attached stream before it exits.
+    '''
+    daemon_threads = True
+
+    def __init__(self, path, latency=None, log_lines=10):
+        UnixStreamServer.__init__(self, path, FakeDockerHandler)
+        self.latency = dict(latency or {})
+        self.log_lines = log_lines
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.connections = 0
+        self.containers = OrderedDict()
+        self.images = {}
+        self._ids = itertools.count(1)
+        self._subscribers = []
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'unix://' + self.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self.lock:
+            for events in self._subscribers:
+                events.put(None)
+        self.shutdown()
+        self.server_close()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] += 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls.clear()
+            self.connections = 0
+
+    def _make_id(self):
+        return hashlib.sha256(str(next(self._ids)).encode()).hexdigest()
+
+    def create_container(self, name, config):
+        with self.lock:
+            if any(c['name'] == name for c in self.containers.values()):
+                raise Conflict('name {!r} is already in use'.format(name))
+            container = {
+                'Id': self._make_id(), 'name': name, 'config': config,
+                'running': False, 'created': time.time(),
+                'ip_address': '172.17.{}.{}'.format(
+                    len(self.containers) // 250, len(self.containers) % 250)}
+            self.containers[container['Id']] = container
+        self._publish(container, 'create')
+        return container
+
+    def get_container(self, name_or_id):
+        with self.lock:
+            if name_or_id in self.containers:
+                return self.containers[name_or_id]
+            for container in self.containers.values():
+                if (container['name'] == name_or_id or
+                        container['Id'].startswith(name_or_id)):
+                    return container
+        raise NotFound('container ' + name_or_id)
+
+    def get_listing(self, container):
+        config = container['config']
+        return {
+            'Id': container['Id'], 'Names': ['/' + container['name']],
+            'Image': config.get('Image'), 'Labels': config.get('Labels') or {},
+            'Command': ' '.join(config.get('Cmd') or []),
+            'Created': int(container['created']), 'Ports': [],
+            'Status': 'Up 1 second' if container['running'] else
+                      'Exited (0) 1 second ago'}
+
+    def matches(self, container, filters):
+        '''Whether 'container' matches the filters docker-py sends, where
+        each filter is a list of values of which any may match.
+        '''
+        labels = container['config'].get('Labels') or {}
+        for key, values in filters.items():
+            if key == 'label':
+                if not any(
+                        '{}={}'.format(*item) in values or item[0] in values
+                        for item in labels.items()):
+                    return False
+            elif key == 'name':
+                if not any(
+                        re.search(value, '/' + container['name'])
+                        for value in values):
+                    return False
+            elif key == 'container':
+                if not any(
+                        value in (container['name'], container['Id'])
+                        for value in values):
+                    return False
+            elif key == 'id':
+                if not any(container['Id'].startswith(v) for v in values):
+                    return False
+        return True
+
+    def find_containers(self, filters):
+        with self.lock:
+            containers = list(self.containers.values())
+        return [c for c in containers if self.matches(c, filters)]
+
+    def set_running(self, container, running):
+        with self.lock:
+            changed = container['running'] != running
+            container['running'] = running
+        if changed:
+            self._publish(container, 'start' if running else 'die')
+
+    def remove_container(self, container):
+        with self.lock:
+            if container['running']:
+                raise Conflict('container {} is running'.format(
+                    container['name']))
+            self.containers.pop(container['Id'], None)
+        self._publish(container, 'destroy')
+
+    def build_image(self, tag, context):
+        image = {
+            'Id': self._make_id(), 'RepoTags': [tag], 'RepoDigests': [],
+            'Size': len(context)}
+        with self.lock:
+            self.images[tag] = image
+        return image['Id']
+
+    def get_image(self, name):
+        with self.lock:
+            for candidate in name, name + ':latest':
+                if candidate in self.images:
+                    return self.images[candidate]
+        raise NotFound('image ' + name)
+
+    def subscribe(self):
+        events = Queue()
+        with self.lock:
+            self._subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            self._subscribers.remove(events)
+
+    def _publish(self, container, action):
+        event = {
+            'container': container,
+            'event': {'status': action, 'id': container['Id'],
+                      'from': container['config'].get('Image'),
+                      'time': int(time.time())}}
+        with self.lock:
+            for events in self._subscribers:
+                events.put(event)
+
+
+def parse_latency(value):
+    ''':returns: mapping of endpoint to seconds from 'ENDPOINT=S,...'.'''
+    latency = {}
+    for item in filter(None, value.split(',')):
+        endpoint, _, seconds = item.partition('=')
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(
+                'unknown endpoint {!r}, not one of {}'.format(
+                    endpoint, ', '.join(ENDPOINTS)))
+        latency[endpoint] = float(seconds)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('socket')
+    parser.add_argument('--latency', type=parse_latency, default={})
+    parser.add_argument('--log-lines', type=int, default=10)
+    args = parser.parse_args()
+
+    server = FakeDocker(args.socket, args.latency, args.log_lines)
+    print('serving on {}; DOCKER_HOST={}'.format(
+        args.socket, server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(', '.join(
+            '{} {}'.format(count, endpoint)
+            for endpoint, count in sorted(server.calls.items())))
+
+
+if __name__ == '__main__':
+    main()
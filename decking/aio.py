@@ -0,0 +1,463 @@
+'''Asyncio counterparts of decking's cluster operations. These talk to the
+Docker daemon over its unix socket directly, so that many container operations
+and log streams can share a single event loop rather than each needing a
+thread.
+
+Requires Python 3.6 or later.
+'''
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+
+from decking.components import OperationError, STOP_TIMEOUT
+from decking.terminal import term
+from decking.util import LogStreamDecoder
+
+DEFAULT_SOCKET_PATH = '/var/run/docker.sock'
+
+
+class APIError(RuntimeError):
+    def __init__(self, status, message):
+        super(APIError, self).__init__('{} {}'.format(status, message))
+        self.status = status
+
+
+def _get_socket_path():
+    docker_host = os.environ.get('DOCKER_HOST', '')
+    if docker_host.startswith('unix://'):
+        return docker_host[len('unix://'):]
+    elif docker_host:
+        raise ValueError(
+            'Only unix socket Docker hosts are supported, not {!r}'.format(
+                docker_host))
+    return DEFAULT_SOCKET_PATH
+
+
+class _Response(object):
+    def __init__(self, status, headers, reader, writer):
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+
+    async def iter_chunks(self):
+        '''Yields the body of the response as it arrives.'''
+        reader = self._reader
+        try:
+            encoding = self.headers.get('transfer-encoding', '')
+            if encoding.lower() == 'chunked':
+                while True:
+                    size_line = await reader.readline()
+                    if not size_line:
+                        break
+                    size = int(size_line.split(b';', 1)[0], 16)
+                    if not size:
+                        break
+                    chunk = await reader.readexactly(size)
+                    await reader.readline()
+                    yield chunk
+            elif 'content-length' in self.headers:
+                remaining = int(self.headers['content-length'])
+                while remaining:
+                    chunk = await reader.read(min(remaining, 2 ** 16))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+            else:
+                while True:
+                    chunk = await reader.read(2 ** 16)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            self.close()
+
+    async def read(self):
+        return b''.join([chunk async for chunk in self.iter_chunks()])
+
+    def close(self):
+        self._writer.close()
+
+
+class AsyncDockerClient(object):
+    '''A minimal Docker Engine API client, covering the calls decking makes
+    to manage containers.
+
+    :parameter limit: the maximum number of requests to have in flight at
+        once, not counting log streams.
+    '''
+    def __init__(self, socket_path=None, version='1.19', limit=64):
+        self.socket_path = socket_path or _get_socket_path()
+        self.version = version
+        self._limit = limit
+        self._semaphore = None
+
+    async def _open(self, method, path, params=None, body=None):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        url = '/v{}{}'.format(self.version, path)
+        if params:
+            url += '?' + urlencode(params)
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        request = [
+            '{} {} HTTP/1.1'.format(method, url),
+            'Host: docker',
+            'Connection: close',
+            'Content-Length: {}'.format(len(data))]
+        if body is not None:
+            request.append('Content-Type: application/json')
+        writer.write(
+            ('\r\n'.join(request) + '\r\n\r\n').encode('latin-1') + data)
+
+        status_line = await reader.readline()
+        try:
+            status = int(status_line.split(None, 2)[1])
+        except (IndexError, ValueError):
+            writer.close()
+            raise APIError(0, 'bad response {!r}'.format(status_line))
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        response = _Response(status, headers, reader, writer)
+        if status >= 400:
+            message = await response.read()
+            raise APIError(status, message.decode('utf-8', 'replace').strip())
+        return response
+
+    async def _call(self, method, path, params=None, body=None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._limit)
+        async with self._semaphore:
+            response = await self._open(method, path, params, body)
+            data = await response.read()
+        if data.strip():
+            return json.loads(data.decode('utf-8'))
+
+    @staticmethod
+    def _container_path(container, action=''):
+        return '/containers/{}{}'.format(quote(container, safe=''), action)
+
+    async def containers(self, all=False, filters=None):
+        params = {'all': int(all), 'limit': -1}
+        if filters:
+            params['filters'] = json.dumps({
+                k: v if isinstance(v, list) else [v]
+                for k, v in filters.items()})
+        return await self._call('GET', '/containers/json', params)
+
+    async def create_container(
+            self, image, name, environment, ports, labels=None):
+        body = {
+            'Image': image,
+            'Env': ['{}={}'.format(k, v) for k, v in environment.items()],
+            'ExposedPorts': {
+                _format_port(port): {} for port in ports},
+            'Labels': labels or {}}
+        return await self._call(
+            'POST', '/containers/create', {'name': name}, body)
+
+    async def start(
+            self, container, binds, links, port_bindings, privileged,
+            network_mode):
+        body = {
+            'Binds': [
+                '{}:{}:{}'.format(
+                    local_path, bind['bind'], 'ro' if bind['ro'] else 'rw')
+                for local_path, bind in binds.items()],
+            'Links': [
+                '{}:{}'.format(name, alias) for name, alias in links.items()],
+            'PortBindings': {
+                _format_port(port): [{'HostIp': '', 'HostPort': str(host)}]
+                for port, host in port_bindings.items()},
+            'Privileged': bool(privileged),
+            'NetworkMode': network_mode or ''}
+        await self._call(
+            'POST', self._container_path(container, '/start'), body=body)
+
+    async def stop(self, container, timeout=STOP_TIMEOUT):
+        await self._call(
+            'POST', self._container_path(container, '/stop'), {'t': timeout})
+
+    async def remove_container(self, container):
+        await self._call('DELETE', self._container_path(container))
+
+    async def inspect_container(self, container):
+        return await self._call(
+            'GET', self._container_path(container, '/json'))
+
+    async def logs(self, container, follow=True, tail='all',
+                   multiplexed=True):
+        '''Yields lines of the container's combined stdout and stderr.'''
+        response = await self._open(
+            'GET', self._container_path(container, '/logs'),
+            {'stdout': 1, 'stderr': 1, 'follow': int(follow), 'tail': tail})
+        decoder = LogStreamDecoder(multiplexed)
+        async for chunk in response.iter_chunks():
+            for line in decoder.feed(chunk):
+                yield line
+        for line in decoder.flush():
+            yield line
+
+
+def _format_port(port):
+    port = str(port)
+    return port if '/' in port else port + '/tcp'
+
+
+class AsyncCluster(object):
+    '''Performs the operations of a :class:`decking.components.Cluster` on an
+    event loop, processing containers concurrently as their dependencies
+    allow.
+    '''
+    def __init__(self, cluster, client):
+        self.cluster = cluster
+        self._client = client
+        self._readiness_executor = None
+
+    @property
+    def name(self):
+        return self.cluster.name
+
+    async def _do_by_dependency(self, func):
+        '''As :meth:`decking.components.Cluster._do_by_dependency`, but
+        calling coroutine function 'func', with every container's task waiting
+        only on the tasks of the containers it depends on.
+        '''
+        processed = []
+        errors = OrderedDict()
+
+        async def process(container, dependency_tasks):
+            for dependency, task in dependency_tasks:
+                if not await task:
+                    errors[container] = RuntimeError(
+                        'dependency {!r} failed'.format(dependency.name))
+                    return False
+            try:
+                await func(container)
+            except Exception as e:
+                errors[container] = e
+                return False
+            processed.append(container)
+            return True
+
+        tasks = OrderedDict()
+        for container in self.cluster:
+            tasks[container] = asyncio.ensure_future(process(
+                container,
+                [(dependency, tasks[dependency])
+                 for dependency in container.dependencies]))
+        await asyncio.gather(*tasks.values())
+        if errors:
+            raise OperationError(errors)
+        return processed
+
+    async def _do_by_level(self, func, reverse=False):
+        '''As :meth:`decking.components.Cluster._do_by_level`, but calling
+        coroutine function 'func'.
+        '''
+        levels = list(self.cluster._iter_levels())
+        if reverse:
+            levels.reverse()
+        processed = []
+        errors = OrderedDict()
+        for level in levels:
+            results = await asyncio.gather(
+                *[func(container) for container in level],
+                return_exceptions=True)
+            for container, result in zip(level, results):
+                if isinstance(result, Exception):
+                    errors[container] = result
+                else:
+                    processed.append(container)
+            if errors and not reverse:
+                break
+        if errors:
+            raise OperationError(errors)
+        return processed
+
+    async def _create(self, container):
+        if container.created:
+            term.print_step('{!r} is already created ({})'.format(
+                container.name, container.id))
+        else:
+            container._docker_container_info = (
+                await self._client.create_container(
+                    container.image.name,
+                    **container._get_create_options(
+                        self.cluster.group, self.cluster.name)))
+            term.print_step('created container {!r} ({})'.format(
+                container.name, container.id))
+
+    async def _start(self, container):
+        term.print_step('starting container {!r} ({})...'.format(
+            container.name, container.id))
+        await self._client.start(
+            container.id,
+            **container._get_start_options(self.cluster.group))
+        if container.readiness_check:
+            # Probes block, but this only holds up the container's dependents:
+            await asyncio.get_event_loop().run_in_executor(
+                self._readiness_executor, container.wait_until_ready)
+
+    async def _run(self, container):
+        await self._create(container)
+        await self._start(container)
+
+    async def _do_with_readiness_checks(self, func):
+        '''Calls :meth:`_do_by_dependency` with an executor that has a thread
+        for every container with a readiness check. Each check may spend a
+        long time polling, so sharing the loop's default executor, with its
+        limited workers, could hold them up behind each other.
+        '''
+        checked = [c for c in self.cluster.containers if c.readiness_check]
+        self._readiness_executor = ThreadPoolExecutor(max(len(checked), 1))
+        try:
+            return await self._do_by_dependency(func)
+        finally:
+            self._readiness_executor.shutdown(wait=False)
+            self._readiness_executor = None
+
+    async def create(self):
+        return await self._do_by_dependency(self._create)
+
+    async def start(self):
+        return await self._do_with_readiness_checks(self._start)
+
+    async def run(self):
+        return await self._do_with_readiness_checks(self._run)
+
+    async def stop(self, timeout=STOP_TIMEOUT):
+        async def stop(container):
+            term.print_step('stopping container {!r} ({})...'.format(
+                container.name, container.id))
+            await self._client.stop(container.id, timeout)
+        return await self._do_by_level(stop, reverse=True)
+
+    async def remove(self):
+        async def remove(container):
+            term.print_step('removing container {!r} ({})...'.format(
+                container.name, container.id))
+            await self._client.remove_container(container.id)
+        return await self._do_by_level(remove, reverse=True)
+
+    async def inspect(self):
+        '''Returns a mapping of each created container to its full
+        description from the Docker daemon.
+        '''
+        containers = [c for c in self.cluster.containers if c.created]
+        infos = await asyncio.gather(
+            *[self._client.inspect_container(c.id) for c in containers])
+        return OrderedDict(zip(containers, infos))
+
+    async def attach(self, term=term, tail=0):
+        '''Follows the logs of every container in the cluster until they have
+        all stopped, using a single event loop for all of the streams.
+        '''
+        current_container = [None]
+
+        async def follow(container):
+            async for line in self._client.logs(container.name, tail=tail):
+                if container.name != current_container[0]:
+                    current_container[0] = container.name
+                    term.print_step(container.name)
+                term.print_line(line.strip())
+            term.print_warning('{}: detached'.format(container.name))
+
+        await asyncio.gather(
+            *[follow(container) for container in self.cluster])
+        term.print_warning('All containers detached')
+
+
+class AsyncDecking(object):
+    '''Runs the cluster operations of a :class:`decking.runner.Decking` using
+    an :class:`AsyncDockerClient`.
+    '''
+    operations = 'create', 'start', 'run', 'stop', 'remove', 'status', 'attach'
+
+    def __init__(self, decking, client=None):
+        self.decking = decking
+        self.client = client or AsyncDockerClient()
+
+    async def _get_cluster(self, name):
+        cluster = self.decking.clusters[name]
+        await self.refresh(cluster.containers)
+        return AsyncCluster(cluster, self.client)
+
+    async def refresh(self, containers=None):
+        '''Updates the given containers (by default all of ours) with their
+        live state, looking them up by label then name as
+        :class:`decking.runner.Decking` does.
+        '''
+        decking = self.decking
+        if containers is None:
+            containers = list(decking.containers.values())
+        found = decking._update_container_info(
+            await self.client.containers(
+                all=True, filters=decking._get_project_filters()),
+            containers)
+        missing = [
+            container for container in containers if container not in found]
+        if missing:
+            decking._update_container_info(
+                await self.client.containers(
+                    all=True, filters=decking._get_name_filters(missing)),
+                missing)
+        decking._discovered.update(container.name for container in containers)
+
+    async def _warn_not_created(self, operation, coroutine):
+        try:
+            return await coroutine
+        except OperationError as error:
+            errors = self.decking._handle_not_created(operation, error)
+            if errors:
+                raise OperationError(errors)
+
+    async def create(self, name):
+        cluster = await self._get_cluster(name)
+        return await cluster.create()
+
+    async def start(self, name):
+        cluster = await self._get_cluster(name)
+        return await cluster.start()
+
+    async def run(self, name):
+        cluster = await self._get_cluster(name)
+        return await cluster.run()
+
+    async def stop(self, name, timeout=STOP_TIMEOUT):
+        cluster = await self._get_cluster(name)
+        return await self._warn_not_created('stopped', cluster.stop(timeout))
+
+    async def remove(self, name):
+        cluster = await self._get_cluster(name)
+        return await self._warn_not_created('removed', cluster.remove())
+
+    async def status(self, name):
+        await self._get_cluster(name)
+        return self.decking.status(name)
+
+    async def attach(self, name, term=term):
+        cluster = await self._get_cluster(name)
+        return await cluster.attach(term)
+
+
+def run_operation(decking, operation, cluster_name):
+    '''Runs the named cluster operation to completion on a new event loop.'''
+    if operation not in AsyncDecking.operations:
+        raise ValueError(
+            'Operation {!r} not supported by the asyncio engine'.format(
+                operation))
+    engine = AsyncDecking(decking)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            getattr(engine, operation)(cluster_name))
+    finally:
+        loop.close()
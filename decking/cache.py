@@ -0,0 +1,106 @@
+'''Caches the validated configuration read from decking files, so that we
+only parse and validate a file again when its content changes, along with
+the helpers decking's other caches share.
+'''
+import hashlib
+import json
+import marshal
+import os
+import sys
+import tempfile
+
+from decking.schema import schema
+
+# Atomically replaces any existing file, where available:
+_replace = getattr(os, 'replace', os.rename)
+
+# Files modified this recently may be modified again within the resolution
+# of their modification time, so caches keyed by stat information shouldn't
+# trust it for them:
+RACY_SECONDS = 2
+
+
+def get_cache_directory():
+    ''':returns: the directory in which decking keeps its caches.'''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.environ.get('DECKING_CACHE_DIR') or os.path.join(
+        cache_home, 'decking')
+
+
+def save_json(path, data):
+    '''Writes 'data' to the JSON file at 'path', atomically replacing any
+    existing file. We don't complain if we can't, since whatever is cached
+    there can always be worked out again.
+    '''
+    temp_path = None
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(data, temp_file)
+        _replace(temp_path, path)
+    except (IOError, OSError):
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class ConfigCache(object):
+    '''Stores validated configuration in marshal's binary format, which is
+    much quicker to load than parsing and validating the original file. Each
+    file's entry records a digest of the file's content and of the schema it
+    was validated against, so that changing either invalidates it.
+
+    :parameter directory: where to keep the cache, defaulting to
+        $DECKING_CACHE_DIR, or 'decking' in the user's cache directory.
+    '''
+    def __init__(self, directory=None):
+        self.directory = directory or get_cache_directory()
+
+    def _get_path(self, filename):
+        # marshal's format varies between Python versions:
+        path_digest = hashlib.sha1(
+            os.path.abspath(filename).encode('utf-8')).hexdigest()
+        name = 'config-{}-py{}{}.marshal'.format(
+            path_digest, *sys.version_info[:2])
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def get_digest(content):
+        ''':returns: the digest identifying configuration file 'content'
+            (bytes) validated against the current schema.
+        '''
+        digest = hashlib.sha256(marshal.dumps(schema))
+        digest.update(content)
+        return digest.hexdigest()
+
+    def get(self, filename, digest):
+        ''':returns: the cached configuration for the named file, or None
+            if we don't have any for content with the given digest.
+        '''
+        try:
+            with open(self._get_path(filename), 'rb') as cache_file:
+                entry = marshal.load(cache_file)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if isinstance(entry, dict) and entry.get('digest') == digest:
+            return entry['config']
+
+    def put(self, filename, digest, config):
+        '''Caches the validated configuration read from the named file. We
+        don't complain if we can't, since we can always parse the file again.
+        '''
+        temp_path = None
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as temp_file:
+                marshal.dump({'digest': digest, 'config': config}, temp_file)
+            _replace(temp_path, self._get_path(filename))
+        except (IOError, OSError, ValueError):
+            # ValueError if the configuration holds something marshal can't
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -1,22 +1,54 @@
+from collections import Counter, OrderedDict
 from functools import wraps
+from operator import attrgetter
+import hashlib
+import json
 import os
 import docker
 import threading
-try:
-    from queue import Queue
-except ImportError:
-    from Queue import Queue
+import time
 
+from decking.context import iter_context_tar
+from decking.dockerfile import parse_dockerfile
+from decking.registry import split_tag
+from decking.logs import (
+    END_OF_STREAM, BLOCK, DROP_OLDEST, LogBuffer, LogMultiplexer)
 from decking.terminal import term
-from decking.util import consume_stream, iter_dependencies
+from decking.tracing import traced
+from decking.util import (
+    consume_stream, iter_dependencies, iter_dependency_levels, make_pool,
+    call_concurrently, call_by_dependency)
 
-END_OF_STREAM = object()
+# Seconds to wait for a container to stop before killing it. This must be
+# smaller than our client's socket read timeout:
+STOP_TIMEOUT = 8
+
+# Labels we give the containers we create, so that we can find them again
+# without listing every container on the host:
+PROJECT_LABEL = 'io.decking.project'
+CLUSTER_LABEL = 'io.decking.cluster'
+# The fingerprint of the configuration a container was created from:
+CONFIG_LABEL = 'io.decking.config'
 
 
 class ContainerNotCreatedError(RuntimeError):
     pass
 
 
+class OperationError(RuntimeError):
+    '''Raised when an operation fails for one or more of the objects it was
+    applied to.
+
+    :parameter errors: mapping of each object that failed to the exception it
+        raised.
+    '''
+    def __init__(self, errors):
+        super(OperationError, self).__init__('; '.join(
+            '{}: {}'.format(getattr(obj, 'name', obj), error)
+            for obj, error in errors.items()))
+        self.errors = errors
+
+
 class Named(object):
     def __init__(self, name):
         self.name = name
@@ -26,10 +58,15 @@ class Named(object):
 
 
 class Image(Named):
-    def __init__(self, docker_client, name, path):
+    '''
+    :parameter dockerfile_cache: optional :class:`DockerfileCache` with
+        which to remember the dependencies in this image's Dockerfile.
+    '''
+    def __init__(self, docker_client, name, path, dockerfile_cache=None):
         super(Image, self).__init__(name)
         self._docker_client = docker_client
         self.path = path
+        self._dockerfile_cache = dockerfile_cache
         self._dependencies = None
 
     @property
@@ -39,52 +76,111 @@ class Image(Named):
             self._dependencies = self._parse_dockerfile(path)
         return self._dependencies
 
-    @staticmethod
-    def _parse_dockerfile(path):
-        '''Parses this Image's Dockerfile in order to return any dependency
-        on another image it may have.
+    def _parse_dockerfile(self, path):
+        '''Parses this Image's Dockerfile in order to return every other
+        image it is built from.
         '''
-        with open(path) as docker_file:
-            for line in docker_file:
-                if line.upper().startswith('FROM'):
-                    dependency = line.split(None, 1)[1].strip()
-                    return [dependency]
-            else:
-                return []
+        if self._dockerfile_cache is not None:
+            return self._dockerfile_cache.get_dependencies(path)
+        return parse_dockerfile(path)
 
-    def build(self):
+    @traced
+    def build(self, term=term, build_index=None, force=False, compress=False):
+        '''Builds this image, unless 'build_index' shows that it was last
+        built from the same context and 'force' isn't set. The context is
+        streamed to the daemon as it is read, gzipped if 'compress' is set.
+
+        :returns: whether the image was built.
+        '''
+        if build_index is not None:
+            context_hash = build_index.get_context_hash(self)
+            if not force and build_index.is_up_to_date(self, context_hash):
+                term.print_step('image {!r} is up to date'.format(self.name))
+                return False
         term.print_step('building image {!r}...'.format(self.name))
         stream = self._docker_client.build(
-            self.path, tag=self.name, rm=True, forcerm=True)
-        consume_stream(stream)
-
-    def push(self, registry, allow_insecure=False):
+            fileobj=iter_context_tar(self.path, gzip=compress),
+            custom_context=True, encoding='gzip' if compress else None,
+            tag=self.name, rm=True, forcerm=True)
+        consume_stream(stream, term)
+        if build_index is not None:
+            build_index.record(self, context_hash)
+        return True
+
+    def _get_repo_digests(self):
+        ''':returns: list of the 'repository@digest' references Docker has
+            recorded for this image, from pushing or pulling it.
+        '''
+        try:
+            info = self._docker_client.inspect_image(self.name)
+        except docker.errors.APIError:
+            return []
+        return info.get('RepoDigests') or []
+
+    def _is_in_registry(self, registry_client, remote_image_name):
+        '''Whether the registry already holds this image under
+        'remote_image_name', as far as we can tell.
+        '''
+        digest = registry_client.get_digest(self.name)
+        if not digest:
+            return False
+        repository, _ = split_tag(remote_image_name)
+        return '{}@{}'.format(repository, digest) in self._get_repo_digests()
+
+    @traced
+    def push(
+            self, registry, allow_insecure=False, term=term,
+            registry_client=None):
+        '''Pushes this image to 'registry', unless 'registry_client' shows
+        that the registry already holds it.
+
+        :returns: whether the image was pushed.
+        '''
         remote_image_name = '{}/{}'.format(registry, self.name)
+        if registry_client is not None and self._is_in_registry(
+                registry_client, remote_image_name):
+            term.print_step('image {} is up to date'.format(remote_image_name))
+            return False
         self._docker_client.tag(self.name, remote_image_name)
         term.print_step('pushing image {}...'.format(remote_image_name))
         stream = self._docker_client.push(
             remote_image_name,
             insecure_registry=allow_insecure,
             stream=True)
-        consume_stream(stream)
+        consume_stream(stream, term)
         self._docker_client.remove_image(remote_image_name)
+        return True
 
-    def pull(self, registry=None, allow_insecure=False):
+    @traced
+    def pull(
+            self, registry=None, allow_insecure=False, term=term,
+            registry_client=None):
+        '''Pulls this image, from 'registry' if given, unless
+        'registry_client' shows that we already have what the registry
+        holds.
+
+        :returns: whether the image was pulled.
+        '''
         if registry:
             remote_image_name = '{}/{}'.format(registry, self.name)
         else:
             remote_image_name = self.name
 
+        if registry_client is not None and self._is_in_registry(
+                registry_client, remote_image_name):
+            term.print_step('image {} is up to date'.format(remote_image_name))
+            return False
         term.print_step('pulling image {}...'.format(remote_image_name))
         stream = self._docker_client.pull(
             remote_image_name,
             insecure_registry=allow_insecure,
             stream=True)
-        consume_stream(stream)
+        consume_stream(stream, term)
 
         if remote_image_name != self.name:
             self._docker_client.tag(remote_image_name, self.name, force=True)
             self._docker_client.remove_image(remote_image_name)
+        return True
 
 
 class ContainerData(Named):
@@ -116,14 +212,22 @@ def assert_created(method):
 
 class Container(ContainerData):
     def __init__(
-            self, docker_client, name, image, dependencies=None, **kwargs):
+            self, docker_client, name, image, dependencies=None,
+            readiness_check=None, project=None, **kwargs):
         '''
         :parameter dependencies: list of other Container objects defining the
             containers upon which the container defined in this object depends
             to run.
+        :parameter readiness_check: optional
+            :class:`decking.readiness.ReadinessCheck` that must pass once the
+            container has started before it is considered up.
+        :parameter project: optional name of the project the container
+            belongs to, with which we label it when we create it.
         '''
         super(Container, self).__init__(name, image, **kwargs)
         self.dependencies = dependencies or {}
+        self.readiness_check = readiness_check
+        self.project = project
         self._docker_client = docker_client
         self._docker_container_info = None
 
@@ -136,13 +240,18 @@ class Container(ContainerData):
     def id(self):
         return self._docker_container_info['Id'][:12]
 
+    @property
+    def running(self):
+        return self.created and self._docker_container_info.get(
+            'Status', '').startswith('Up')
+
     def _get_group_modified_dict_attribute(self, group, attr_name):
         value = dict(getattr(self, attr_name))
         if group:
             value.update(getattr(group.options, attr_name))
-            for container, group_spec in group.per_container_specs.items():
-                if container is self:
-                    value.update(getattr(group_spec, attr_name))
+            group_spec = group.per_container_specs.get(self)
+            if group_spec is not None:
+                value.update(getattr(group_spec, attr_name))
         return value
 
     @staticmethod
@@ -165,21 +274,66 @@ class Container(ContainerData):
                 new_env[k] = v
         return new_env
 
-    def create(self, group=None):
+    def _get_labels(self, cluster_name=None):
+        labels = {}
+        if self.project:
+            labels[PROJECT_LABEL] = self.project
+        if cluster_name:
+            labels[CLUSTER_LABEL] = cluster_name
+        return labels
+
+    def _get_fingerprint(self, create_options, group):
+        ''':returns: a digest of everything we configure this container with
+            as a member of the given group, given the other options we create
+            it with.
+        '''
+        config = dict(
+            create_options, image=self.image.name,
+            start=self._get_start_options(group))
+        # The order of exposed ports doesn't matter, and isn't stable:
+        config['ports'] = sorted(config['ports'])
+        return hashlib.sha256(json.dumps(
+            config, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _get_create_options(self, group, cluster_name=None):
+        '''Returns the keyword arguments with which to create this container
+        (besides its image name) as a member of the given group and named
+        cluster.
+        '''
+        environment = self._get_group_modified_dict_attribute(
+            group, 'environment')
+        options = dict(
+            name=self.name,
+            environment=self._update_env_from_local_env(environment),
+            ports=list(self.port_bindings.keys()))
+        labels = self._get_labels(cluster_name)
+        labels[CONFIG_LABEL] = self._get_fingerprint(options, group)
+        options['labels'] = labels
+        return options
+
+    def is_up_to_date(self, group=None, cluster_name=None):
+        '''Whether this container exists and was created from its current
+        configuration as a member of the given group and named cluster.
+        '''
+        if not self.created:
+            return False
+        labels = self._docker_container_info.get('Labels') or {}
+        expected = self._get_create_options(group, cluster_name)['labels']
+        return labels.get(CONFIG_LABEL) == expected[CONFIG_LABEL]
+
+    @traced
+    def create(self, group=None, cluster_name=None):
         if self.created:
             term.print_step('{!r} is already created ({})'.format(
                 self.name, self.id))
         else:
-            term.print_step('creating container {!r}...'.format(self.name))
-            environment = self._get_group_modified_dict_attribute(
-                group, 'environment')
-            environment = self._update_env_from_local_env(environment)
             self._docker_container_info = self._docker_client.create_container(
                 self.image.name,
-                name=self.name,
-                environment=environment,
-                ports=list(self.port_bindings.keys()))
-            term.print_line('({})'.format(self.id))
+                **self._get_create_options(group, cluster_name))
+            # Other containers may be being created concurrently, so we give
+            # the name and id together:
+            term.print_step('created container {!r} ({})'.format(
+                self.name, self.id))
 
     @staticmethod
     def _format_volume_bindings(volume_bindings):
@@ -187,14 +341,13 @@ class Container(ContainerData):
             local_path: {'bind': container_path, 'ro': False} for
             local_path, container_path in volume_bindings.items()}
 
-    @assert_created
-    def start(self, group=None):
-        term.print_step('starting container {!r} ({})...'.format(
-            self.name, self.id))
+    def _get_start_options(self, group):
+        '''Returns the keyword arguments with which to start this container as
+        a member of the given group.
+        '''
         volume_bindings = self._format_volume_bindings(
             self._get_group_modified_dict_attribute(group, 'volume_bindings'))
-        self._docker_client.start(
-            self._docker_container_info,
+        return dict(
             binds=volume_bindings,
             links={
                 container.name: alias for container, alias in
@@ -203,16 +356,62 @@ class Container(ContainerData):
             privileged=self.privileged,
             network_mode=self.net)
 
-    def run(self, group=None):
-        self.create(group)
+    @traced
+    @assert_created
+    def start(self, group=None):
+        term.print_step('starting container {!r} ({})...'.format(
+            self.name, self.id))
+        self._docker_client.start(
+            self._docker_container_info, **self._get_start_options(group))
+        self.wait_until_ready()
+
+    @traced
+    def wait_until_ready(self):
+        '''Blocks until our readiness check, if we have one, passes.'''
+        if self.readiness_check:
+            term.print_line(
+                'waiting for {!r} to be ready...'.format(self.name))
+            self.readiness_check.wait(self)
+
+    @property
+    @assert_created
+    def ip_address(self):
+        if self.net == 'host':
+            return '127.0.0.1'
+        info = self._docker_client.inspect_container(self.id)
+        return info['NetworkSettings']['IPAddress'] or '127.0.0.1'
+
+    @assert_created
+    def logs(self, since=None, timestamps=False):
+        '''
+        :parameter since: only return the logs since this many seconds since
+            the epoch.
+        :parameter timestamps: prefix each line with its RFC 3339 timestamp.
+        '''
+        logs = self._docker_client.logs(
+            self.id, stdout=True, stderr=True, since=since,
+            timestamps=timestamps)
+        if isinstance(logs, bytes):
+            logs = logs.decode('utf-8', 'replace')
+        return logs
+
+    @assert_created
+    def execute(self, command):
+        ''':returns: the exit code of 'command' run inside the container.'''
+        exec_id = self._docker_client.exec_create(self.id, command)
+        self._docker_client.exec_start(exec_id)
+        return self._docker_client.exec_inspect(exec_id)['ExitCode']
+
+    def run(self, group=None, cluster_name=None):
+        self.create(group, cluster_name)
         self.start(group)
 
+    @traced
     @assert_created
-    def stop(self):
+    def stop(self, timeout=STOP_TIMEOUT):
         term.print_step('stopping container {!r} ({})...'.format(
             self.name, self.id))
-        # timeout must be smaller than our client's socket read timeout:
-        self._docker_client.stop(self._docker_container_info, timeout=8)
+        self._docker_client.stop(self._docker_container_info, timeout=timeout)
 
     def status(self):
         if self.created:
@@ -237,6 +436,7 @@ class Container(ContainerData):
         else:
             term.print_step("container {!r} isn't created".format(self.name))
 
+    @traced
     @assert_created
     def remove(self):
         term.print_step('removing container {!r} ({})...'.format(
@@ -246,7 +446,18 @@ class Container(ContainerData):
         except docker.errors.APIError as error:
             term.print_error("couldn't remove container {!r} ({})".format(
                 self.name, self.id), str(error))
+        else:
+            self._docker_container_info = None
 
+    def attach_socket(self):
+        ''':returns: a socket streaming the container's stdout and stderr.
+            We never create containers with a TTY, so the stream is always
+            multiplexed.
+        '''
+        return self._docker_client.attach_socket(
+            self.name, params={'stdout': 1, 'stderr': 1, 'stream': 1})
+
+    @traced
     def attach(self, log_queue):
         stdout_stream = self._docker_client.attach(self.name, stream=True)
         thread = threading.Thread(
@@ -285,64 +496,211 @@ class Cluster(Named):
     def __iter__(self):
         return iter_dependencies(self.containers, lambda c: c.dependencies)
 
-    def create(self):
-        for container in self:
-            container.create(self.group)
-
-    def start(self):
-        for container in self:
-            container.start(self.group)
+    def _iter_levels(self):
+        for level in iter_dependency_levels(
+                self.containers, lambda c: c.dependencies):
+            yield sorted(level, key=attrgetter('name'))
 
-    def run(self):
-        for container in self:
-            container.run(self.group)
-
-    def status(self):
-        for container in self:
-            container.status()
+    def _do_by_dependency(self, func, jobs=1):
+        '''Calls 'func' for every container, starting each container as soon
+        as all of the containers it depends on have been processed. Up to
+        'jobs' containers are processed concurrently, prioritising those at
+        the head of the longest chains of dependent containers.
 
-    @staticmethod
-    def _raise_first_error(containers, method_name, *args, **kwargs):
+        :returns: list of the containers that were processed.
+        :raises OperationError: listing every container that failed, or that
+            was skipped because one of its dependencies failed.
+        '''
+        processed, errors = call_by_dependency(
+            func, sorted(self.containers, key=attrgetter('name')),
+            lambda container: container.dependencies, jobs)
+        if errors:
+            raise OperationError(errors)
+        return list(processed)
+
+    def _do_by_level(self, func, jobs=1, reverse=False):
+        '''Calls 'func' for every container, one dependency level at a time,
+        so that all of a container's dependencies have been processed before
+        it is. The containers within a level are processed concurrently using
+        up to 'jobs' threads. If any container fails, we stop after its level,
+        so that nothing is processed before its dependencies.
+
+        :parameter reverse: process dependents before their dependencies
+            instead, e.g. for tearing a cluster down. Then every level is
+            processed, even if some containers fail.
+        :returns: list of the containers that were processed.
+        :raises OperationError: listing every container that failed.
+        '''
+        levels = list(self._iter_levels())
+        if reverse:
+            levels.reverse()
         processed = []
-        errors = []
-        for container in containers:
-            func = getattr(container, method_name)
-            try:
-                func(*args, **kwargs)
-            except Exception as e:
-                errors.append(e)
+        all_errors = OrderedDict()
+        with make_pool(jobs) as pool:
+            for level in levels:
+                results, errors = call_concurrently(pool, func, level)
+                processed.extend(results)
+                all_errors.update(errors)
+                if errors and not reverse:
+                    break
+        if all_errors:
+            raise OperationError(all_errors)
+        return processed
+
+    @traced
+    def create(self, jobs=1):
+        return self._do_by_dependency(
+            lambda container: container.create(self.group, self.name), jobs)
+
+    @traced
+    def start(self, jobs=1):
+        return self._do_by_dependency(
+            lambda container: container.start(self.group), jobs)
+
+    @traced
+    def run(self, jobs=1):
+        return self._do_by_dependency(
+            lambda container: container.run(self.group, self.name), jobs)
+
+    def _get_dependents(self, containers):
+        ''':returns: set of the containers in this cluster that depend on any
+            of 'containers', directly or indirectly.
+        '''
+        dependents = {container: [] for container in self.containers}
+        for container in self.containers:
+            for dependency in container.dependencies:
+                if dependency in dependents:
+                    dependents[dependency].append(container)
+        found = set()
+        to_visit = list(containers)
+        while to_visit:
+            for dependent in dependents[to_visit.pop()]:
+                if dependent not in found:
+                    found.add(dependent)
+                    to_visit.append(dependent)
+        return found
+
+    @traced
+    def converge(self, jobs=1):
+        '''Brings the cluster's containers in line with its configuration.
+        Containers whose configuration has changed since they were created
+        are recreated, along with any containers linked to them, which would
+        otherwise be left linked to the old ones. Missing containers are
+        created, and any that aren't running are started. Everything else is
+        left alone.
+
+        :returns: list of the containers that were created.
+        '''
+        changed = set(
+            container for container in self.containers
+            if not container.is_up_to_date(self.group, self.name))
+        changed |= self._get_dependents(changed)
+        to_remove = set(
+            container for container in changed if container.created)
+        if to_remove:
+            term.print_step('recreating {}...'.format(', '.join(sorted(
+                repr(container.name) for container in to_remove))))
+
+        def remove(container):
+            if container in to_remove:
+                if container.running:
+                    container.stop()
+                container.remove()
+                if container.created:
+                    raise RuntimeError(
+                        "couldn't remove container {!r}".format(
+                            container.name))
+
+        def bring_up(container):
+            if container in changed:
+                container.run(self.group, self.name)
+            elif not container.running:
+                container.start(self.group)
             else:
-                processed.append(container)
-        if errors:
-            raise errors[0]
-        else:
-            return processed
+                term.print_step('{!r} is up to date ({})'.format(
+                    container.name, container.id))
 
-    def stop(self):
-        return self._raise_first_error(reversed(tuple(self)), 'stop')
+        self._do_by_level(remove, jobs, reverse=True)
+        self._do_by_dependency(bring_up, jobs)
+        return sorted(changed, key=attrgetter('name'))
 
-    def remove(self):
-        return self._raise_first_error(reversed(tuple(self)), 'remove')
+    @traced
+    def status(self):
+        for container in self:
+            container.status()
 
-    def _display_logs(self, attached, log_queue, term):
-        current_container = None, None
+    @traced
+    def stop(self, jobs=1, timeout=STOP_TIMEOUT):
+        return self._do_by_level(
+            lambda container: container.stop(timeout), jobs, reverse=True)
+
+    @traced
+    def remove(self, jobs=1):
+        return self._do_by_level(
+            lambda container: container.remove(), jobs, reverse=True)
+
+    def _display_logs(self, attached, log_buffer, term, tick=0.05):
+        '''Displays lines from 'log_buffer' until all the 'attached' containers
+        have detached. Rather than writing each line as it arrives, we write
+        whatever has built up for each container at most once every 'tick'
+        seconds.
+        '''
+        current_container = None
+        reported_dropped = Counter()
         while attached:
-            container, line = log_queue.get(timeout=60 * 60)
-            if line is END_OF_STREAM:
-                attached.remove(container)
-                term.print_warning('{}: detached'.format(container))
-            else:
+            batch, ended, all_dropped = log_buffer.get_batch(timeout=60 * 60)
+            for container, lines in batch:
                 if container != current_container:
                     current_container = container
                     term.print_step(container)
-                term.print_line(line.strip())
+                term.print_lines([line.strip() for line in lines])
+            for container, dropped in all_dropped.items():
+                if dropped > reported_dropped[container]:
+                    term.print_warning('{}: dropped {} lines'.format(
+                        container, dropped - reported_dropped[container]))
+                    reported_dropped[container] = dropped
+            for container in ended:
+                attached.remove(container)
+                term.print_warning('{}: detached'.format(container))
+            if attached:
+                time.sleep(tick)
         term.print_warning('All containers detached')
 
-    def attach(self, term=term):
+    @traced
+    def attach(
+            self, term=term, multiplex=LogMultiplexer.available,
+            max_lines=1000, policy=DROP_OLDEST, metrics=None):
+        '''Displays the output of all the cluster's containers until they have
+        all stopped.
+
+        :parameter multiplex: read every container's stream on a single
+            thread, rather than using a thread per container. This is ignored
+            for the BLOCK policy, since one container filling its buffer
+            would otherwise hold up every other container's stream.
+        :parameter max_lines: the most lines to buffer for each container
+            between writes to the terminal.
+        :parameter policy: the :class:`decking.logs.LogBuffer` policy for
+            lines that arrive when a container's buffer is full.
+        :parameter metrics: optional :class:`decking.metrics.AttachMetrics`
+            to track the session with.
+        '''
         attached = set()
+        log_buffer = LogBuffer(max_lines, policy)
         threads = []
-        log_queue = Queue()
-        for container in self:
-            attached.add(container.name)
-            threads.append(container.attach(log_queue))
-        self._display_logs(attached, log_queue, term)
+        if multiplex and policy != BLOCK:
+            multiplexer = LogMultiplexer(log_buffer)
+            try:
+                for container in self:
+                    attached.add(container.name)
+                    multiplexer.add(container.name, container.attach_socket())
+            except Exception:
+                multiplexer.close()
+                raise
+            threads.append(multiplexer.start())
+        else:
+            for container in self:
+                attached.add(container.name)
+                threads.append(container.attach(log_buffer))
+        if metrics:
+            metrics.track(log_buffer, threads)
+        self._display_logs(attached, log_buffer, term)
@@ -0,0 +1,337 @@
+'''Works out what is in an image's build context, as Docker would send it to
+the daemon, and whether it has changed since the image was last built.
+'''
+import hashlib
+import json
+import os
+import re
+import stat
+import sys
+import tarfile
+import threading
+import time
+import zlib
+
+import docker
+
+from decking.cache import (
+    get_cache_directory, save_json, RACY_SECONDS)
+
+_compiled_patterns = {}
+
+
+def read_dockerignore(path):
+    ''':returns: list of the exclusion patterns in the .dockerignore file of
+        the build context at 'path', normalised as Docker does.
+    '''
+    try:
+        with open(os.path.join(path, '.dockerignore')) as ignore_file:
+            lines = ignore_file.read().splitlines()
+    except IOError:
+        return []
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        exception = line.startswith('!')
+        if exception:
+            line = line[1:].strip()
+        line = os.path.normpath(line).lstrip(os.sep)
+        patterns.append('!' + line if exception else line)
+    return patterns
+
+
+def _compile_pattern(pattern):
+    '''Translates a .dockerignore pattern into a regular expression. As in
+    Go's filepath.Match, which Docker uses, '*' and '?' don't match path
+    separators, but Docker's '**' matches any number of directories.
+    '''
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(.*/)?'
+            i += 3
+            continue
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        elif char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                group = pattern[i + 1:end]
+                if group.startswith('!'):
+                    group = '^' + group[1:]
+                regex += '[' + group.replace('\\', '\\\\') + ']'
+                i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    return re.compile(regex + r'\Z')
+
+
+def is_ignored(relative_path, patterns):
+    '''Whether the file or directory at 'relative_path' within a build context
+    is excluded by the .dockerignore 'patterns'. As with Docker, the last
+    pattern that matches wins, and excluding a directory excludes everything
+    beneath it.
+    '''
+    parts = relative_path.split(os.sep)
+    prefixes = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+    ignored = False
+    for pattern in patterns:
+        exception = pattern.startswith('!')
+        if exception:
+            pattern = pattern[1:]
+        regex = _compiled_patterns.get(pattern)
+        if regex is None:
+            regex = _compiled_patterns[pattern] = _compile_pattern(
+                pattern.replace(os.sep, '/'))
+        if any(regex.match(prefix) for prefix in prefixes):
+            ignored = not exception
+    return ignored
+
+
+def iter_context_files(path):
+    '''Yields the (relative path, absolute path) of every file, symlink and
+    directory in the build context at 'path' that Docker would send, in a
+    consistent order. The Dockerfile and .dockerignore are always sent.
+    '''
+    patterns = read_dockerignore(path)
+    # We can only skip whole ignored directories if no exception could bring
+    # back something beneath them:
+    can_prune = not any(pattern.startswith('!') for pattern in patterns)
+    for directory, dir_names, file_names in os.walk(path):
+        relative_directory = os.path.relpath(directory, path)
+        if relative_directory == os.curdir:
+            relative_directory = ''
+        dir_names.sort()
+        for name in list(dir_names):
+            relative_path = os.path.join(relative_directory, name)
+            if is_ignored(relative_path, patterns):
+                if can_prune:
+                    dir_names.remove(name)
+                continue
+            absolute_path = os.path.join(directory, name)
+            yield relative_path, absolute_path
+            if os.path.islink(absolute_path):
+                # os.walk doesn't follow symlinks, but lists them as
+                # directories:
+                dir_names.remove(name)
+        for name in sorted(file_names):
+            relative_path = os.path.join(relative_directory, name)
+            if (relative_path in ('Dockerfile', '.dockerignore') or
+                    not is_ignored(relative_path, patterns)):
+                yield relative_path, os.path.join(directory, name)
+
+
+# How tar names are encoded; Python 3 represents undecodable file names with
+# surrogates:
+_TAR_ERRORS = 'strict' if sys.version_info.major < 3 else 'surrogateescape'
+
+
+def _get_tar_info(relative_path, absolute_path):
+    ''':returns: the :class:`tarfile.TarInfo` describing the file, directory
+        or symlink at 'absolute_path' for a build context, or None for
+        anything else.
+    '''
+    stat_result = os.lstat(absolute_path)
+    info = tarfile.TarInfo(relative_path.replace(os.sep, '/'))
+    info.mode = stat.S_IMODE(stat_result.st_mode)
+    info.uid = stat_result.st_uid
+    info.gid = stat_result.st_gid
+    info.mtime = int(stat_result.st_mtime)
+    if stat.S_ISREG(stat_result.st_mode):
+        info.size = stat_result.st_size
+    elif stat.S_ISDIR(stat_result.st_mode):
+        info.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(stat_result.st_mode):
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink(absolute_path)
+    else:
+        return None
+    return info
+
+
+def _iter_file_blocks(path, size, chunk_size):
+    '''Yields exactly 'size' bytes of the file at 'path', padded to a whole
+    number of tar blocks, even if the file changes size as we read it.
+    '''
+    remaining = size
+    with open(path, 'rb') as f:
+        while remaining:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    padding = remaining + (-size % tarfile.BLOCKSIZE)
+    if padding:
+        yield tarfile.NUL * padding
+
+
+def _iter_tar(path, chunk_size):
+    for relative_path, absolute_path in iter_context_files(path):
+        info = _get_tar_info(relative_path, absolute_path)
+        if info is None:
+            continue
+        yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', _TAR_ERRORS)
+        if info.isreg():
+            for chunk in _iter_file_blocks(
+                    absolute_path, info.size, chunk_size):
+                yield chunk
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+def iter_context_tar(path, gzip=False, chunk_size=2 ** 16):
+    '''Yields the build context at 'path' as a tar archive, optionally
+    gzipped, in chunks of around 'chunk_size' bytes. Unlike building the
+    archive up front, as docker-py does, this only ever holds a chunk or so
+    in memory, however big the context.
+    '''
+    pending = []
+    pending_size = 0
+    compressor = gzip and zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for data in _iter_tar(path, chunk_size):
+        if compressor:
+            data = compressor.compress(data)
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= chunk_size:
+            yield b''.join(pending)
+            pending = []
+            pending_size = 0
+    if compressor:
+        pending.append(compressor.flush())
+    if pending:
+        yield b''.join(pending)
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildIndex(object):
+    '''A local record of the build context each image was last built from,
+    so that we can skip building images whose contexts haven't changed.
+
+    To avoid rehashing every file in every context each time, we also keep
+    the digest of each file we hash along with its size, modification time
+    and inode, and trust it for as long as those stay the same.
+
+    :parameter path: the file to keep the index in, defaulting to
+        'build-index.json' in decking's cache directory.
+    '''
+    def __init__(self, path=None):
+        self.path = path or os.path.join(
+            get_cache_directory(), 'build-index.json')
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as index_file:
+                index = json.load(index_file)
+        except (IOError, ValueError):
+            index = {}
+        self._files = index.get('files', {})
+        self._images = index.get('images', {})
+        # The files we last found in each context we hashed, so that we can
+        # forget any that have gone:
+        self._context_files = {}
+
+    def _get_file_digest(self, path, stat_result):
+        key = [
+            stat_result.st_size, stat_result.st_mtime, stat_result.st_ino]
+        with self._lock:
+            entry = self._files.get(path)
+        if entry and entry[:3] == key:
+            return entry[3]
+        digest = _hash_file(path)
+        if time.time() - stat_result.st_mtime > RACY_SECONDS:
+            with self._lock:
+                self._files[path] = key + [digest]
+        return digest
+
+    @staticmethod
+    def _get_image_id(image, name):
+        try:
+            return image._docker_client.inspect_image(name)['Id']
+        except docker.errors.APIError:
+            return None
+
+    def get_context_hash(self, image):
+        ''':returns: a digest of everything that goes into building 'image':
+            the paths, permissions and content of its build context, and the
+            ids of the images it is built from.
+        '''
+        digest = hashlib.sha256()
+        seen_files = set()
+        for relative_path, absolute_path in iter_context_files(image.path):
+            seen_files.add(absolute_path)
+            stat_result = os.lstat(absolute_path)
+            mode = stat_result.st_mode
+            if stat.S_ISLNK(mode):
+                content = 'link:' + os.readlink(absolute_path)
+            elif stat.S_ISDIR(mode):
+                content = 'directory'
+            else:
+                content = self._get_file_digest(absolute_path, stat_result)
+            digest.update('{}\0{:o}\0{}\0'.format(
+                relative_path.replace(os.sep, '/'), stat.S_IMODE(mode),
+                content).encode('utf-8'))
+        for dependency in sorted(image.dependencies):
+            digest.update('from\0{}\0{}\0'.format(
+                dependency, self._get_image_id(image, dependency)).encode(
+                    'utf-8'))
+        with self._lock:
+            self._context_files[os.path.join(image.path, '')] = seen_files
+        return digest.hexdigest()
+
+    def is_up_to_date(self, image, context_hash):
+        '''Whether 'image' was last built from a context with the given hash,
+        and is still the image we built then.
+        '''
+        with self._lock:
+            entry = self._images.get(image.name)
+        return bool(
+            entry and entry['context'] == context_hash and
+            entry['id'] == self._get_image_id(image, image.name))
+
+    def record(self, image, context_hash):
+        '''Records that 'image' has just been built from a context with the
+        given hash.
+        '''
+        image_id = self._get_image_id(image, image.name)
+        with self._lock:
+            self._images[image.name] = {
+                'context': context_hash, 'id': image_id}
+
+    def _forget_missing_files(self):
+        seen_files = set().union(*self._context_files.values())
+        for path in list(self._files):
+            if path not in seen_files and any(
+                    path.startswith(context)
+                    for context in self._context_files):
+                del self._files[path]
+
+    def save(self):
+        '''Writes the index to disk.'''
+        with self._lock:
+            self._forget_missing_files()
+            index = {'files': dict(self._files), 'images': dict(self._images)}
+        save_json(self.path, index)
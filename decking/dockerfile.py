@@ -0,0 +1,171 @@
+'''Works out which other images a Dockerfile builds from, following the
+parts of Docker's Dockerfile syntax that affect that: line continuations,
+build stages, `COPY --from` and `ARG` substitution.
+'''
+import json
+import os
+import re
+import threading
+import time
+
+from decking.cache import (
+    get_cache_directory, save_json, RACY_SECONDS)
+
+_DIRECTIVE_PATTERN = re.compile(r'#\s*(\w+)\s*=\s*(\S+)\s*$')
+_VARIABLE_PATTERN = re.compile(
+    r'\$(?:\{(?P<braced>\w+)(?:(?P<operator>:[-+])(?P<word>[^}]*))?\}|'
+    r'(?P<bare>\w+))')
+
+
+def _iter_instructions(content):
+    '''Yields the (upper case instruction, arguments) of each instruction in
+    the Dockerfile 'content', having joined continued lines and skipped
+    comments.
+    '''
+    escape = '\\'
+    lines = content.splitlines()
+    # Parser directives may only come before anything else:
+    for line in lines:
+        match = _DIRECTIVE_PATTERN.match(line)
+        if not match:
+            break
+        if match.group(1).lower() == 'escape':
+            escape = match.group(2)
+    instructions = []
+    instruction = ''
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('#'):
+            continue
+        if stripped.endswith(escape):
+            instruction += stripped[:-len(escape)] + ' '
+            continue
+        instructions.append(instruction + stripped)
+        instruction = ''
+    instructions.append(instruction)
+    for instruction in instructions:
+        parts = instruction.split(None, 1)
+        if parts:
+            yield parts[0].upper(), parts[1] if len(parts) > 1 else ''
+
+
+def _substitute(word, variables):
+    '''Expands references to 'variables' in 'word', as Docker does, with
+    unset variables expanding to nothing.
+    '''
+    def expand(match):
+        name = match.group('braced') or match.group('bare')
+        value = variables.get(name)
+        operator = match.group('operator')
+        if operator == ':-':
+            return value or match.group('word')
+        elif operator == ':+':
+            return match.group('word') if value else ''
+        return value or ''
+    return _VARIABLE_PATTERN.sub(expand, word)
+
+
+def _parse_arg(arguments, variables):
+    ''':returns: the (name, default value) an ARG instruction declares.'''
+    name, _, default = arguments.strip().partition('=')
+    default = _substitute(default.strip(), variables)
+    if len(default) > 1 and default[0] == default[-1] and default[0] in '"\'':
+        default = default[1:-1]
+    return name.strip(), default or None
+
+
+def parse_dependencies(content):
+    ''':returns: list of the images the Dockerfile 'content' builds from, in
+        the order they're first referenced: the base images of every build
+        stage and the sources of `COPY --from`, but not references to the
+        Dockerfile's own stages or to 'scratch'.
+    '''
+    # Only the ARGs declared before the first FROM can be used in FROM
+    # lines. We don't pass build arguments, so they take their defaults:
+    global_args = {}
+    stages = []
+    dependencies = []
+
+    def add(reference):
+        if (reference and reference.lower() != 'scratch' and
+                reference.lower() not in stages and
+                reference not in dependencies):
+            dependencies.append(reference)
+
+    for instruction, arguments in _iter_instructions(content):
+        if instruction == 'ARG' and not stages:
+            name, default = _parse_arg(arguments, global_args)
+            global_args[name] = default
+        elif instruction == 'FROM':
+            words = [
+                word for word in arguments.split()
+                if not word.startswith('--')]
+            if not words:
+                continue
+            add(_substitute(words[0], global_args))
+            if len(words) >= 3 and words[1].upper() == 'AS':
+                stages.append(words[2].lower())
+            else:
+                stages.append(None)
+        elif instruction == 'COPY':
+            for word in arguments.split():
+                if not word.startswith('--'):
+                    break
+                if word.startswith('--from='):
+                    source = word[len('--from='):]
+                    # Stages may also be referred to by their index:
+                    if not source.isdigit():
+                        add(source)
+    return dependencies
+
+
+def parse_dockerfile(path):
+    ''':returns: list of the images the Dockerfile at 'path' builds from.'''
+    with open(path) as docker_file:
+        return parse_dependencies(docker_file.read())
+
+
+class DockerfileCache(object):
+    '''Remembers the dependencies of each Dockerfile we parse between runs,
+    for as long as its size and modification time stay the same.
+
+    :parameter path: the file to keep the cache in, defaulting to
+        'dockerfiles.json' in decking's cache directory.
+    '''
+    def __init__(self, path=None):
+        self.path = path or os.path.join(
+            get_cache_directory(), 'dockerfiles.json')
+        self._lock = threading.Lock()
+        self._changed = False
+        try:
+            with open(self.path) as cache_file:
+                self._entries = json.load(cache_file)
+        except (IOError, ValueError):
+            self._entries = {}
+
+    def get_dependencies(self, path):
+        ''':returns: list of the images the Dockerfile at 'path' builds
+            from.
+        '''
+        path = os.path.abspath(path)
+        stat_result = os.stat(path)
+        key = [stat_result.st_size, stat_result.st_mtime]
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry and entry[:2] == key:
+            return list(entry[2])
+        dependencies = parse_dockerfile(path)
+        if time.time() - stat_result.st_mtime > RACY_SECONDS:
+            with self._lock:
+                self._entries[path] = key + [dependencies]
+                self._changed = True
+        return dependencies
+
+    def save(self):
+        '''Writes the cache to disk, if anything has been added to it.'''
+        with self._lock:
+            if not self._changed:
+                return
+            self._changed = False
+            entries = dict(self._entries)
+        save_json(self.path, entries)
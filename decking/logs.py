@@ -0,0 +1,180 @@
+import threading
+from collections import Counter, OrderedDict, deque
+try:
+    import selectors
+except ImportError:
+    # Python <3.4
+    selectors = None
+
+from decking.util import LogStreamDecoder
+
+END_OF_STREAM = object()
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+SAMPLE = 'sample'
+POLICIES = BLOCK, DROP_OLDEST, SAMPLE
+
+
+def _read(sock, size=2 ** 16):
+    # Depending on the Python version, docker-py gives us either a real socket
+    # or a SocketIO wrapping one:
+    if hasattr(sock, 'recv'):
+        return sock.recv(size)
+    return sock.read(size)
+
+
+class LogMultiplexer(object):
+    '''Reads the attach streams of any number of containers on a single
+    thread, putting ``(name, line)`` tuples onto a queue as lines arrive, and
+    ``(name, END_OF_STREAM)`` when a container's stream ends.
+    '''
+    available = selectors is not None
+
+    def __init__(self, log_queue):
+        self._log_queue = log_queue
+        self._selector = selectors.DefaultSelector()
+        self._thread = None
+
+    def add(self, name, sock, multiplexed=True):
+        self._selector.register(
+            sock, selectors.EVENT_READ,
+            (name, LogStreamDecoder(multiplexed)))
+
+    def _read_ready(self, key):
+        name, decoder = key.data
+        try:
+            data = _read(key.fileobj)
+        except (IOError, OSError):
+            data = b''
+        if data:
+            for line in decoder.feed(data):
+                self._log_queue.put((name, line))
+        else:
+            self._selector.unregister(key.fileobj)
+            key.fileobj.close()
+            for line in decoder.flush():
+                self._log_queue.put((name, line))
+            self._log_queue.put((name, END_OF_STREAM))
+
+    def close(self):
+        '''Stops reading, closing any streams that haven't ended.'''
+        for key in list(self._selector.get_map().values()):
+            self._selector.unregister(key.fileobj)
+            key.fileobj.close()
+        self._selector.close()
+
+    def run(self):
+        '''Reads the streams until they have all ended.'''
+        try:
+            while self._selector.get_map():
+                for key, _ in self._selector.select():
+                    self._read_ready(key)
+        except Exception as error:
+            # Don't leave whatever is displaying the logs waiting for streams
+            # we're no longer reading:
+            for key in list(self._selector.get_map().values()):
+                name, _ = key.data
+                self._log_queue.put(
+                    (name, 'stopped reading logs: {}'.format(error)))
+                self._log_queue.put((name, END_OF_STREAM))
+        finally:
+            self.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+
+class LogBuffer(object):
+    '''A bounded buffer of lines waiting to be displayed for each container,
+    which takes ``(name, line)`` tuples like the queue it replaces.
+
+    :parameter max_lines: the most lines to hold for any one container.
+    :parameter policy: what to do with a line for a container whose buffer is
+        full. BLOCK waits until there is room, which holds up whatever is
+        reading the container's stream, so each stream should be read on its
+        own thread rather than by a :class:`LogMultiplexer`. DROP_OLDEST
+        discards the oldest
+        buffered line. SAMPLE keeps only one in every 'sample_every' lines
+        until there is room again, each of which displaces the oldest line.
+    '''
+    def __init__(self, max_lines=1000, policy=DROP_OLDEST, sample_every=10):
+        if policy not in POLICIES:
+            raise ValueError('Unknown log buffer policy {!r}'.format(policy))
+        if max_lines < 1:
+            raise ValueError('A log buffer must hold at least one line')
+        self.max_lines = max_lines
+        self.policy = policy
+        self.sample_every = sample_every
+        self.dropped = Counter()
+        self.received = Counter()
+        self.received_bytes = Counter()
+        self._condition = threading.Condition()
+        self._buffers = OrderedDict()
+        self._ended = []
+        self._samples = Counter()
+
+    def __len__(self):
+        with self._condition:
+            return sum(len(buffer) for buffer in self._buffers.values())
+
+    def put(self, item):
+        name, line = item
+        with self._condition:
+            if line is END_OF_STREAM:
+                self._ended.append(name)
+                self._condition.notify_all()
+                return
+            self.received[name] += 1
+            self.received_bytes[name] += len(
+                line if isinstance(line, bytes) else line.encode('utf-8'))
+            buffer = self._buffers.setdefault(name, deque())
+            if len(buffer) >= self.max_lines:
+                if self.policy == BLOCK:
+                    while len(buffer) >= self.max_lines:
+                        self._condition.wait()
+                        buffer = self._buffers.setdefault(name, deque())
+                else:
+                    self.dropped[name] += 1
+                    if self.policy == SAMPLE:
+                        self._samples[name] += 1
+                        if self._samples[name] % self.sample_every:
+                            return
+                    buffer.popleft()
+            else:
+                self._samples[name] = 0
+            buffer.append(line)
+            self._condition.notify_all()
+
+    def get_batch(self, timeout=None):
+        '''Waits until there is something to display, then takes everything
+        that's buffered.
+
+        :returns: tuple of (batch, ended, dropped), where 'batch' is a list of
+            (name, lines) tuples for the containers with new lines, 'ended'
+            lists the containers whose streams ended after those lines, and
+            'dropped' is a snapshot of the :attr:`dropped` counts.
+        '''
+        with self._condition:
+            if not self._buffers and not self._ended:
+                self._condition.wait(timeout)
+            batch = list(self._buffers.items())
+            ended = self._ended
+            dropped = Counter(self.dropped)
+            self._buffers = OrderedDict()
+            self._ended = []
+            self._condition.notify_all()
+        return [(name, list(lines)) for name, lines in batch], ended, dropped
+
+    def get_counts(self):
+        ''':returns: tuple of snapshots of the (:attr:`received`,
+            :attr:`received_bytes`, :attr:`dropped`) counts for each
+            container.
+        '''
+        with self._condition:
+            return (
+                Counter(self.received), Counter(self.received_bytes),
+                Counter(self.dropped))
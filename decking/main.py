@@ -1,9 +1,9 @@
 """
 Usage:
     decking help
-    decking build WHAT [--no-cache] [--config=CONFIG] [--debug]
-    decking (push | pull) WHAT [REGISTRY] [--config=CONFIG] [--debug] [--allow-insecure]
-    decking OPERATION CLUSTER [--config=CONFIG] [--debug]
+    decking build WHAT [--no-cache] [--force] [--compress] [--config=CONFIG] [--debug] [--jobs=JOBS] [--profile=FILE]
+    decking (push | pull) WHAT [REGISTRY] [--config=CONFIG] [--debug] [--allow-insecure] [--jobs=JOBS] [--profile=FILE]
+    decking OPERATION CLUSTER [--config=CONFIG] [--debug] [--jobs=JOBS] [--async] [--log-buffer=LINES] [--log-policy=POLICY] [--metrics-port=PORT] [--metrics-file=FILE] [--metrics-interval=SECONDS] [--profile=FILE]
 
 decking image operations:
     WHAT            The image name found in the decking definition file,
@@ -11,6 +11,10 @@ decking image operations:
                     To reference all images provide the literal string
                     'all'.
     --no-cache      Prevents Docker using cached layers during the build.
+    --force         Build images even if their build context hasn't changed
+                    since they were last built.
+    --compress      Gzip build contexts on their way to the Docker daemon,
+                    which helps when it is remote.
     REGISTRY        The url of the registry used for the operation.
 
 decking cluster operations:
@@ -25,8 +29,8 @@ decking cluster operations:
                     start - Starts all the containers in a given cluster. Safe
                         to run multiple times; it will only start containers
                         which aren't already running. Ensures that any
-                        dependencies are always started before their dependent
-                        services.
+                        dependencies are always started, and pass any 'ready'
+                        checks they define, before their dependent services.
                     stop - Stops all the containers in a given cluster. Safe
                         to run multiple times; it will only stop containers
                         which are currently running.
@@ -46,6 +50,41 @@ decking cluster operations:
                         container is restarted.
                     build - build the images associated to the cluster.
                     run - Create and start the containers for a given cluster.
+                    converge - Brings a cluster in line with the decking
+                        definition file. Containers whose configuration,
+                        including group overrides, has changed since they
+                        were created are recreated, along with any containers
+                        that depend on them. Missing containers are created,
+                        stopped ones are started, and the rest are left
+                        alone.
+    --async         Perform the operation on a single asyncio event loop,
+                    talking to the Docker daemon over its unix socket, rather
+                    than with a thread per concurrent container or stream.
+                    Containers are processed as soon as their dependencies
+                    allow, so --jobs doesn't apply. Supports create, start,
+                    run, stop, remove, status and attach, and needs Python
+                    3.6 or later.
+    --log-buffer=LINES
+                    For attach, the most lines to buffer for each container
+                    between writes to the terminal. [default: 1000]
+    --log-policy=POLICY
+                    For attach, what to do with lines from a container whose
+                    buffer is full: 'block' its stream until there is room,
+                    'drop-oldest' buffered lines, or 'sample' one in every
+                    ten new lines. [default: drop-oldest]
+    --metrics-port=PORT
+                    For attach, serve metrics on how the session is coping
+                    at http://127.0.0.1:PORT/metrics, in Prometheus' text
+                    format, and at /metrics.json: the lines and bytes per
+                    second from each container, the lines waiting to be
+                    displayed and those dropped, reconnections to the Docker
+                    daemon and the threads reading container streams.
+    --metrics-file=FILE
+                    For attach, append the same metrics to FILE as a line
+                    of JSON every interval.
+    --metrics-interval=SECONDS
+                    How often to sample metrics, over which rates are
+                    measured. [default: 10]
 
 Global options:
     --allow-insecure
@@ -53,24 +92,45 @@ Global options:
                     only https.
 
     --config=CONFIG Define the file to read the decking definition
-                    from. JSON and YAML formats are supported.
-                    [default: decking.json]
+                    from. JSON and YAML formats are supported. Once read
+                    and validated, the definition is cached in
+                    $DECKING_CACHE_DIR (by default ~/.cache/decking) until
+                    the file changes. [default: decking.json]
 
     --debug         Enable debugging information.
 
+    --jobs=JOBS     The number of containers or images to operate on
+                    concurrently. Dependencies are always processed before
+                    the things that depend on them. Concurrent output from
+                    image operations is prefixed with the name of the image
+                    it relates to, and every line of output from container
+                    operations names its container. [default: 1]
+
+    --profile=FILE  Record how long each phase of the operation, and each
+                    call to the Docker daemon, took, from which thread, and
+                    save them to FILE in Chrome's trace event format, for
+                    viewing in chrome://tracing or https://ui.perfetto.dev.
+
 For more detailed help about the format of the decking definition file
 and operation please refer to http://decking.io/
 """
 
 from __future__ import print_function
 
+import json
 import os
 import sys
 import yaml
+from functools import partial
 from docopt import docopt, DocoptExit
 
+from decking.cache import ConfigCache
+from decking.logs import POLICIES
+from decking.metrics import AttachMetrics, MetricsReporter
 from decking.runner import Decking
 from decking.terminal import Terminal
+from decking.tracing import span, start_tracing, stop_tracing
+from decking.transport import DEFAULT_POOL_SIZE
 from decking.schema import ConfigValidator, schema
 
 
@@ -80,16 +140,104 @@ def _validate_config(config_data):
         raise ValueError(str(validator.errors))
 
 
-def _read_config(filename):
+# libyaml's loader is many times faster than the pure Python one, where it's
+# available. Decking files are plain data, so only ever need a safe loader:
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _load_config_data(content):
+    '''Parses the content (bytes) of a JSON or YAML configuration file. YAML
+    is a superset of JSON, but the json module parses it far faster, so we
+    try that first for anything that looks like JSON.
+    '''
+    if content.lstrip()[:1] == b'{':
+        try:
+            return json.loads(content.decode('utf-8'))
+        except ValueError:
+            # Perhaps YAML flow syntax, or invalid, in which case the YAML
+            # parser gives better errors:
+            pass
+    return yaml.load(content, Loader=_YamlLoader)
+
+
+def _read_config(filename, cache=None):
+    '''
+    :parameter cache: optional :class:`decking.cache.ConfigCache` from which
+        to take the validated configuration if the file hasn't changed.
+    '''
     try:
-        with open(filename) as f:
-            config_data = yaml.load(f)
-            _validate_config(config_data)
-            return config_data
+        with open(filename, 'rb') as f:
+            content = f.read()
     except IOError:
         # FIXME: why do we obliterate the message of the original exception?
         raise IOError("Could not open cluster configuration file {}".format(
             filename))
+    if cache:
+        digest = cache.get_digest(content)
+        config_data = cache.get(filename, digest)
+        if config_data is not None:
+            return config_data
+    config_data = _load_config_data(content)
+    _validate_config(config_data)
+    if cache:
+        cache.put(filename, digest, config_data)
+    return config_data
+
+
+def _get_attach_options(opts):
+    try:
+        max_lines = int(opts['--log-buffer'])
+    except ValueError:
+        max_lines = 0
+    if max_lines < 1:
+        raise ValueError('--log-buffer must be a whole number of lines, at '
+                         'least 1, not {!r}'.format(opts['--log-buffer']))
+    policy = opts['--log-policy']
+    if policy not in POLICIES:
+        raise ValueError('--log-policy must be one of {}, not {!r}'.format(
+            ', '.join(POLICIES), policy))
+    return dict(max_lines=max_lines, policy=policy)
+
+
+def _make_metrics_reporter(opts):
+    ''':returns: a :class:`decking.metrics.MetricsReporter` for the metrics
+        options, or None if there are none.
+    '''
+    port, filename = opts['--metrics-port'], opts['--metrics-file']
+    if port is None and filename is None:
+        return None
+    try:
+        interval = float(opts['--metrics-interval'])
+    except ValueError:
+        interval = 0
+    if interval <= 0:
+        raise ValueError(
+            '--metrics-interval must be a positive number of seconds, not '
+            '{!r}'.format(opts['--metrics-interval']))
+    if port is not None:
+        try:
+            port = int(port)
+        except ValueError:
+            raise ValueError(
+                '--metrics-port must be a port number, not {!r}'.format(port))
+    return MetricsReporter(AttachMetrics(), interval, filename, port)
+
+
+def _attach(runner, cluster, opts):
+    reporter = _make_metrics_reporter(opts)
+    if reporter is None:
+        return runner.attach(cluster, **_get_attach_options(opts))
+    with reporter.start():
+        return runner.attach(
+            cluster, metrics=reporter.metrics, **_get_attach_options(opts))
+
+
+def _run_async(runner, command, cluster):
+    if sys.version_info < (3, 6):
+        raise RuntimeError('--async needs Python 3.6 or later')
+    # Only importable on Python 3.6+:
+    from decking.aio import run_operation
+    run_operation(runner, command, cluster)
 
 
 def _not_implemented(*args, **kwargs):
@@ -108,34 +256,49 @@ def main():
         return 0
 
     terminal = Terminal()
+    if opts['--profile']:
+        start_tracing()
 
     try:
         config_filename = os.path.expanduser(opts['--config'])
         base_path = os.path.dirname(config_filename)
-        runner = Decking(_read_config(config_filename), base_path)
+        jobs = int(opts['--jobs'] or 1)
+        with span('read_config', filename=config_filename):
+            config_data = _read_config(config_filename, ConfigCache())
+        with span('Decking.__init__'):
+            runner = Decking(
+                config_data, base_path,
+                pool_size=max(jobs, DEFAULT_POOL_SIZE))
         commands = {
-            'create': runner.create,
-            'start': runner.start,
-            'run': runner.run,
-            'stop': runner.stop,
-            'remove': runner.remove,
+            'create': partial(runner.create, jobs=jobs),
+            'start': partial(runner.start, jobs=jobs),
+            'run': partial(runner.run, jobs=jobs),
+            'converge': partial(runner.converge, jobs=jobs),
+            'stop': partial(runner.stop, jobs=jobs),
+            'remove': partial(runner.remove, jobs=jobs),
             'restart': runner.restart,
             'status': runner.status,
-            'attach': runner.attach,
+            'attach': lambda cluster: _attach(runner, cluster, opts),
         }
 
         if opts['build']:
-            runner.build(opts['WHAT'])
+            runner.build(
+                opts['WHAT'], jobs=jobs, force=opts['--force'],
+                compress=opts['--compress'])
         elif opts['pull'] or opts['push']:
             image = opts['WHAT']
             registry = opts.get('REGISTRY')
             if opts['push']:
-                runner.push(image, registry, opts['--allow-insecure'])
+                runner.push(
+                    image, registry, opts['--allow-insecure'], jobs=jobs)
             elif opts['pull']:
-                runner.pull(image, registry, opts['--allow-insecure'])
+                runner.pull(
+                    image, registry, opts['--allow-insecure'], jobs=jobs)
         else:
             command, cluster = opts['OPERATION'], opts['CLUSTER']
-            if command in commands:
+            if opts['--async']:
+                _run_async(runner, command, cluster)
+            elif command in commands:
                 commands[command](cluster)
             else:
                 raise ValueError(
@@ -150,6 +313,12 @@ def main():
         else:
             terminal.print_error("Operation failed", str(error))
             return 1
+    finally:
+        tracer = stop_tracing()
+        if tracer:
+            tracer.save(opts['--profile'])
+            terminal.print_line(
+                'saved profile to {}'.format(opts['--profile']))
     return 0
 
 if __name__ == '__main__':
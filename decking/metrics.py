@@ -0,0 +1,233 @@
+'''Metrics about how a long running attach session is coping with the output
+of its containers, sampled periodically and written to a file as lines of
+JSON, or served over HTTP in Prometheus' text format and as JSON.
+'''
+import json
+import threading
+import time
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+from decking.terminal import term
+
+
+class AttachMetrics(object):
+    '''Samples the state of an attach session: the lines and bytes received
+    from each container, in total and per second since the previous sample,
+    the lines dropped, the lines waiting to be displayed, how often we have
+    reconnected to the Docker daemon's event stream, and how many threads are
+    consuming container streams.
+    '''
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._log_buffer = None
+        self._threads = []
+        self._state_cache = None
+        self._previous = None
+
+    def track(self, log_buffer=None, threads=(), state_cache=None):
+        '''Adds parts of the attach session to those we sample.
+
+        :parameter log_buffer: the session's :class:`decking.logs.LogBuffer`.
+        :parameter threads: the threads consuming container streams.
+        :parameter state_cache: the session's
+            :class:`decking.state.ContainerStateCache`.
+        '''
+        with self._lock:
+            if log_buffer is not None:
+                self._log_buffer = log_buffer
+            self._threads.extend(threads)
+            if state_cache is not None:
+                self._state_cache = state_cache
+
+    def sample(self):
+        ''':returns: mapping of the current metrics, with rates over the time
+            since the previous sample.
+        '''
+        with self._lock:
+            now = self._clock()
+            if self._log_buffer is not None:
+                lines, sizes, dropped = self._log_buffer.get_counts()
+                queue_depth = len(self._log_buffer)
+            else:
+                lines, sizes, dropped, queue_depth = {}, {}, {}, 0
+            previous_time, previous_lines, previous_sizes = (
+                self._previous or (now, {}, {}))
+            self._previous = now, lines, sizes
+            threads = sum(thread.is_alive() for thread in self._threads)
+            # We connect to the event stream once, then reconnect:
+            resyncs = self._state_cache.resyncs if self._state_cache else 0
+        elapsed = now - previous_time
+        containers = {}
+        for name in set(lines) | set(dropped):
+            containers[name] = {
+                'lines': lines.get(name, 0),
+                'bytes': sizes.get(name, 0),
+                'dropped': dropped.get(name, 0),
+                'lines_per_second': _rate(
+                    lines.get(name, 0) - previous_lines.get(name, 0),
+                    elapsed),
+                'bytes_per_second': _rate(
+                    sizes.get(name, 0) - previous_sizes.get(name, 0),
+                    elapsed),
+            }
+        return {
+            'time': now,
+            'interval': elapsed,
+            'containers': containers,
+            'queue_depth': queue_depth,
+            'dropped': sum(dropped.values()),
+            'reconnects': max(resyncs - 1, 0),
+            'consumer_threads': threads,
+        }
+
+
+def _rate(count, elapsed):
+    return count / float(elapsed) if elapsed > 0 else 0.0
+
+
+# (name, type, help, key in each container's metrics or None for the
+# session's):
+_PROMETHEUS_METRICS = [
+    ('lines_total', 'counter', 'Lines received from the container.',
+     'lines'),
+    ('bytes_total', 'counter', 'Bytes received from the container.',
+     'bytes'),
+    ('lines_per_second', 'gauge',
+     'Lines received per second over the last interval.',
+     'lines_per_second'),
+    ('bytes_per_second', 'gauge',
+     'Bytes received per second over the last interval.',
+     'bytes_per_second'),
+    ('dropped_lines_total', 'counter',
+     'Lines dropped because the buffer was full.', 'dropped'),
+    ('queue_depth', 'gauge', 'Lines waiting to be displayed.', None),
+    ('reconnects_total', 'counter',
+     'Reconnections to the Docker event stream.', None),
+    ('consumer_threads', 'gauge',
+     'Threads consuming container streams.', None),
+]
+
+
+def format_prometheus(sample):
+    ''':returns: 'sample' in Prometheus' text exposition format.'''
+    session = {
+        'queue_depth': sample['queue_depth'],
+        'reconnects_total': sample['reconnects'],
+        'consumer_threads': sample['consumer_threads'],
+    }
+    lines = []
+    for name, metric_type, help_text, key in _PROMETHEUS_METRICS:
+        full_name = 'decking_attach_' + name
+        lines.append('# HELP {} {}'.format(full_name, help_text))
+        lines.append('# TYPE {} {}'.format(full_name, metric_type))
+        if key is None:
+            lines.append('{} {}'.format(full_name, session[name]))
+            continue
+        for container, metrics in sorted(sample['containers'].items()):
+            label = container.replace('\\', '\\\\').replace('"', '\\"')
+            lines.append('{}{{container="{}"}} {}'.format(
+                full_name, label, metrics[key]))
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        sample = self.server.reporter.latest
+        if self.path == '/metrics':
+            body = format_prometheus(sample).encode('utf-8')
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps(sample).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsReporter(object):
+    '''Samples 'metrics' every 'interval' seconds, appending each sample to
+    'filename' as a line of JSON, and serving the latest on 'port' of
+    'host' at /metrics, in Prometheus' text format, and /metrics.json.
+    '''
+    def __init__(
+            self, metrics, interval=10, filename=None, port=None,
+            host='127.0.0.1'):
+        self.metrics = metrics
+        self.interval = interval
+        self.filename = filename
+        self.latest = None
+        self._server = None
+        if port is not None:
+            self._server = _MetricsServer((host, port), _MetricsHandler)
+            self._server.reporter = self
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def address(self):
+        ''':returns: the (host, port) we're serving metrics on, if any.'''
+        if self._server is not None:
+            return self._server.server_address
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _sample(self):
+        self.latest = self.metrics.sample()
+        if self.filename:
+            try:
+                with open(self.filename, 'a') as metrics_file:
+                    metrics_file.write(json.dumps(self.latest) + '\n')
+            except IOError as error:
+                term.print_warning(
+                    "Couldn't write metrics to {}".format(self.filename),
+                    str(error))
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        if self._server is not None:
+            server_thread = threading.Thread(
+                target=self._server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stops sampling, taking a final sample of the session.'''
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._sample()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
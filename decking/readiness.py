@@ -0,0 +1,165 @@
+import calendar
+import re
+import socket
+import time
+try:
+    from http.client import HTTPConnection, HTTPException
+except ImportError:
+    from httplib import HTTPConnection, HTTPException
+
+
+class ContainerNotReadyError(RuntimeError):
+    pass
+
+
+def _split_address(address, container):
+    '''Splits an address of the form '[host:]port[/path]' into its parts. The
+    host defaults to the container's own IP address, which we only look up
+    when we need it.
+    '''
+    address, slash, path = str(address).partition('/')
+    host, _, port = address.rpartition(':')
+    return host or container.ip_address, int(port), slash + path
+
+
+def _parse_timestamp(timestamp):
+    ''':returns: the whole number of seconds since the epoch of one of
+        Docker's RFC 3339 log timestamps.
+    '''
+    return calendar.timegm(time.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+class TcpProbe(object):
+    '''Checks whether a TCP port is accepting connections.
+
+    :parameter address: '[host:]port', where the host defaults to the
+        container's own IP address.
+    '''
+    def __init__(self, address):
+        self.address = address
+
+    def __str__(self):
+        return 'tcp {}'.format(self.address)
+
+    def check(self, container):
+        host, port, _ = _split_address(self.address, container)
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+        except (socket.error, socket.timeout):
+            return False
+        return True
+
+
+class HttpProbe(object):
+    '''Checks whether an HTTP GET gets a successful (2xx) response.
+
+    :parameter address: '[host:]port[/path]', where the host defaults to the
+        container's own IP address.
+    '''
+    def __init__(self, address):
+        self.address = address
+
+    def __str__(self):
+        return 'http {}'.format(self.address)
+
+    def check(self, container):
+        host, port, path = _split_address(self.address, container)
+        connection = HTTPConnection(host, port, timeout=1)
+        try:
+            connection.request('GET', path or '/')
+            return 200 <= connection.getresponse().status < 300
+        except (socket.error, socket.timeout, HTTPException):
+            # Including malformed responses from services still booting
+            return False
+        finally:
+            connection.close()
+
+
+class LogProbe(object):
+    '''Checks whether the container has logged a line matching a regular
+    expression. Each check only fetches the logs since the second of the last
+    line the previous check saw, so that polling a chatty container doesn't
+    get more expensive as its logs grow.
+    '''
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._regex = re.compile(pattern, re.MULTILINE)
+        self._since = {}
+
+    def __str__(self):
+        return 'log {!r}'.format(self.pattern)
+
+    def check(self, container):
+        lines = []
+        timestamp = None
+        logs = container.logs(
+            since=self._since.get(container.name), timestamps=True)
+        for line in logs.splitlines():
+            timestamp, _, line = line.partition(' ')
+            lines.append(line)
+        if timestamp:
+            self._since[container.name] = _parse_timestamp(timestamp)
+        return bool(self._regex.search('\n'.join(lines)))
+
+
+class ExecProbe(object):
+    '''Checks whether a command run inside the container exits successfully.
+    '''
+    def __init__(self, command):
+        self.command = command
+
+    def __str__(self):
+        return 'exec {!r}'.format(self.command)
+
+    def check(self, container):
+        return container.execute(self.command) == 0
+
+
+class ReadinessCheck(object):
+    '''Polls a container's probes, backing off exponentially between
+    attempts, until they all pass.
+
+    :parameter probes: sequence of probe objects, each with a
+        ``check(container)`` method returning whether it passed.
+    :parameter timeout: seconds after which to give up on the container.
+    :parameter interval: seconds to wait after the first failed attempt,
+        doubling after each subsequent failure up to 'max_interval'.
+    '''
+    _probe_types = {
+        'tcp': TcpProbe,
+        'http': HttpProbe,
+        'log': LogProbe,
+        'exec': ExecProbe,
+    }
+
+    def __init__(self, probes, timeout=60, interval=0.1, max_interval=5):
+        self.probes = probes
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+
+    @classmethod
+    def from_config(cls, config):
+        probes = [
+            probe_type(config[name]) for name, probe_type in
+            sorted(cls._probe_types.items()) if name in config]
+        kwargs = {
+            k: config[k] for k in ('timeout', 'interval') if k in config}
+        return cls(probes, **kwargs)
+
+    def wait(self, container, clock=time.time, sleep=time.sleep):
+        deadline = clock() + self.timeout
+        interval = self.interval
+        while True:
+            failing = [
+                probe for probe in self.probes if not probe.check(container)]
+            if not failing:
+                return
+            remaining = deadline - clock()
+            if remaining <= 0:
+                raise ContainerNotReadyError(
+                    '{!r} not ready after {}s: {}'.format(
+                        container.name, self.timeout,
+                        ', '.join(map(str, failing))))
+            sleep(min(interval, remaining))
+            interval = min(interval * 2, self.max_interval)
@@ -0,0 +1,109 @@
+'''Asks Docker registries which image a tag refers to, through the V2 API,
+so that we can tell whether a push or pull would change anything without
+transferring the image.
+'''
+import re
+
+import requests
+
+# Where images named without a registry live:
+DEFAULT_REGISTRY = 'registry-1.docker.io'
+
+# The manifest types the Docker daemon records the digests of:
+_MANIFEST_TYPES = ', '.join([
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.oci.image.index.v1+json',
+])
+
+_CHALLENGE_PARAM_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+
+
+def split_tag(name):
+    ''':returns: the (repository, tag) of image 'name', with the tag
+        defaulting to 'latest'.
+    '''
+    repository, _, tag = name.rpartition(':')
+    if not repository or '/' in tag:
+        # Either there's no tag, or the colon was the registry's port:
+        return name, 'latest'
+    return repository, tag
+
+
+class RegistryClient(object):
+    '''Looks up manifest digests in a registry. Anonymous bearer tokens are
+    fetched when the registry asks for them, as Docker Hub does. Anything
+    else going wrong is taken to mean we don't know what the registry holds.
+
+    :parameter registry: the registry's host, and optionally port, defaulting
+        to Docker Hub.
+    :parameter allow_insecure: whether to fall back to plain HTTP if HTTPS
+        doesn't work.
+    '''
+    def __init__(self, registry=None, allow_insecure=False, timeout=10):
+        self.registry = registry or DEFAULT_REGISTRY
+        self.timeout = timeout
+        self._schemes = ['https', 'http'] if allow_insecure else ['https']
+        self._failed_schemes = set()
+        self._session = requests.Session()
+
+    def _get_repository_path(self, repository):
+        if self.registry == DEFAULT_REGISTRY and '/' not in repository:
+            # Official images:
+            repository = 'library/' + repository
+        return repository
+
+    def _get_token(self, challenge):
+        ''':returns: the bearer token asked for by the WWW-Authenticate
+            'challenge', or None if it isn't a bearer challenge.
+        '''
+        scheme, _, params = challenge.partition(' ')
+        if scheme.lower() != 'bearer':
+            return None
+        params = dict(_CHALLENGE_PARAM_PATTERN.findall(params))
+        realm = params.pop('realm', None)
+        if not realm:
+            return None
+        response = self._session.get(
+            realm, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        return body.get('token') or body.get('access_token')
+
+    def _head_manifest(self, url):
+        headers = {'Accept': _MANIFEST_TYPES}
+        response = self._session.head(
+            url, headers=headers, timeout=self.timeout)
+        if response.status_code == 401:
+            token = self._get_token(
+                response.headers.get('WWW-Authenticate', ''))
+            if token:
+                headers['Authorization'] = 'Bearer ' + token
+                response = self._session.head(
+                    url, headers=headers, timeout=self.timeout)
+        return response
+
+    def get_digest(self, name):
+        ''':returns: the digest of the manifest the registry holds for image
+            'name', given without the registry, or None if it doesn't have
+            one or we can't tell.
+        '''
+        repository, tag = split_tag(name)
+        path = '/v2/{}/manifests/{}'.format(
+            self._get_repository_path(repository), tag)
+        # Don't keep trying a scheme that hasn't worked:
+        schemes = [
+            scheme for scheme in self._schemes
+            if scheme not in self._failed_schemes] or self._schemes
+        for scheme in schemes:
+            url = '{}://{}{}'.format(scheme, self.registry, path)
+            try:
+                response = self._head_manifest(url)
+            except (requests.RequestException, ValueError):
+                self._failed_schemes.add(scheme)
+                continue
+            if response.status_code == 200:
+                return response.headers.get('Docker-Content-Digest')
+            return None
+        return None
@@ -1,11 +1,23 @@
 import docker
 import os
-from collections import Sequence
+import re
+import time
+from collections import OrderedDict, Sequence
 
-from decking.util import undelimit_mapping, iter_dependencies
+from decking.util import (
+    undelimit_mapping, iter_dependencies, make_pool, call_concurrently,
+    call_by_dependency, format_size)
 from decking.components import (
-    Image, ContainerData, Container, Cluster, Group, ContainerNotCreatedError)
+    Image, ContainerData, Container, Cluster, Group, ContainerNotCreatedError,
+    OperationError, PROJECT_LABEL)
+from decking.context import BuildIndex
+from decking.dockerfile import DockerfileCache
+from decking.readiness import ReadinessCheck
+from decking.registry import RegistryClient
+from decking.state import ContainerStateCache
 from decking.terminal import term
+from decking.tracing import span, traced, trace_client
+from decking.transport import PooledClient, DEFAULT_POOL_SIZE
 
 
 class Decking(object):
@@ -14,16 +26,26 @@ class Decking(object):
 
     :parameter decking_config: Python mapping containing the validated
         decking.json file_config
+    :parameter project: the name with which to label the containers we
+        create, defaulting to the name of the directory containing the
+        configuration.
+    :parameter pool_size: how many connections to the Docker daemon to keep
+        open for concurrent operations, if we create the client.
     '''
-    def __init__(self, decking_config, base_path='', docker_client=None):
+    def __init__(
+            self, decking_config, base_path='', docker_client=None,
+            project=None, pool_size=DEFAULT_POOL_SIZE):
         self._base_path = base_path
-        self.client = docker_client or docker.Client(
-            base_url=os.environ.get('DOCKER_HOST'), version='1.19')
+        self.project = project or os.path.basename(os.path.abspath(base_path))
+        self.client = trace_client(docker_client or PooledClient(
+            base_url=os.environ.get('DOCKER_HOST'), version='1.19',
+            pool_size=pool_size))
         self.images = self._make_images(decking_config['images'])
         self.containers = self._make_containers(decking_config['containers'])
         self.groups = self._make_groups(decking_config.get('groups', {}))
         self.clusters = self._make_clusters(decking_config['clusters'])
-        self._populate_live_container_info()
+        # Names of the containers whose live state we've looked up:
+        self._discovered = set()
 
     def _normalise_path(self, path):
         if not os.path.isabs(path):
@@ -31,10 +53,12 @@ class Decking(object):
         return path
 
     def _make_images(self, config_data):
+        self._dockerfile_cache = DockerfileCache()
         image_specs = {}
         for name, path in config_data.items():
             image_specs[name] = Image(
-                self.client, name, self._normalise_path(path))
+                self.client, name, self._normalise_path(path),
+                self._dockerfile_cache)
         return image_specs
 
     @staticmethod
@@ -73,8 +97,12 @@ class Decking(object):
             existing_containers[name]: alias for name, alias in links.items()}
         port_bindings, volume_bindings, environment = (
             self._process_container_config(container_config))
+        ready_config = container_config.get('ready')
+        readiness_check = (
+            ReadinessCheck.from_config(ready_config) if ready_config else None)
         return Container(
             self.client, name, image, dependencies=dependencies,
+            readiness_check=readiness_check, project=self.project,
             port_bindings=port_bindings, environment=environment,
             net=container_config.get('net'),
             privileged=container_config.get('privileged'),
@@ -118,14 +146,76 @@ class Decking(object):
             clusters[name] = Cluster(self.client, name, containers, group)
         return clusters
 
-    def _populate_live_container_info(self):
-        container_infos = self.client.containers(all=True, limit=-1)
+    def _get_project_filters(self):
+        return {'label': '{}={}'.format(PROJECT_LABEL, self.project)}
+
+    @staticmethod
+    def _get_name_filters(containers):
+        return {'name': [
+            '^/{}$'.format(re.escape(container.name))
+            for container in containers]}
+
+    def _update_container_info(self, container_infos, containers=None):
+        '''Gives the given containers (by default all of ours) the live state
+        listed for them in 'container_infos'.
+
+        :returns: set of the containers that were listed.
+        '''
+        if containers is None:
+            containers = self.containers.values()
+        infos_by_name = {}
         for container_info in container_infos:
             for name in container_info['Names']:
-                name = name.lstrip('/')
-                if name in self.containers:
-                    self.containers[name]._docker_container_info = (
-                        container_info)
+                infos_by_name[name.lstrip('/')] = container_info
+        found = set()
+        for container in containers:
+            if container.name in infos_by_name:
+                container._docker_container_info = infos_by_name[
+                    container.name]
+                found.add(container)
+        return found
+
+    @traced
+    def _populate_live_container_info(self, containers, refresh=False):
+        '''Looks up the live state of any of the given containers that we
+        haven't already. Rather than listing every container on the host, we
+        ask the Docker daemon for those labelled as part of our project, then
+        by name for any that weren't, in case they were created before we
+        labelled containers.
+
+        :parameter refresh: look up all the given containers again, forgetting
+            the state of any that no longer exist.
+        '''
+        if not refresh:
+            containers = [
+                container for container in containers
+                if container.name not in self._discovered]
+        if not containers:
+            return
+        found = self._update_container_info(
+            self.client.containers(
+                all=True, filters=self._get_project_filters()),
+            containers)
+        missing = [
+            container for container in containers if container not in found]
+        if missing:
+            found |= self._update_container_info(
+                self.client.containers(
+                    all=True, filters=self._get_name_filters(missing)),
+                missing)
+        if refresh:
+            for container in containers:
+                if container not in found:
+                    container._docker_container_info = None
+        self._discovered.update(container.name for container in containers)
+
+    def _get_cluster(self, name):
+        ''':returns: the named cluster, with the live state of its
+            containers.
+        '''
+        cluster = self.clusters[name]
+        self._populate_live_container_info(cluster.containers)
+        return cluster
 
     def _get_images_by_name(self, name):
         if name == 'all':
@@ -139,64 +229,212 @@ class Decking(object):
         else:
             raise ValueError("Can't find enity named {!r}".format(name))
 
+    def _get_image_dependencies(self, images):
+        '''Returns a mapping of each of the given images to the list of other
+        given images they are built from.
+        '''
+        # Remove external dependencies:
+        dependencies = {
+            image: [images[n] for n in image.dependencies if n in images]
+            for image in images.values()}
+        self._dockerfile_cache.save()
+        return dependencies
+
+    def _do_per_image(self, images, method_name, jobs, *args, **kwargs):
+        '''Calls the named method on each of the given images, using up to
+        'jobs' threads to do so concurrently.
+
+        :returns: tuple of (results, errors) as for :func:`call_concurrently`.
+        '''
+        def call(image):
+            image_kwargs = dict(kwargs)
+            if jobs > 1:
+                image_kwargs['term'] = term.prefixed(image.name)
+            return getattr(image, method_name)(*args, **image_kwargs)
+
+        with make_pool(jobs) as pool:
+            return call_concurrently(pool, call, images)
+
     @staticmethod
-    def _iter_images_by_dependency(images):
-        images_dependency_names = {}
-        for name, image in images.items():
-            # Remove external dependencies:
-            dependencies = filter(lambda n: n in images, image.dependencies)
-            images_dependency_names[name] = dependencies
-        for image_name in iter_dependencies(
-                images, images_dependency_names.__getitem__):
-            yield images[image_name]
-
-    def _do_per_image(self, images, method_name, *args, **kwargs):
-        processed = []
-        for image in images:
-            getattr(image, method_name)(*args, **kwargs)
-            processed.append(image)
-        return processed
-
-    def build(self, name):
-        images = self._iter_images_by_dependency(
-            self._get_images_by_name(name))
-        return self._do_per_image(images, 'build')
-
-    def create(self, name):
-        return self.clusters[name].create()
-
-    def start(self, name):
-        return self.clusters[name].start()
-
-    def run(self, name):
-        return self.clusters[name].run()
-
-    def stop(self, name):
+    def _raise_image_errors(operation, errors):
+        '''Reports each of the images that failed, then raises them all
+        together.
+
+        :raises OperationError: if there are any 'errors'.
+        '''
+        if errors:
+            for image, error in errors.items():
+                term.print_error(
+                    '{} failed for image {!r}'.format(operation, image.name),
+                    str(error))
+            raise OperationError(errors)
+
+    @traced
+    def build(self, name, jobs=1, force=False, compress=False):
+        '''Builds the named images, starting each one as soon as any image
+        it is built from has been, and building up to 'jobs' images at once.
+        Images whose build context hasn't changed since they were last built
+        are skipped, unless 'force' is set. Build contexts are gzipped on
+        the way to the daemon if 'compress' is set.
+        '''
+        images = self._get_images_by_name(name)
+        with span('Decking._get_image_dependencies'):
+            dependencies = self._get_image_dependencies(images)
+        build_index = BuildIndex()
+        built = set()
+
+        def build(image):
+            image_term = term.prefixed(image.name) if jobs > 1 else term
+            if image.build(image_term, build_index, force, compress):
+                built.add(image)
+
+        start_time = time.time()
         try:
-            return self.clusters[name].stop()
-        except ContainerNotCreatedError:
-            term.print_warning('Containers were not present to be stopped')
+            processed, errors = call_by_dependency(
+                build, images.values(), dependencies.__getitem__, jobs)
+        finally:
+            with span('BuildIndex.save'):
+                build_index.save()
+        term.print_step(
+            'built {} of {} images in {:.1f}s ({} up to date)'.format(
+                len(built), len(images), time.time() - start_time,
+                len(processed) - len(built)))
+        self._raise_image_errors('build', errors)
+        return list(processed)
 
+    @traced
+    def create(self, name, jobs=1):
+        return self._get_cluster(name).create(jobs)
+
+    @traced
+    def start(self, name, jobs=1):
+        return self._get_cluster(name).start(jobs)
+
+    @traced
+    def run(self, name, jobs=1):
+        return self._get_cluster(name).run(jobs)
+
+    @traced
+    def converge(self, name, jobs=1):
+        cluster = self.clusters[name]
+        # Decisions to recreate containers mustn't rest on stale state:
+        self._populate_live_container_info(cluster.containers, refresh=True)
+        return cluster.converge(jobs)
+
+    @staticmethod
+    def _handle_not_created(operation, error):
+        '''Warns about any containers in the given :class:`OperationError`
+        that couldn't be operated on because they don't exist.
+
+        :returns: mapping of the containers that failed for any other reason
+            to their errors.
+        '''
+        not_created = [
+            container.name for container, e in error.errors.items()
+            if isinstance(e, ContainerNotCreatedError)]
+        if not_created:
+            term.print_warning(
+                'Containers were not present to be {}'.format(operation),
+                *not_created)
+        return OrderedDict(
+            (container, e) for container, e in error.errors.items()
+            if not isinstance(e, ContainerNotCreatedError))
+
+    def _warn_not_created(self, operation, func, *args, **kwargs):
+        '''Calls 'func', warning about (rather than failing on) any containers
+        it couldn't operate on because they don't exist.
+        '''
+        try:
+            return func(*args, **kwargs)
+        except OperationError as error:
+            errors = self._handle_not_created(operation, error)
+            if errors:
+                raise OperationError(errors)
+
+    @traced
+    def stop(self, name, jobs=1):
+        return self._warn_not_created(
+            'stopped', self._get_cluster(name).stop, jobs)
+
+    @traced
     def status(self, name):
-        return self.clusters[name].status()
+        return self._get_cluster(name).status()
 
+    @traced
     def restart(self, name):
-        self.clusters[name].stop()
+        self._get_cluster(name).stop()
         self.clusters[name].restart()
 
-    def remove(self, name):
+    @traced
+    def remove(self, name, jobs=1):
+        return self._warn_not_created(
+            'removed', self._get_cluster(name).remove, jobs)
+
+    def watch(self, name):
+        ''':returns: a started :class:`decking.state.ContainerStateCache`
+            keeping the live state of the named cluster's containers up to
+            date until it is stopped.
+        '''
+        cache = ContainerStateCache(self, self._get_cluster(name).containers)
+        cache.start()
+        return cache
+
+    @traced
+    def attach(self, name, metrics=None, **kwargs):
+        '''
+        :parameter metrics: optional :class:`decking.metrics.AttachMetrics`
+            to track the session with.
+        '''
+        # Attaching can go on for a long time, during which containers may
+        # come and go:
+        with self.watch(name) as state_cache:
+            if metrics:
+                metrics.track(state_cache=state_cache)
+            return self.clusters[name].attach(metrics=metrics, **kwargs)
+
+    def _get_image_size(self, image):
         try:
-            return self.clusters[name].remove()
-        except ContainerNotCreatedError:
-            term.print_warning('Containers were not present to be removed')
+            return self.client.inspect_image(image.name).get('Size') or 0
+        except docker.errors.APIError:
+            return 0
 
-    def attach(self, name):
-        return self.clusters[name].attach()
+    def _report_transfers(self, operation, results, elapsed):
+        '''Summarises a push or pull, including how much we saved by
+        skipping the images that were already up to date. We estimate the
+        time saved from the rate at which the other images were transferred.
+        '''
+        sizes = {image: self._get_image_size(image) for image in results}
+        skipped = [
+            image for image, transferred in results.items() if not transferred]
+        summary = '{}ed {} of {} images in {:.1f}s'.format(
+            operation, len(results) - len(skipped), len(results), elapsed)
+        if skipped:
+            saved = sum(sizes[image] for image in skipped)
+            transferred = sum(sizes.values()) - saved
+            summary += ', skipping {} up to date: saved {}'.format(
+                len(skipped), format_size(saved))
+            if transferred and elapsed:
+                summary += ' and about {:.1f}s'.format(
+                    saved * elapsed / transferred)
+        term.print_step(summary)
 
-    def push(self, name, *args, **kwargs):
+    @traced
+    def _transfer(self, operation, name, registry, allow_insecure, jobs):
+        '''Pushes or pulls the named images, skipping any that the registry
+        shows are up to date.
+        '''
         images = self._get_images_by_name(name).values()
-        return self._do_per_image(images, 'push', *args, **kwargs)
+        registry_client = RegistryClient(registry, allow_insecure)
+        start_time = time.time()
+        processed, errors = self._do_per_image(
+            images, operation, jobs, registry, allow_insecure,
+            registry_client=registry_client)
+        self._report_transfers(operation, processed, time.time() - start_time)
+        self._raise_image_errors(operation, errors)
+        return list(processed)
 
-    def pull(self, name, *args, **kwargs):
-        images = self._get_images_by_name(name).values()
-        return self._do_per_image(images, 'pull', *args, **kwargs)
+    def push(self, name, registry, allow_insecure=False, jobs=1):
+        return self._transfer('push', name, registry, allow_insecure, jobs)
+
+    def pull(self, name, registry=None, allow_insecure=False, jobs=1):
+        return self._transfer('pull', name, registry, allow_insecure, jobs)
@@ -53,6 +53,30 @@ _container_schema_common = {
     }
 }
 
+_readiness_schema = {
+    'tcp': {
+        'type': 'string'
+    },
+    'http': {
+        'type': 'string'
+    },
+    'log': {
+        'type': 'string'
+    },
+    'exec': {
+        'type': 'list',
+        'schema': {'type': 'string'}
+    },
+    'timeout': {
+        'type': 'number',
+        'min': 0
+    },
+    'interval': {
+        'type': 'number',
+        'min': 0
+    }
+}
+
 schema = {
     'images': {
         'type': 'dict',
@@ -75,6 +99,10 @@ schema = {
                 image={
                     'type': 'string',
                     'required': True
+                },
+                ready={
+                    'type': 'dict',
+                    'schema': _readiness_schema
                 }, **_container_schema_common),
             },
         },
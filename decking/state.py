@@ -0,0 +1,117 @@
+import threading
+
+from decking.terminal import term
+
+
+class ContainerStateCache(object):
+    '''Keeps the live state of some of a :class:`decking.runner.Decking`'s
+    containers up to date by applying the Docker daemon's container events
+    to them as they happen, so that long running operations don't act on a
+    stale snapshot. We may miss events while we aren't connected to the
+    daemon's event stream, so every time we (re)connect we also look up the
+    full state of the containers again.
+
+    :parameter retry_interval: seconds to wait before reconnecting after
+        losing the event stream, doubling after each consecutive failure up to
+        'max_retry_interval'.
+    '''
+    # How the container listings' 'Status' changes with each event:
+    _statuses = {
+        'start': 'Up',
+        'unpause': 'Up',
+        'pause': 'Up (Paused)',
+        'die': 'Exited',
+    }
+
+    def __init__(
+            self, decking, containers, retry_interval=1,
+            max_retry_interval=30):
+        self._decking = decking
+        self._client = decking.client
+        self.containers = list(containers)
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.resyncs = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _find(self, container_id):
+        for container in self.containers:
+            info = container._docker_container_info
+            if info and info['Id'] == container_id:
+                return container
+
+    def apply(self, event):
+        '''Updates our containers with a single event from the Docker daemon.
+        '''
+        # Newer daemons describe events with 'Action', older with 'status':
+        action = event.get('Action') or event.get('status')
+        container_id = event.get('id')
+        if action == 'create':
+            # The event doesn't give the container's name, so we don't know
+            # whether it's one of ours until we look it up:
+            self._decking._update_container_info(
+                self._client.containers(
+                    all=True, filters={'id': container_id}),
+                self.containers)
+            return
+        container = self._find(container_id)
+        if container is None:
+            return
+        if action == 'destroy':
+            container._docker_container_info = None
+        elif action in self._statuses:
+            # Replaced rather than mutated, as other threads may be reading it:
+            info = dict(container._docker_container_info)
+            info['Status'] = self._statuses[action]
+            container._docker_container_info = info
+
+    def resync(self):
+        '''Looks up the full state of all our containers.'''
+        self._decking._populate_live_container_info(
+            self.containers, refresh=True)
+        self.resyncs += 1
+
+    def run(self):
+        '''Applies events until we are stopped, reconnecting to the event
+        stream whenever we lose it.
+        '''
+        interval = self.retry_interval
+        while not self._stopped.is_set():
+            try:
+                # We subscribe before resyncing so that we can't miss events
+                # in between. Any that arrive in the meantime are applied
+                # afterwards, in order, so leave the state as it should be:
+                events = self._client.events(
+                    decode=True,
+                    filters={'container': [c.name for c in self.containers]})
+                self.resync()
+                interval = self.retry_interval
+                for event in events:
+                    if self._stopped.is_set():
+                        return
+                    self.apply(event)
+            except (IOError, ValueError) as error:
+                term.print_warning(
+                    'Lost the Docker event stream, reconnecting...',
+                    str(error))
+            self._stopped.wait(interval)
+            interval = min(interval * 2, self.max_retry_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        '''Stops applying events. The event stream only notices when the next
+        event arrives, so we don't wait for that.
+        '''
+        self._stopped.set()
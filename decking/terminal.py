@@ -1,39 +1,124 @@
 from __future__ import print_function
 
+import threading
+import time
+
 import blessings
 
 UP = '\x1b[1A'
 ERASE_LINE = '\x1b[2K'
 
+# Serialises output from concurrent operations so that lines don't interleave:
+_print_lock = threading.Lock()
+
+
+def _print(*args):
+    with _print_lock:
+        print(*args)
+
 
 class Terminal(blessings.Terminal):
     def print_step(self, title, *lines):
-        print("----->", self.green(title))
+        _print("----->", self.green(title))
         for line in lines:
             self.print_line(line)
 
     @staticmethod
     def print_line(*line):
-        print("      ", *line)
+        _print("      ", *line)
+
+    @staticmethod
+    def print_lines(lines):
+        '''Prints many lines as a single write.'''
+        if lines:
+            _print('\n'.join('       {}'.format(line) for line in lines))
 
     @staticmethod
     def replace_line(*line):
-        print("\r{}{}      ".format(UP, ERASE_LINE), *line)
+        _print("\r{}{}      ".format(UP, ERASE_LINE), *line)
 
     def print_error_line(self, *line):
-        print(self.red(' !    '), *line)
+        _print(self.red(' !    '), *line)
 
     def print_error(self, title, *lines):
-        print("----->", self.red(title))
+        _print("----->", self.red(title))
         for line in lines:
             self.print_error_line(line)
 
     def print_warning_line(self, *line):
-        print(self.yellow(' !    '), *line)
+        _print(self.yellow(' !    '), *line)
 
     def print_warning(self, title, *lines):
-        print("----->", self.yellow(title))
+        _print("----->", self.yellow(title))
         for line in lines:
             self.print_warning_line(line)
 
+    def prefixed(self, prefix):
+        return PrefixedTerminal(self, prefix)
+
+
+class PrefixedTerminal(object):
+    '''Wraps a :class:`Terminal` so that everything printed through it is
+    labelled with a prefix. This keeps the interleaved output of concurrent
+    operations readable.
+    '''
+    def __init__(self, term, prefix, progress_interval=2, clock=time.time):
+        self._term = term
+        self.prefix = prefix
+        self.progress_interval = progress_interval
+        self._clock = clock
+        self._last_status = None
+        self._last_progress_time = None
+
+    def _prefix(self, line):
+        return '{}: {}'.format(self.prefix, line)
+
+    def print_step(self, title, *lines):
+        self._term.print_step(self._prefix(title))
+        for line in lines:
+            self.print_line(line)
+
+    def print_line(self, *line):
+        self._term.print_line(self._prefix(' '.join(map(str, line))))
+
+    def print_lines(self, lines):
+        self._term.print_lines([self._prefix(line) for line in lines])
+
+    def replace_line(self, *line):
+        '''Other output may have been printed since the line we'd replace, so
+        we print progress updates as new lines instead. There can be thousands
+        of them for each image, so we only print one when its status changes,
+        or at most every 'progress_interval' seconds otherwise.
+        '''
+        line = ' '.join(map(str, line))
+        # Progress updates look like 'status (id): progress':
+        status = line.partition(':')[0]
+        now = self._clock()
+        if (status != self._last_status or
+                now - self._last_progress_time >= self.progress_interval):
+            self._last_status = status
+            self._last_progress_time = now
+            self.print_line(line)
+
+    def print_error_line(self, *line):
+        self._term.print_error_line(self._prefix(' '.join(map(str, line))))
+
+    def print_error(self, title, *lines):
+        self._term.print_error(self._prefix(title))
+        for line in lines:
+            self.print_error_line(line)
+
+    def print_warning_line(self, *line):
+        self._term.print_warning_line(self._prefix(' '.join(map(str, line))))
+
+    def print_warning(self, title, *lines):
+        self._term.print_warning(self._prefix(title))
+        for line in lines:
+            self.print_warning_line(line)
+
+    def prefixed(self, prefix):
+        return PrefixedTerminal(
+            self._term, self._prefix(prefix), self.progress_interval,
+            self._clock)
+
 term = Terminal()
@@ -0,0 +1,171 @@
+'''Tests for :mod:`decking.aio`, imported by test_aio only on Python 3.6 or
+later, since older interpreters can't parse them.
+'''
+from unittest import TestCase
+from mock import Mock
+
+import asyncio
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+
+from decking.aio import (
+    AsyncDockerClient, AsyncCluster, APIError, run_operation)
+from decking.components import Image, Container, Cluster, OperationError
+from decking.readiness import ReadinessCheck
+from decking.terminal import Terminal
+
+
+class FakeDaemon(object):
+    '''Serves just enough of the Docker API on a unix socket for the async
+    client tests.
+    '''
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.requests = []
+        self.started = []
+        self.logs = {}
+
+    async def handle(self, reader, writer):
+        request_line = (await reader.readline()).decode('latin-1')
+        method, url, _ = request_line.split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers['content-length']))
+        body = json.loads(body.decode('utf-8')) if body else None
+        path, _, query = url.partition('?')
+        self.requests.append((method, path, query, body))
+        parts = path.split('/')[2:]
+        if parts == ['containers', 'create']:
+            name = query.split('name=')[1]
+            self._respond(writer, 201, {'Id': name + '-id' * 10})
+        elif parts[-1] == 'start':
+            self.started.append(parts[1])
+            self._respond(writer, 204)
+        elif parts[-1] == 'stop' and parts[1].startswith('broken'):
+            self._respond(writer, 500, {'message': 'cannot stop'})
+        elif parts[-1] == 'stop':
+            self._respond(writer, 204)
+        elif parts[-1] == 'logs':
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n')
+            for chunk in self.logs.get(parts[1], []):
+                writer.write('{:x}\r\n'.format(len(chunk)).encode() + chunk +
+                             b'\r\n')
+            writer.write(b'0\r\n\r\n')
+        else:
+            self._respond(writer, 404, {'message': 'no such thing'})
+        await writer.drain()
+        writer.close()
+
+    @staticmethod
+    def _respond(writer, status, body=None):
+        data = json.dumps(body).encode('utf-8') if body else b''
+        writer.write(
+            'HTTP/1.1 {} X\r\nContent-Length: {}\r\n\r\n'.format(
+                status, len(data)).encode('latin-1') + data)
+
+
+def frame(data, stream=1):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+class TestAsync(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.daemon = FakeDaemon(os.path.join(self.temp_dir, 'docker.sock'))
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_unix_server(
+            self.daemon.handle, self.daemon.socket_path))
+        self.client = AsyncDockerClient(self.daemon.socket_path)
+        image = Image(None, 'image_name', 'some/path')
+        self.dependency = Container(None, 'dependency_name', image)
+        self.container = Container(
+            None, 'container_name', image, port_bindings={'1111': '2222'},
+            environment={'moose': 'pants'},
+            dependencies={self.dependency: 'dependency_alias'})
+        self.cluster = AsyncCluster(
+            Cluster(None, 'cluster_name', [self.container, self.dependency]),
+            self.client)
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        shutil.rmtree(self.temp_dir)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_run(self):
+        processed = self.run_async(self.cluster.run())
+        self.assertEqual(processed, [self.dependency, self.container])
+        self.assertEqual(self.container.id, 'container_na')
+        self.assertEqual(self.daemon.started, ['dependency_n', 'container_na'])
+        method, path, query, body = self.daemon.requests[2]
+        self.assertEqual((method, query), ('POST', 'name=container_name'))
+        self.assertEqual(body['Env'], ['moose=pants'])
+        self.assertEqual(body['ExposedPorts'], {'1111/tcp': {}})
+        method, path, query, body = self.daemon.requests[3]
+        self.assertEqual(body['Links'], ['dependency_name:dependency_alias'])
+        self.assertEqual(
+            body['PortBindings'],
+            {'1111/tcp': [{'HostIp': '', 'HostPort': '2222'}]})
+
+    def test_stop_reports_every_failure(self):
+        self.container._docker_container_info = {'Id': 'broken_container'}
+        self.dependency._docker_container_info = {'Id': 'broken_dependency'}
+        with self.assertRaises(OperationError) as context:
+            self.run_async(self.cluster.stop())
+        self.assertEqual(
+            list(context.exception.errors), [self.container, self.dependency])
+        for error in context.exception.errors.values():
+            self.assertIsInstance(error, APIError)
+            self.assertEqual(error.status, 500)
+
+    def test_logs(self):
+        split_frame = frame(b'ld\n', 2)
+        self.daemon.logs['container_name'] = [
+            frame(b'hello\nwor'), split_frame[:5], split_frame[5:],
+            frame(b'partial')]
+
+        async def read_logs():
+            return [line async for line in self.client.logs('container_name')]
+        self.assertEqual(
+            self.run_async(read_logs()), ['hello', 'world', 'partial'])
+
+    def test_attach(self):
+        term = Mock(spec=Terminal)
+        self.daemon.logs['container_name'] = [frame(b'hello\n')]
+        self.daemon.logs['dependency_name'] = [frame(b'world\n')]
+        self.run_async(self.cluster.attach(term))
+        self.assertEqual(term.print_line.call_count, 2)
+        term.print_warning.assert_called_with('All containers detached')
+
+    def test_run_operation_unsupported(self):
+        with self.assertRaisesRegexp(ValueError, "'restart' not supported"):
+            run_operation(Mock(), 'restart', 'cluster_name')
+
+    def test_readiness_checks_wait_concurrently(self):
+        # Each check only passes once every container is being checked:
+        barrier = threading.Barrier(8, timeout=5)
+        containers = []
+        for i in range(8):
+            check = Mock(spec=ReadinessCheck)
+            check.wait.side_effect = lambda container: barrier.wait()
+            containers.append(Container(
+                None, 'container{}'.format(i), self.container.image,
+                readiness_check=check))
+        cluster = AsyncCluster(
+            Cluster(None, 'cluster_name', containers), self.client)
+        processed = self.run_async(cluster.run())
+        self.assertEqual(len(processed), 8)
+        self.assertFalse(barrier.broken)
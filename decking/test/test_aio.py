@@ -0,0 +1,6 @@
+import sys
+
+# The asyncio engine's tests use syntax that Python <3.6 can't parse, so they
+# live in a module that we only import when the engine is available:
+if sys.version_info >= (3, 6):
+    from decking.test._aio_cases import TestAsync  # noqa
@@ -0,0 +1,62 @@
+from unittest import TestCase
+from mock import patch
+
+import os
+import shutil
+import tempfile
+
+from decking.cache import ConfigCache
+from decking.main import _read_config, _validate_config
+
+here = os.path.dirname(__file__)
+
+
+class TestConfigCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = ConfigCache(os.path.join(self.temp_dir, 'cache'))
+        self.filename = os.path.join(self.temp_dir, 'decking.json')
+        shutil.copy(
+            os.path.join(here, 'data', 'example_decking_file.json'),
+            self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_config(self):
+        with patch(
+                'decking.main._validate_config',
+                wraps=_validate_config) as validate:
+            config = _read_config(self.filename, self.cache)
+        return config, validate.called
+
+    def test_skips_parsing_unchanged_file(self):
+        config, validated = self.read_config()
+        self.assertTrue(validated)
+        cached, validated = self.read_config()
+        self.assertFalse(validated)
+        self.assertEqual(cached, config)
+        self.assertEqual(cached, _read_config(self.filename))
+
+    def test_reparses_changed_file(self):
+        self.read_config()
+        with open(self.filename, 'a') as f:
+            f.write('\n')
+        config, validated = self.read_config()
+        self.assertTrue(validated)
+
+    def test_ignores_corrupt_entry(self):
+        self.read_config()
+        cache_dir = self.cache.directory
+        for name in os.listdir(cache_dir):
+            with open(os.path.join(cache_dir, name), 'wb') as f:
+                f.write(b'\x00garbage')
+        config, validated = self.read_config()
+        self.assertTrue(validated)
+        self.assertEqual(
+            config['clusters']['vanilla'], ['alice', 'bob1', 'bob2'])
+
+    def test_unwritable_directory(self):
+        cache = ConfigCache(os.path.join(self.filename, 'not_a_directory'))
+        config = _read_config(self.filename, cache)
+        self.assertEqual(config, _read_config(self.filename))
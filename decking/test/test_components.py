@@ -1,14 +1,23 @@
-from unittest import TestCase
-from mock import Mock, MagicMock, call, patch
+from unittest import TestCase, skipIf
+from mock import ANY, Mock, MagicMock, call, patch
 
 import os
 import sys
 import json
+import socket
+import struct
 import docker
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
+from decking.logs import LogBuffer, LogMultiplexer, END_OF_STREAM, BLOCK
+from decking.metrics import AttachMetrics
 from decking.terminal import Terminal
 from decking.components import (
-    Image, Container, ContainerData, Group, Cluster, ContainerNotCreatedError)
+    Image, Container, ContainerData, Group, Cluster, ContainerNotCreatedError,
+    OperationError)
 
 here = os.path.dirname(__file__)
 
@@ -69,9 +78,16 @@ class TestImage(BaseTest):
 
     def test_build(self):
         self.docker_client.build.return_value = self.stream
-        self.image.build()
-        self.docker_client.build.assert_called_once_with(
-            'some/path', tag='image_name', rm=True, forcerm=True)
+        with patch('decking.components.iter_context_tar') as context_tar:
+            self.image.build()
+            self.image.build(compress=True)
+        context_tar.assert_has_calls([
+            call('some/path', gzip=False), call('some/path', gzip=True)])
+        self.docker_client.build.assert_has_calls([
+            call(
+                fileobj=context_tar.return_value, custom_context=True,
+                encoding=encoding, tag='image_name', rm=True, forcerm=True)
+            for encoding in (None, 'gzip')])
 
     def test_push(self):
         self.docker_client.push.return_value = self.stream
@@ -118,6 +134,41 @@ class TestContainer(BaseTest):
         self.container.create()
         self.assertEqual(self.container.id, '1234')
 
+    def test_create_labels(self):
+        self.container.project = 'project_name'
+        self.docker_client.create_container.return_value = {'Id': '1234'}
+        self.container.create(cluster_name='cluster_name')
+        _, kwargs = self.docker_client.create_container.call_args
+        labels = kwargs['labels']
+        self.assertRegexpMatches(
+            labels.pop('io.decking.config'), '^[0-9a-f]{64}$')
+        self.assertEqual(labels, {
+            'io.decking.project': 'project_name',
+            'io.decking.cluster': 'cluster_name'})
+
+    @environ_patch()
+    def test_is_up_to_date(self):
+        self.assertFalse(self.container.is_up_to_date())
+        self.docker_client.create_container.return_value = {'Id': '1234'}
+        self.container.create(self.group, 'cluster_name')
+        _, kwargs = self.docker_client.create_container.call_args
+        # As we'd find it listed:
+        self.container._docker_container_info = {
+            'Id': '1234', 'Labels': kwargs['labels']}
+        self.assertTrue(
+            self.container.is_up_to_date(self.group, 'cluster_name'))
+        self.assertFalse(self.container.is_up_to_date(None, 'cluster_name'))
+        self.container.port_bindings['3333'] = '4444'
+        self.assertFalse(
+            self.container.is_up_to_date(self.group, 'cluster_name'))
+        del self.container.port_bindings['3333']
+        with patch.dict('decking.components.os.environ', dynamic='changed'):
+            self.assertFalse(
+                self.container.is_up_to_date(self.group, 'cluster_name'))
+        self.container._docker_container_info['Labels'] = None
+        self.assertFalse(
+            self.container.is_up_to_date(self.group, 'cluster_name'))
+
     def assert_docker_create_with_group(self):
         expected_env = {
             'moose': 'overridden', 'pants': 'extra', 'more': 'extra extra',
@@ -125,7 +176,8 @@ class TestContainer(BaseTest):
             'dynamic_missing': ''}
         self.docker_client.create_container.assert_called_once_with(
             'image_name', name='container_name',
-            environment=expected_env, ports={'1111': None}.keys())
+            environment=expected_env, ports={'1111': None}.keys(),
+            labels=ANY)
 
     @environ_patch()
     def test_create_with_group(self):
@@ -174,7 +226,11 @@ class TestContainer(BaseTest):
     def test_stop(self):
         self.fake_container_create()
         self.container.stop()
-        self.assertTrue(self.docker_client.stop.called)
+        self.docker_client.stop.assert_called_once_with(
+            self.container._docker_container_info, timeout=8)
+        self.container.stop(timeout=2)
+        self.docker_client.stop.assert_called_with(
+            self.container._docker_container_info, timeout=2)
 
     def test_status(self):
         self.container.status()
@@ -194,20 +250,109 @@ class TestContainer(BaseTest):
 
 
 class TestCluster(BaseTest):
+    @staticmethod
+    def printed_lines(term):
+        return [
+            line for args, kwargs in term.print_lines.call_args_list
+            for line in args[0]]
+
     def test_attach(self):
         stream = 'hello', 'world'
         self.docker_client.attach.return_value = stream
         term = Mock(spec=Terminal)
-        self.cluster.attach(term)
+        self.cluster.attach(term, multiplex=False)
         term.print_step.assert_has_calls(
             [call(self.container.name), call(self.dependency.name)],
             any_order=True)
-        term.print_line.assert_has_calls([call('hello'), call('world')] * 2)
+        self.assertEqual(
+            sorted(self.printed_lines(term)),
+            ['hello', 'hello', 'world', 'world'])
         term.print_warning.has_calls([
             call('{}: detached'.format(self.container.name)),
             call('{}: detached'.format(self.dependency.name)),
             call('All containers detached')], any_order=True)
 
+    @skipIf(not LogMultiplexer.available, 'selectors needs Python 3.4')
+    def test_attach_multiplexed(self):
+        sockets = {}
+        for name in self.container.name, self.dependency.name:
+            ours, theirs = socket.socketpair()
+            sockets[name] = theirs
+            header = struct.pack('>BxxxL', 1, 12)
+            ours.sendall(header + 'hello\n{}\n'.format(name[:5]).encode())
+            ours.close()
+        self.docker_client.attach_socket.side_effect = (
+            lambda name, params: sockets[name])
+        term = Mock(spec=Terminal)
+        metrics = AttachMetrics()
+        self.cluster.attach(term, multiplex=True, metrics=metrics)
+        self.assertEqual(
+            sorted(self.printed_lines(term)),
+            ['conta', 'depen', 'hello', 'hello'])
+        term.print_warning.assert_called_with('All containers detached')
+        sample = metrics.sample()
+        self.assertEqual(
+            sample['containers'][self.container.name]['lines'], 2)
+        self.assertEqual(sample['dropped'], 0)
+
+    def test_display_logs_reports_dropped_lines(self):
+        log_buffer = LogBuffer(max_lines=2)
+        for i in range(5):
+            log_buffer.put(('alice', str(i)))
+        log_buffer.put(('alice', END_OF_STREAM))
+        term = Mock(spec=Terminal)
+        self.cluster._display_logs({'alice'}, log_buffer, term, tick=0)
+        self.assertEqual(self.printed_lines(term), ['3', '4'])
+        term.print_warning.assert_has_calls([
+            call('alice: dropped 3 lines'), call('alice: detached'),
+            call('All containers detached')])
+
+    def test_attach_block_reads_streams_on_own_threads(self):
+        self.docker_client.attach.return_value = ['hello']
+        term = Mock(spec=Terminal)
+        self.cluster.attach(term, multiplex=True, policy=BLOCK)
+        self.assertFalse(self.docker_client.attach_socket.called)
+        self.assertEqual(self.printed_lines(term), ['hello', 'hello'])
+
+    @skipIf(not LogMultiplexer.available, 'selectors needs Python 3.4')
+    def test_attach_failure_closes_sockets(self):
+        ours, theirs = socket.socketpair()
+        self.docker_client.attach_socket.side_effect = [
+            theirs, docker.errors.NotFound('no such container', Mock())]
+        self.assertRaises(
+            docker.errors.NotFound, self.cluster.attach, Mock(spec=Terminal),
+            multiplex=True)
+        self.assertEqual(theirs.fileno(), -1)
+        ours.close()
+
+    @skipIf(not LogMultiplexer.available, 'selectors needs Python 3.4')
+    def test_multiplexer_failure_ends_streams(self):
+        class BrokenSocket(object):
+            def __init__(self, sock):
+                self.sock = sock
+
+            def fileno(self):
+                return self.sock.fileno()
+
+            def recv(self, size):
+                raise ValueError('for test')
+
+            def close(self):
+                self.sock.close()
+
+        ours, theirs = socket.socketpair()
+        ours.sendall(b'data')
+        log_queue = Queue()
+        multiplexer = LogMultiplexer(log_queue)
+        multiplexer.add('alice', BrokenSocket(theirs))
+        multiplexer.run()
+        self.assertEqual(
+            log_queue.get_nowait(),
+            ('alice', 'stopped reading logs: for test'))
+        self.assertEqual(log_queue.get_nowait(), ('alice', END_OF_STREAM))
+        self.assertEqual(theirs.fileno(), -1)
+        ours.close()
+
     def test_stop(self):
         patch_dep = patch.object(self.dependency, 'stop', Mock())
         patch_cont = patch.object(self.container, 'stop', Mock())
@@ -220,5 +365,126 @@ class TestCluster(BaseTest):
             self.dependency, 'stop', Mock(side_effect=KeyError('for test')))
         patch_cont = patch.object(self.container, 'stop', Mock())
         with patch_dep, patch_cont:
-            self.assertRaises(KeyError, self.cluster.stop)
+            self.assertRaises(OperationError, self.cluster.stop)
             self.assertTrue(self.container.stop.called)
+
+    def test_by_level_stops_after_failed_level(self):
+        processed = []
+        def func(container):
+            if container is self.dependency:
+                raise KeyError('for test')
+            processed.append(container)
+        with self.assertRaises(OperationError) as context:
+            self.cluster._do_by_level(func, jobs=2)
+        self.assertEqual(list(context.exception.errors), [self.dependency])
+        self.assertEqual(processed, [])
+
+    def test_remove_concurrently_reports_every_failure(self):
+        removed = []
+        def fake_remove(container, error):
+            def remove():
+                # Dependents must have been removed before dependencies:
+                for dependency in container.dependencies:
+                    self.assertNotIn(dependency, removed)
+                removed.append(container)
+                raise error
+            return remove
+        patch_dep = patch.object(
+            self.dependency, 'remove',
+            Mock(side_effect=fake_remove(self.dependency, KeyError('dep'))))
+        patch_cont = patch.object(
+            self.container, 'remove',
+            Mock(side_effect=fake_remove(self.container, ValueError('cont'))))
+        with patch_dep, patch_cont:
+            with self.assertRaises(OperationError) as context:
+                self.cluster.remove(jobs=4)
+        self.assertEqual(removed, [self.container, self.dependency])
+        self.assertEqual(
+            list(context.exception.errors),
+            [self.container, self.dependency])
+        self.assertIn('cont', str(context.exception))
+        self.assertIn('dep', str(context.exception))
+
+    def fake_live_containers(self, up_to_date, running):
+        '''Gives the cluster's containers live info as though they had been
+        created, from their current configuration if 'up_to_date'.
+        '''
+        for container in self.cluster.containers:
+            options = container._get_create_options(
+                self.cluster.group, self.cluster.name)
+            if container not in up_to_date:
+                options['labels']['io.decking.config'] = 'stale'
+            container._docker_container_info = {
+                'Id': container.name, 'Labels': options['labels'],
+                'Status': 'Up 2 hours' if container in running else 'Exited'}
+
+    def test_converge_recreates_changed_containers_and_dependents(self):
+        self.fake_live_containers(
+            up_to_date=[self.container], running=[self.dependency])
+        self.docker_client.create_container.side_effect = (
+            lambda image, name, **kwargs: {'Id': name + '-new'})
+        created = self.cluster.converge(jobs=2)
+        self.assertEqual(created, [self.container, self.dependency])
+        self.docker_client.stop.assert_called_once_with(
+            {'Id': 'dependency_name', 'Labels': ANY, 'Status': 'Up 2 hours'},
+            timeout=ANY)
+        # Dependents are removed first, and created last:
+        self.assertEqual(
+            [args[0]['Id'] for args, _ in
+             self.docker_client.remove_container.call_args_list],
+            ['container_name', 'dependency_name'])
+        self.assertEqual(
+            [kwargs['name'] for _, kwargs in
+             self.docker_client.create_container.call_args_list],
+            ['dependency_name', 'container_name'])
+        self.assertEqual(self.docker_client.start.call_count, 2)
+
+    def test_converge_leaves_unchanged_containers(self):
+        self.fake_live_containers(
+            up_to_date=self.cluster.containers, running=[self.dependency])
+        self.assertEqual(self.cluster.converge(), [])
+        self.assertFalse(self.docker_client.remove_container.called)
+        self.assertFalse(self.docker_client.create_container.called)
+        # But those that aren't running are started:
+        self.docker_client.start.assert_called_once_with(
+            self.container._docker_container_info, binds=ANY, links=ANY,
+            port_bindings=ANY, privileged=ANY, network_mode=ANY)
+
+    def test_converge_stops_if_containers_cant_be_removed(self):
+        self.fake_live_containers(up_to_date=[], running=[])
+        self.docker_client.remove_container.side_effect = (
+            docker.errors.APIError('in use', response=Mock(status_code=409)))
+        with patch('decking.components.term'):
+            self.assertRaises(OperationError, self.cluster.converge)
+        self.assertFalse(self.docker_client.create_container.called)
+
+    def test_run_concurrently(self):
+        started = []
+        def fake_run(container):
+            def run(group, cluster_name):
+                # Dependencies must have been started before dependents:
+                for dependency in container.dependencies:
+                    self.assertIn(dependency, started)
+                started.append(container)
+            return run
+        patch_dep = patch.object(
+            self.dependency, 'run',
+            Mock(side_effect=fake_run(self.dependency)))
+        patch_cont = patch.object(
+            self.container, 'run', Mock(side_effect=fake_run(self.container)))
+        with patch_dep, patch_cont:
+            processed = self.cluster.run(jobs=4)
+        self.assertEqual(processed, [self.dependency, self.container])
+        self.assertEqual(started, [self.dependency, self.container])
+
+    def test_run_concurrently_failure_skips_dependents(self):
+        patch_dep = patch.object(
+            self.dependency, 'create', Mock(side_effect=KeyError('for test')))
+        patch_cont = patch.object(self.container, 'create', Mock())
+        with patch_dep, patch_cont:
+            with self.assertRaises(OperationError) as context:
+                self.cluster.create(jobs=4)
+            self.assertFalse(self.container.create.called)
+        errors = context.exception.errors
+        self.assertEqual(list(errors), [self.dependency, self.container])
+        self.assertIn("'dependency_name' failed", str(errors[self.container]))
@@ -0,0 +1,197 @@
+from unittest import TestCase
+from mock import MagicMock, patch
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+import docker
+
+from decking.components import Image
+from decking.context import (
+    read_dockerignore, is_ignored, iter_context_files, iter_context_tar,
+    BuildIndex)
+
+
+class TestDockerignore(TestCase):
+    def test_read(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.assertEqual(read_dockerignore(path), [])
+        with open(os.path.join(path, '.dockerignore'), 'w') as f:
+            f.write('# comment\n\n  build/  \n!./build/keep\n/*.pyc\n')
+        self.assertEqual(
+            read_dockerignore(path),
+            ['build', '!' + os.path.join('build', 'keep'), '*.pyc'])
+
+    def test_is_ignored(self):
+        patterns = ['build', '*.pyc', '!keep.pyc']
+        self.assertTrue(is_ignored('build', patterns))
+        self.assertTrue(is_ignored(os.path.join('build', 'x'), patterns))
+        self.assertTrue(is_ignored('x.pyc', patterns))
+        self.assertFalse(is_ignored('keep.pyc', patterns))
+        self.assertFalse(is_ignored(os.path.join('src', 'x.pyc'), patterns))
+        self.assertFalse(is_ignored('src', patterns))
+        patterns = ['**/*.pyc', 'docs/[!a]*']
+        self.assertTrue(is_ignored('x.pyc', patterns))
+        self.assertTrue(is_ignored(os.path.join('a', 'b', 'x.pyc'), patterns))
+        self.assertTrue(is_ignored(os.path.join('docs', 'build'), patterns))
+        self.assertFalse(is_ignored(os.path.join('docs', 'api'), patterns))
+
+
+class TestContextTar(TestCase):
+    def setUp(self):
+        self.context = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.context)
+        os.makedirs(os.path.join(self.context, 'src', 'build'))
+        self.files = {
+            'Dockerfile': b'FROM base\n',
+            '.dockerignore': b'**/build\n',
+            os.path.join('src', 'empty'): b'',
+            os.path.join('src', 'big'): os.urandom(300000),
+            os.path.join('src', 'build', 'output'): b'junk'}
+        for name, content in self.files.items():
+            with open(os.path.join(self.context, name), 'wb') as f:
+                f.write(content)
+        os.chmod(os.path.join(self.context, 'src', 'empty'), 0o755)
+        os.symlink('big', os.path.join(self.context, 'src', 'link'))
+
+    def read_tar(self, chunks, mode='r'):
+        archive = tarfile.open(fileobj=io.BytesIO(b''.join(chunks)), mode=mode)
+        members = {member.name: member for member in archive}
+        contents = {
+            name: archive.extractfile(member).read()
+            for name, member in members.items() if member.isreg()}
+        return members, contents
+
+    def test_tar(self):
+        chunks = list(iter_context_tar(self.context, chunk_size=4096))
+        # Chunks stay close to the size asked for, whatever the file sizes:
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 8192)
+        members, contents = self.read_tar(chunks)
+        self.assertEqual(
+            sorted(members),
+            ['.dockerignore', 'Dockerfile', 'src', 'src/big', 'src/empty',
+             'src/link'])
+        self.assertTrue(members['src'].isdir())
+        self.assertEqual(members['src/link'].linkname, 'big')
+        self.assertEqual(members['src/empty'].mode, 0o755)
+        for name, content in contents.items():
+            self.assertEqual(content, self.files[name.replace('/', os.sep)])
+
+    def test_gzip(self):
+        chunks = list(iter_context_tar(self.context, gzip=True))
+        self.assertEqual(chunks[0][:2], b'\x1f\x8b')
+        members, contents = self.read_tar(chunks, 'r:gz')
+        self.assertEqual(contents['src/big'], self.files['src/big'.replace(
+            '/', os.sep)])
+
+    def test_file_changing_size(self):
+        path = os.path.join(self.context, 'src', 'big')
+        chunks = iter_context_tar(self.context, chunk_size=1024)
+        # Read on until we're part way through the file, then shrink it:
+        read = []
+        while sum(len(chunk) for chunk in read) < 8192:
+            read.append(next(chunks))
+        with open(path, 'wb') as f:
+            f.write(b'less')
+        members, contents = self.read_tar(read + list(chunks))
+        # The size in the header still holds, so later members are intact:
+        self.assertEqual(len(contents['src/big']), 300000)
+        self.assertEqual(contents['src/empty'], b'')
+        self.assertEqual(members['src/link'].linkname, 'big')
+
+
+class TestBuildIndex(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.context = os.path.join(self.temp_dir, 'context')
+        os.makedirs(os.path.join(self.context, 'build'))
+        self.write('Dockerfile', 'FROM base\n')
+        self.write('.dockerignore', 'build\n*.log\n')
+        self.write('app.py', 'print(1)\n')
+        self.write(os.path.join('build', 'output'), 'junk')
+        self.docker_client = MagicMock(spec=docker.Client)
+        self.docker_client.inspect_image.side_effect = (
+            lambda name: {'Id': name + '-id'})
+        self.image = Image(self.docker_client, 'repo/app', self.context)
+        self.index_path = os.path.join(self.temp_dir, 'index.json')
+
+    def write(self, name, content, age=60):
+        path = os.path.join(self.context, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        # Stay clear of the window in which stat information isn't trusted:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def test_iter_context_files(self):
+        self.write('debug.log', '')
+        self.assertEqual(
+            [relative for relative, _ in iter_context_files(self.context)],
+            ['.dockerignore', 'Dockerfile', 'app.py'])
+
+    def test_context_hash(self):
+        index = BuildIndex(self.index_path)
+        context_hash = index.get_context_hash(self.image)
+        self.assertEqual(index.get_context_hash(self.image), context_hash)
+        # Ignored files don't matter:
+        self.write('debug.log', 'lots')
+        self.write(os.path.join('build', 'output'), 'more junk')
+        self.assertEqual(index.get_context_hash(self.image), context_hash)
+        # But anything else does:
+        self.write('app.py', 'print(2)\n')
+        changed_hash = index.get_context_hash(self.image)
+        self.assertNotEqual(changed_hash, context_hash)
+        os.chmod(os.path.join(self.context, 'app.py'), 0o755)
+        self.assertNotEqual(index.get_context_hash(self.image), changed_hash)
+        # As do the images it's built from:
+        self.docker_client.inspect_image.side_effect = (
+            lambda name: {'Id': 'new-' + name})
+        self.assertNotEqual(index.get_context_hash(self.image), changed_hash)
+
+    def test_unchanged_files_are_not_rehashed(self):
+        index = BuildIndex(self.index_path)
+        context_hash = index.get_context_hash(self.image)
+        index.save()
+        with patch('decking.context._hash_file') as hash_file:
+            index = BuildIndex(self.index_path)
+            self.assertEqual(index.get_context_hash(self.image), context_hash)
+            self.assertFalse(hash_file.called)
+            # Recently modified files are always hashed:
+            self.write('app.py', 'print(2)\n', age=0)
+            hash_file.return_value = 'digest'
+            index.get_context_hash(self.image)
+            hash_file.assert_called_once_with(
+                os.path.join(self.context, 'app.py'))
+
+    def test_forgets_missing_files(self):
+        index = BuildIndex(self.index_path)
+        index.get_context_hash(self.image)
+        os.remove(os.path.join(self.context, 'app.py'))
+        index.get_context_hash(self.image)
+        index.save()
+        index = BuildIndex(self.index_path)
+        self.assertNotIn(os.path.join(self.context, 'app.py'), index._files)
+        self.assertIn(os.path.join(self.context, 'Dockerfile'), index._files)
+
+    def test_build_skips_unchanged_context(self):
+        self.docker_client.build.return_value = []
+        index = BuildIndex(self.index_path)
+        self.assertTrue(self.image.build(build_index=index))
+        self.assertFalse(self.image.build(build_index=index))
+        self.assertEqual(self.docker_client.build.call_count, 1)
+        self.assertTrue(self.image.build(build_index=index, force=True))
+        self.assertEqual(self.docker_client.build.call_count, 2)
+        # Changing the context means building again:
+        self.write('app.py', 'print(2)\n')
+        self.assertTrue(self.image.build(build_index=index))
+        # As does the image being replaced behind our back:
+        self.docker_client.inspect_image.side_effect = (
+            lambda name: {'Id': 'other-' + name})
+        self.assertTrue(self.image.build(build_index=index))
+        self.assertFalse(self.image.build(build_index=index))
@@ -1,11 +1,28 @@
 from unittest import TestCase
-from mock import MagicMock
+from mock import MagicMock, call, patch
 import os
+import re
+import json
+import shutil
+import tempfile
+import threading
 from copy import deepcopy
 import docker
+import yaml
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
 
 from ..runner import Decking
-from ..main import _read_config
+from ..components import OperationError
+from ..main import (
+    _read_config, _load_config_data, _get_attach_options,
+    _make_metrics_reporter)
+from ..tracing import start_tracing, stop_tracing
+from .test_registry import RegistryServer
 
 here = os.path.dirname(__file__)
 
@@ -29,6 +46,17 @@ class TestDecking(TestCase):
         # Protect tests from interfering by mutating config:
         self.decking_config = deepcopy(self._decking_config)
         self.docker_client = MagicMock(spec=docker.Client)
+        self.docker_client.inspect_image.return_value = {'Id': 'some-id'}
+        # Keep the build index out of the real cache directory:
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        env = patch.dict(os.environ, {'DECKING_CACHE_DIR': cache_dir})
+        env.start()
+        self.addCleanup(env.stop)
+        # Don't go looking for registries:
+        registry_client = patch('decking.runner.RegistryClient')
+        registry_client.start().return_value.get_digest.return_value = None
+        self.addCleanup(registry_client.stop)
 
     def test_config_processing(self):
         base_path = os.path.join(os.sep, 'somewhere')
@@ -42,6 +70,11 @@ class TestDecking(TestCase):
         self.assertEqual(cont.name, 'alice')
         self.assertIs(cont.image, decking.images['repo/alice'])
         self.assertEqual(cont.port_bindings, {'1234': '2345'})
+        self.assertEqual(
+            [str(probe) for probe in cont.readiness_check.probes],
+            ["log '^listening'", 'tcp 2345'])
+        self.assertEqual(cont.readiness_check.timeout, 30)
+        self.assertIsNone(decking.containers['bob1'].readiness_check)
         cont = decking.containers['bob1']
         self.assertEqual(cont.environment, {'SOME_VAR': "'hello world'"})
         self.assertEqual(cont.net, 'host')
@@ -69,28 +102,130 @@ class TestDecking(TestCase):
             decking.groups['additional_config'])
 
     def test_live_container_info(self):
-        live_data = [
-            {
-                u'Status': u'', u'Created': 1412867823,
-                u'Image': u'repo/alice_image:latest', u'Ports': [],
-                u'Command': u'ping localhost',
-                u'Names': [u'/alice'],
-                u'Id': u'183612dfe2c984e7363417dd7deb6c7a23e5eecfa5d5d9433be8',
-            },
-            {
-                u'Status': u'', u'Created': 1412867769,
-                u'Image': u'repo/bob1:latest', u'Ports': [],
-                u'Command': u'ping localhost',
-                u'Names': [u'/bob1'],
-                u'Id': u'7295655e7ff050bddbac5d72e5dc289eb1fad8fd008e2e0ed552',
-            }
-        ]
-        self.docker_client.containers.return_value = live_data
+        labelled = {
+            u'Status': u'', u'Created': 1412867823,
+            u'Image': u'repo/alice_image:latest', u'Ports': [],
+            u'Command': u'ping localhost',
+            u'Names': [u'/alice'],
+            u'Labels': {u'io.decking.project': u'project_name'},
+            u'Id': u'183612dfe2c984e7363417dd7deb6c7a23e5eecfa5d5d9433be8',
+        }
+        unlabelled = {
+            u'Status': u'', u'Created': 1412867769,
+            u'Image': u'repo/bob1:latest', u'Ports': [],
+            u'Command': u'ping localhost',
+            u'Names': [u'/bob1'],
+            u'Id': u'7295655e7ff050bddbac5d72e5dc289eb1fad8fd008e2e0ed552',
+        }
+        def containers(all, filters):
+            if 'label' in filters:
+                return [labelled]
+            return [unlabelled]
+        self.docker_client.containers.side_effect = containers
         decking = Decking(
-            self.decking_config, docker_client=self.docker_client)
+            self.decking_config, docker_client=self.docker_client,
+            project='project_name')
+        # Nothing is looked up until we operate on a cluster:
+        self.assertFalse(self.docker_client.containers.called)
+        decking.status('vanilla')
         self.assertTrue(decking.containers['alice'].created)
         self.assertTrue(decking.containers['bob1'].created)
         self.assertFalse(decking.containers['bob2'].created)
+        self.assertEqual(self.docker_client.containers.call_args_list, [
+            call(all=True, filters={
+                'label': 'io.decking.project=project_name'}),
+            call(all=True, filters={'name': ['^/bob1$', '^/bob2$']})])
+        # Only the containers we haven't looked up yet:
+        decking.status('with_group')
+        self.assertEqual(self.docker_client.containers.call_count, 2)
+
+    def test_converge_looks_up_containers_again(self):
+        decking = Decking(self.decking_config, '', self.docker_client)
+        self.docker_client.containers.return_value = []
+        self.docker_client.create_container.side_effect = (
+            lambda image, name, **kwargs: {'Id': name})
+        decking.status('vanilla')
+        calls = self.docker_client.containers.call_count
+        with patch('decking.components.Container.wait_until_ready'):
+            created = decking.converge('vanilla')
+        self.assertGreater(self.docker_client.containers.call_count, calls)
+        self.assertEqual(
+            sorted(container.name for container in created),
+            sorted(container.name for container in decking.clusters[
+                'vanilla'].containers))
+
+    def test_stop_warns_about_containers_not_created(self):
+        self.docker_client.containers.return_value = [{
+            u'Status': u'Up', u'Ports': [], u'Names': [u'/alice'],
+            u'Id': u'183612dfe2c984e7363417dd7deb6c7a23e5eecfa5d5d9433be8'}]
+        decking = Decking(
+            self.decking_config, docker_client=self.docker_client)
+        self.assertIsNone(decking.stop('vanilla', jobs=2))
+        self.docker_client.stop.assert_called_once_with(
+            decking.containers['alice']._docker_container_info, timeout=8)
+        self.docker_client.stop.side_effect = RuntimeError('for test')
+        with self.assertRaises(OperationError) as context:
+            decking.stop('vanilla')
+        self.assertEqual(
+            list(context.exception.errors), [decking.containers['alice']])
+
+    def test_tracing(self):
+        self.docker_client.containers.return_value = [{
+            u'Status': u'Up', u'Ports': [], u'Names': [u'/alice'],
+            u'Id': u'183612dfe2c984e7363417dd7deb6c7a23e5eecfa5d5d9433be8'}]
+        tracer = start_tracing()
+        self.addCleanup(stop_tracing)
+        decking = Decking(
+            self.decking_config, docker_client=self.docker_client)
+        decking.stop('vanilla', jobs=2)
+        self.docker_client.stop.assert_called_once_with(
+            decking.containers['alice']._docker_container_info, timeout=8)
+        events = [
+            event for event in tracer.get_trace()['traceEvents']
+            if event['ph'] == 'X']
+        self.assertEqual([event['name'] for event in events], [
+            'Decking.stop', 'Decking._populate_live_container_info',
+            'docker.containers', 'docker.containers', 'Cluster.stop',
+            'Container.stop', 'Container.stop', 'Container.stop',
+            'docker.stop'])
+        # Only alice was created to be stopped:
+        self.assertEqual(
+            sorted(
+                (event['args']['name'], 'error' in event['args'])
+                for event in events if event['name'] == 'Container.stop'),
+            [('alice', False), ('bob1', True), ('bob2', True)])
+
+    def test_attach_options(self):
+        opts = {'--log-buffer': '10', '--log-policy': 'sample'}
+        self.assertEqual(
+            _get_attach_options(opts), {'max_lines': 10, 'policy': 'sample'})
+        for value in '0', 'foo':
+            opts['--log-buffer'] = value
+            self.assertRaisesRegexp(
+                ValueError, '--log-buffer', _get_attach_options, opts)
+        opts = {'--log-buffer': '10', '--log-policy': 'tosh'}
+        self.assertRaisesRegexp(
+            ValueError, '--log-policy', _get_attach_options, opts)
+
+    def test_metrics_options(self):
+        opts = {
+            '--metrics-port': None, '--metrics-file': None,
+            '--metrics-interval': '10'}
+        self.assertIsNone(_make_metrics_reporter(opts))
+        opts['--metrics-file'] = 'metrics.jsonl'
+        reporter = _make_metrics_reporter(opts)
+        self.assertEqual(reporter.filename, 'metrics.jsonl')
+        self.assertEqual(reporter.interval, 10)
+        self.assertIsNone(reporter.address)
+        for value in '0', 'often':
+            opts['--metrics-interval'] = value
+            self.assertRaisesRegexp(
+                ValueError, '--metrics-interval', _make_metrics_reporter,
+                opts)
+        opts['--metrics-interval'] = '1'
+        opts['--metrics-port'] = 'http'
+        self.assertRaisesRegexp(
+            ValueError, '--metrics-port', _make_metrics_reporter, opts)
 
     def image_operation_helper(self, method_name, ordered, *args, **kwargs):
         base_path = os.path.join(here, 'data')
@@ -115,6 +250,18 @@ class TestDecking(TestCase):
     def test_build(self):
         self.image_operation_helper('build', ordered=True)
 
+    def test_build_concurrently(self):
+        decking = self.image_operation_helper('build', False, jobs=3)
+        self.docker_client.build.side_effect = RuntimeError('for test')
+        with patch('decking.runner.term') as term:
+            with self.assertRaises(OperationError) as context:
+                decking.build('all', jobs=3, force=True)
+        term.print_error.assert_any_call(
+            "build failed for image 'repo/alice'", 'for test')
+        self.assertCountEqual(
+            context.exception.errors,
+            [decking.images['repo/' + n] for n in ('alice', 'bob', 'unused')])
+
     def test_push(self):
         decking = self.image_operation_helper(
             'push', False, 'some-repo.domain.com')
@@ -122,3 +269,195 @@ class TestDecking(TestCase):
 
     def test_pull(self):
         self.image_operation_helper('pull', ordered=False)
+
+    def test_push_pull_concurrently(self):
+        def transfer(name, **kwargs):
+            if not name.endswith('alice'):
+                raise RuntimeError('no ' + name)
+            return []
+        for method_name in 'push', 'pull':
+            decking = self.image_operation_helper(
+                method_name, False, 'some-repo.domain.com', jobs=4)
+            getattr(self.docker_client, method_name).side_effect = transfer
+            with self.assertRaises(OperationError) as context:
+                getattr(decking, method_name)(
+                    'all', 'some-repo.domain.com', jobs=4)
+            self.assertCountEqual(
+                context.exception.errors,
+                [decking.images['repo/' + n] for n in ('bob', 'unused')])
+            self.assertIn(
+                'no some-repo.domain.com/repo/bob', str(context.exception))
+
+
+class TestLoadConfigData(TestCase):
+    def test_json(self):
+        self.assertEqual(
+            _load_config_data(b' {"images": {"a": "./a"}}'),
+            {'images': {'a': './a'}})
+
+    def test_yaml(self):
+        self.assertEqual(
+            _load_config_data(b'images:\n  a: ./a\n'),
+            {'images': {'a': './a'}})
+        # YAML flow mappings look like JSON, but aren't:
+        self.assertEqual(
+            _load_config_data(b'{images: {a: ./a}}'),
+            {'images': {'a': './a'}})
+
+    def test_yaml_is_loaded_safely(self):
+        self.assertRaises(
+            yaml.YAMLError, _load_config_data,
+            b'images: !!python/object/apply:os.getcwd []')
+
+
+class TransferHandler(BaseHTTPRequestHandler):
+    '''Stands in for the image transfer endpoints of the Docker daemon,
+    streaming a few progress messages for each push or pull, or an error for
+    images named in the server's 'failing' set. Images are inspected as
+    having the server's 'repo_digests', keyed by image name.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, name):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        if name in self.server.failing:
+            messages = [{'error': 'no ' + name}]
+        else:
+            messages = [
+                {'status': 'Pushing', 'id': 'layer', 'progress': str(i)}
+                for i in range(3)]
+        for message in messages:
+            data = json.dumps(message).encode('utf-8') + b'\r\n'
+            self.wfile.write(
+                '{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        path, _, query = self.path.partition('?')
+        path = re.sub(r'^/v[0-9.]+', '', path)
+        self.server.requests.append((self.command, path))
+        if path == '/containers/json':
+            self._send_json(200, [])
+        elif path == '/images/create':
+            params = dict(pair.split('=', 1) for pair in query.split('&'))
+            self._send_stream(params['fromImage'].replace('%2F', '/'))
+        elif path.endswith('/push'):
+            self._send_stream(path[len('/images/'):-len('/push')])
+        elif path.endswith('/tag'):
+            self._send_json(201, {})
+        elif path.endswith('/json') and path.startswith('/images/'):
+            name = path[len('/images/'):-len('/json')]
+            self._send_json(200, {
+                'Id': 'sha256:' + name, 'Size': 2 ** 20,
+                'RepoDigests': self.server.repo_digests.get(name, [])})
+        elif self.command == 'DELETE':
+            self._send_json(200, [])
+        else:
+            self._send_json(404, {'message': 'not found'})
+
+    do_GET = do_POST = do_DELETE = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class TransferServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), TransferHandler)
+        self.requests = []
+        self.failing = set()
+        self.repo_digests = {}
+
+
+class TestImageTransfers(TestCase):
+    '''Pushes and pulls images through a real Docker client talking to HTTP
+    stand-ins for the daemon and a registry.
+    '''
+    def setUp(self):
+        self.registry_server = RegistryServer()
+        self.registry_server.start()
+        self.addCleanup(self.registry_server.stop)
+        self.registry = self.registry_server.address
+        self.server = TransferServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        client = docker.Client(
+            base_url='http://127.0.0.1:{}'.format(
+                self.server.server_address[1]),
+            version='1.19')
+        path = os.path.join(here, 'data', 'example_decking_file.json')
+        self.decking = Decking(
+            _read_config(path), os.path.dirname(path), client)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def requests(self, method, suffix):
+        return sorted(
+            path for m, path in self.server.requests
+            if m == method and path.endswith(suffix))
+
+    def test_push_concurrently(self):
+        self.server.failing.add(self.registry + '/repo/unused')
+        with self.assertRaises(OperationError) as context:
+            self.decking.push('all', self.registry, jobs=3)
+        self.assertEqual(
+            list(context.exception.errors),
+            [self.decking.images['repo/unused']])
+        self.assertEqual(self.requests('POST', '/push'), [
+            '/images/{}/repo/{}/push'.format(self.registry, name)
+            for name in ('alice', 'bob', 'unused')])
+        # The registry tags of the images that were pushed are removed again:
+        self.assertEqual(len(self.requests('DELETE', '')), 2)
+
+    def test_pull_concurrently(self):
+        processed = self.decking.pull('vanilla', self.registry, jobs=3)
+        self.assertEqual(
+            sorted(image.name for image in processed),
+            ['repo/alice', 'repo/bob'])
+        self.assertEqual(len(self.requests('POST', '/images/create')), 2)
+        self.assertEqual(self.requests('POST', '/tag'), [
+            '/images/{}/repo/{}/tag'.format(self.registry, name)
+            for name in ('alice', 'bob')])
+
+    def test_skip_up_to_date(self):
+        for name in 'alice', 'bob':
+            self.registry_server.manifests['repo/{}:latest'.format(name)] = (
+                'sha256:' + name)
+        # We pushed alice before, but bob has changed since:
+        self.server.repo_digests['repo/alice'] = [
+            '{}/repo/alice@sha256:alice'.format(self.registry)]
+        self.server.repo_digests['repo/bob'] = [
+            '{}/repo/bob@sha256:old'.format(self.registry)]
+        for method_name in 'push', 'pull':
+            with patch('decking.runner.term') as term:
+                processed = getattr(self.decking, method_name)(
+                    'vanilla', self.registry, allow_insecure=True, jobs=2)
+            self.assertEqual(
+                sorted(image.name for image in processed),
+                ['repo/alice', 'repo/bob'])
+            summary, = term.print_step.call_args[0]
+            self.assertRegexpMatches(
+                summary, r'^{}ed 1 of 2 images in .*, skipping 1 up to date: '
+                'saved 1.0 MB and about .*s$'.format(method_name))
+        self.assertEqual(self.requests('POST', '/push'), [
+            '/images/{}/repo/bob/push'.format(self.registry)])
+        self.assertEqual(len(self.requests('POST', '/images/create')), 1)
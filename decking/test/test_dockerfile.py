@@ -0,0 +1,95 @@
+from unittest import TestCase
+from mock import patch
+
+import os
+import shutil
+import tempfile
+import time
+
+from decking.dockerfile import parse_dependencies, DockerfileCache
+
+
+class TestParseDependencies(TestCase):
+    def test_single_stage(self):
+        self.assertEqual(
+            parse_dependencies('# A comment\nfrom ubuntu\nRUN things\n'),
+            ['ubuntu'])
+        self.assertEqual(parse_dependencies('FROM scratch\n'), [])
+        self.assertEqual(parse_dependencies(''), [])
+
+    def test_multi_stage(self):
+        content = '\n'.join([
+            'FROM --platform=linux/amd64 repo/builder:1.0 AS build',
+            'RUN make',
+            'FROM build AS test',
+            'FROM repo/runtime',
+            'COPY --from=build /out /app',
+            'COPY --from=0 /out /app',
+            'COPY --chown=me --from=repo/assets /assets /assets',
+        ])
+        self.assertEqual(
+            parse_dependencies(content),
+            ['repo/builder:1.0', 'repo/runtime', 'repo/assets'])
+
+    def test_args(self):
+        content = '\n'.join([
+            'ARG REPO=repo',
+            'ARG VERSION="1.0"',
+            'ARG UNSET',
+            'FROM ${REPO}/base:$VERSION',
+            'FROM ${UNSET:-repo/default} AS stage',
+            'FROM ${UNSET:+never}',
+            # Only ARGs before the first FROM apply to FROM lines:
+            'ARG REPO=other',
+            'FROM $REPO/other',
+        ])
+        self.assertEqual(
+            parse_dependencies(content),
+            ['repo/base:1.0', 'repo/default', 'repo/other'])
+
+    def test_continuations(self):
+        content = '\n'.join([
+            'FROM \\',
+            '    # A comment within the instruction',
+            '    repo/base',
+            'RUN echo \\',
+            '  FROM not-an-image',
+        ])
+        self.assertEqual(parse_dependencies(content), ['repo/base'])
+        content = '# escape=`\nFROM `\n  repo/base\n'
+        self.assertEqual(parse_dependencies(content), ['repo/base'])
+
+
+class TestDockerfileCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.cache_path = os.path.join(self.temp_dir, 'cache', 'df.json')
+        self.dockerfile = os.path.join(self.temp_dir, 'Dockerfile')
+
+    def write(self, content, age=60):
+        with open(self.dockerfile, 'w') as f:
+            f.write(content)
+        mtime = time.time() - age
+        os.utime(self.dockerfile, (mtime, mtime))
+
+    def test_remembers_dependencies_between_runs(self):
+        self.write('FROM repo/a\n')
+        cache = DockerfileCache(self.cache_path)
+        self.assertEqual(cache.get_dependencies(self.dockerfile), ['repo/a'])
+        cache.save()
+        with patch('decking.dockerfile.parse_dockerfile') as parse:
+            cache = DockerfileCache(self.cache_path)
+            self.assertEqual(
+                cache.get_dependencies(self.dockerfile), ['repo/a'])
+            self.assertFalse(parse.called)
+        # Changing the file means parsing it again:
+        self.write('FROM repo/bb\n')
+        self.assertEqual(cache.get_dependencies(self.dockerfile), ['repo/bb'])
+
+    def test_doesnt_trust_recently_modified_files(self):
+        self.write('FROM repo/a\n', age=0)
+        cache = DockerfileCache(self.cache_path)
+        cache.get_dependencies(self.dockerfile)
+        cache.save()
+        self.assertFalse(os.path.exists(self.cache_path))
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+import threading
+
+from decking.logs import (
+    LogBuffer, END_OF_STREAM, BLOCK, DROP_OLDEST, SAMPLE)
+
+
+class TestLogBuffer(TestCase):
+    def fill(self, log_buffer, count, name='alice'):
+        for i in range(count):
+            log_buffer.put((name, str(i)))
+
+    def test_batches_by_container(self):
+        log_buffer = LogBuffer()
+        log_buffer.put(('alice', 'a1'))
+        log_buffer.put(('bob', 'b1'))
+        log_buffer.put(('alice', 'a2'))
+        log_buffer.put(('bob', END_OF_STREAM))
+        self.assertEqual(len(log_buffer), 3)
+        batch, ended, dropped = log_buffer.get_batch()
+        self.assertEqual(batch, [('alice', ['a1', 'a2']), ('bob', ['b1'])])
+        self.assertEqual(ended, ['bob'])
+        self.assertEqual(dropped, {})
+        self.assertEqual(len(log_buffer), 0)
+        self.assertEqual(log_buffer.get_batch(timeout=0), ([], [], {}))
+
+    def test_drop_oldest(self):
+        log_buffer = LogBuffer(max_lines=3, policy=DROP_OLDEST)
+        self.fill(log_buffer, 5)
+        self.assertEqual(
+            log_buffer.get_batch(),
+            ([('alice', ['2', '3', '4'])], [], {'alice': 2}))
+
+    def test_sample(self):
+        log_buffer = LogBuffer(max_lines=3, policy=SAMPLE, sample_every=4)
+        self.fill(log_buffer, 11)
+        # Lines 3 to 10 overflow, and only every fourth of those is kept:
+        self.assertEqual(
+            log_buffer.get_batch(),
+            ([('alice', ['2', '6', '10'])], [], {'alice': 8}))
+
+    def test_block(self):
+        log_buffer = LogBuffer(max_lines=2, policy=BLOCK)
+        self.fill(log_buffer, 2)
+        thread = threading.Thread(target=self.fill, args=(log_buffer, 2))
+        thread.daemon = True
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(
+            log_buffer.get_batch(), ([('alice', ['0', '1'])], [], {}))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(
+            log_buffer.get_batch(), ([('alice', ['0', '1'])], [], {}))
+        self.assertEqual(log_buffer.dropped['alice'], 0)
+
+    def test_dropped_is_a_snapshot(self):
+        log_buffer = LogBuffer(max_lines=1)
+        self.fill(log_buffer, 2)
+        _, _, dropped = log_buffer.get_batch()
+        self.fill(log_buffer, 2, 'bob')
+        self.assertEqual(dropped, {'alice': 1})
+        self.assertEqual(log_buffer.dropped, {'alice': 1, 'bob': 1})
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, LogBuffer, policy='tosh')
+        self.assertRaises(ValueError, LogBuffer, max_lines=0)
@@ -0,0 +1,124 @@
+from unittest import TestCase
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import urlopen, HTTPError
+
+from mock import Mock
+
+from decking.logs import LogBuffer, END_OF_STREAM
+from decking.metrics import AttachMetrics, MetricsReporter, format_prometheus
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAttachMetrics(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.metrics = AttachMetrics(clock=self.clock)
+        self.log_buffer = LogBuffer(max_lines=3)
+
+    def test_sample(self):
+        finished = threading.Thread(target=lambda: None)
+        finished.start()
+        finished.join()
+        running = threading.Event()
+        consumer = threading.Thread(target=running.wait)
+        consumer.start()
+        self.addCleanup(consumer.join)
+        self.addCleanup(running.set)
+        self.metrics.track(self.log_buffer, [finished, consumer])
+        self.metrics.track(state_cache=Mock(resyncs=3))
+
+        sample = self.metrics.sample()
+        self.assertEqual(sample['containers'], {})
+        self.assertEqual(sample['consumer_threads'], 1)
+        self.assertEqual(sample['reconnects'], 2)
+
+        for line in 'one', 'two', 'three', u'f\xf6ur', b'five':
+            self.log_buffer.put(('alice', line))
+        self.log_buffer.put(('bob', 'hello'))
+        self.log_buffer.put(('bob', END_OF_STREAM))
+        self.clock.now += 2
+        sample = self.metrics.sample()
+        self.assertEqual(sample['interval'], 2)
+        self.assertEqual(sample['queue_depth'], 4)
+        self.assertEqual(sample['dropped'], 2)
+        self.assertEqual(sample['containers']['alice'], {
+            'lines': 5, 'bytes': 20, 'dropped': 2,
+            'lines_per_second': 2.5, 'bytes_per_second': 10.0})
+        self.assertEqual(sample['containers']['bob'], {
+            'lines': 1, 'bytes': 5, 'dropped': 0,
+            'lines_per_second': 0.5, 'bytes_per_second': 2.5})
+
+        # Rates are only over the time since the last sample:
+        self.log_buffer.get_batch()
+        self.log_buffer.put(('alice', 'six'))
+        self.clock.now += 1
+        sample = self.metrics.sample()
+        self.assertEqual(sample['queue_depth'], 1)
+        self.assertEqual(sample['containers']['alice']['lines'], 6)
+        self.assertEqual(
+            sample['containers']['alice']['lines_per_second'], 1.0)
+        self.assertEqual(sample['containers']['bob']['lines_per_second'], 0)
+
+    def test_format_prometheus(self):
+        self.metrics.track(self.log_buffer)
+        self.log_buffer.put(('alice', 'hello'))
+        text = format_prometheus(self.metrics.sample())
+        self.assertIn(
+            '# TYPE decking_attach_lines_total counter\n'
+            'decking_attach_lines_total{container="alice"} 1\n', text)
+        self.assertIn('decking_attach_queue_depth 1\n', text)
+        self.assertIn('decking_attach_reconnects_total 0\n', text)
+
+
+class TestMetricsReporter(TestCase):
+    def setUp(self):
+        self.log_buffer = LogBuffer()
+        self.metrics = AttachMetrics()
+        self.metrics.track(self.log_buffer)
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.filename = os.path.join(temp_dir, 'metrics.jsonl')
+
+    def test_file(self):
+        with MetricsReporter(
+                self.metrics, interval=60, filename=self.filename).start():
+            self.log_buffer.put(('alice', 'hello'))
+        with open(self.filename) as metrics_file:
+            samples = [json.loads(line) for line in metrics_file]
+        # One when we start, and another when we stop:
+        self.assertEqual(len(samples), 2)
+        self.assertEqual(samples[0]['containers'], {})
+        self.assertEqual(samples[1]['containers']['alice']['lines'], 1)
+
+    def test_http(self):
+        reporter = MetricsReporter(self.metrics, interval=0.01, port=0)
+        with reporter.start():
+            self.log_buffer.put(('alice', 'hello'))
+            url = 'http://{}:{}'.format(*reporter.address)
+            while not reporter.latest['containers']:
+                threading.Event().wait(0.01)
+            sample = json.loads(
+                urlopen(url + '/metrics.json').read().decode('utf-8'))
+            self.assertEqual(sample['containers']['alice']['lines'], 1)
+            text = urlopen(url + '/metrics').read().decode('utf-8')
+            self.assertIn(
+                'decking_attach_lines_total{container="alice"} 1', text)
+            with self.assertRaises(HTTPError) as context:
+                urlopen(url + '/other')
+            self.assertEqual(context.exception.code, 404)
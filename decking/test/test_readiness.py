@@ -0,0 +1,162 @@
+from unittest import TestCase
+from mock import Mock, MagicMock
+
+import socket
+import threading
+import docker
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from decking.components import Image, Container
+from decking.readiness import (
+    TcpProbe, HttpProbe, LogProbe, ExecProbe, ReadinessCheck,
+    ContainerNotReadyError)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200 if self.path == '/health' else 503)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestProbes(TestCase):
+    def setUp(self):
+        self.container = Mock(spec=Container)
+        self.container.name = 'container_name'
+        self.container.ip_address = '127.0.0.1'
+
+    def test_tcp(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+        try:
+            self.assertTrue(TcpProbe(str(port)).check(self.container))
+            self.assertTrue(
+                TcpProbe('localhost:{}'.format(port)).check(self.container))
+        finally:
+            listener.close()
+        self.assertFalse(TcpProbe(str(port)).check(self.container))
+
+    def test_http(self):
+        server = HTTPServer(('127.0.0.1', 0), HealthHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        port = server.server_address[1]
+        try:
+            self.assertTrue(
+                HttpProbe('{}/health'.format(port)).check(self.container))
+            self.assertFalse(
+                HttpProbe('{}/booting'.format(port)).check(self.container))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertFalse(HttpProbe(str(port)).check(self.container))
+
+    def test_http_malformed_response(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        def respond():
+            connection, _ = listener.accept()
+            connection.recv(1024)
+            connection.sendall(b'garbage\r\n\r\n')
+            connection.close()
+        thread = threading.Thread(target=respond)
+        thread.daemon = True
+        thread.start()
+        try:
+            probe = HttpProbe(str(listener.getsockname()[1]))
+            self.assertFalse(probe.check(self.container))
+        finally:
+            listener.close()
+
+    def test_address_with_host_doesnt_inspect(self):
+        del self.container.ip_address
+        self.assertFalse(TcpProbe('127.0.0.1:1').check(self.container))
+
+    def test_log(self):
+        self.container.logs.return_value = (
+            '2015-06-01T12:00:00.123Z starting\n'
+            '2015-06-01T12:00:01.456Z listening on 80\n')
+        self.assertTrue(LogProbe('^listening').check(self.container))
+        self.assertFalse(LogProbe('^ready').check(self.container))
+
+    def test_log_only_fetches_new_lines(self):
+        probe = LogProbe('^ready')
+        self.container.logs.return_value = ''
+        self.assertFalse(probe.check(self.container))
+        self.container.logs.assert_called_with(since=None, timestamps=True)
+        self.container.logs.return_value = '2015-06-01T12:00:01.456Z booting'
+        self.assertFalse(probe.check(self.container))
+        self.container.logs.return_value = ''
+        self.assertFalse(probe.check(self.container))
+        self.container.logs.assert_called_with(
+            since=1433160001, timestamps=True)
+
+    def test_exec(self):
+        self.container.execute.side_effect = [1, 0]
+        probe = ExecProbe(['pg_isready'])
+        self.assertFalse(probe.check(self.container))
+        self.assertTrue(probe.check(self.container))
+        self.container.execute.assert_called_with(['pg_isready'])
+
+
+class TestReadinessCheck(TestCase):
+    def setUp(self):
+        self.container = Mock(spec=Container)
+        self.container.name = 'container_name'
+        self.probe = Mock()
+        self.clock = FakeClock()
+
+    def test_from_config(self):
+        check = ReadinessCheck.from_config(
+            {'tcp': '5432', 'exec': ['true'], 'timeout': 10})
+        self.assertEqual(
+            [type(probe) for probe in check.probes], [ExecProbe, TcpProbe])
+        self.assertEqual(check.timeout, 10)
+
+    def test_wait_backs_off(self):
+        self.probe.check.side_effect = [False] * 6 + [True]
+        check = ReadinessCheck([self.probe], interval=0.5, max_interval=4)
+        check.wait(self.container, self.clock, self.clock.sleep)
+        self.assertEqual(self.clock.sleeps, [0.5, 1, 2, 4, 4, 4])
+
+    def test_wait_times_out(self):
+        self.probe.check.return_value = False
+        self.probe.__str__ = Mock(return_value='tcp 5432')
+        check = ReadinessCheck([self.probe], timeout=10, interval=1)
+        with self.assertRaisesRegexp(
+                ContainerNotReadyError,
+                "'container_name' not ready after 10s: tcp 5432"):
+            check.wait(self.container, self.clock, self.clock.sleep)
+        self.assertEqual(self.clock.now, 10)
+
+    def test_container_start_waits(self):
+        docker_client = MagicMock(spec=docker.Client)
+        check = Mock(spec=ReadinessCheck)
+        container = Container(
+            docker_client, 'container_name', Image(None, 'image', 'path'),
+            readiness_check=check)
+        container.run()
+        self.assertTrue(docker_client.start.called)
+        check.wait.assert_called_once_with(container)
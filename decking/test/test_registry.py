@@ -0,0 +1,130 @@
+from unittest import TestCase
+
+import json
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+from decking.registry import RegistryClient, split_tag, DEFAULT_REGISTRY
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    '''Stands in for the manifest endpoint of a registry's V2 API, serving
+    the digests in the server's 'manifests', keyed by 'repository:tag'. If
+    the server has a 'token', manifests are only served to requests bearing
+    it, which can be had anonymously from '/token'.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, headers=(), body=b''):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _handle(self):
+        url = urlparse(self.path)
+        self.server.requests.append((self.command, self.path))
+        token = self.server.token
+        if url.path == '/token':
+            self.server.token_queries.append(parse_qs(url.query))
+            self._send(
+                200, [('Content-Type', 'application/json')],
+                json.dumps({'token': token}).encode('utf-8'))
+        elif token and self.headers.get('Authorization') != (
+                'Bearer ' + token):
+            realm = 'http://{}:{}/token'.format(*self.server.server_address)
+            self._send(401, [('WWW-Authenticate', (
+                'Bearer realm="{}",service="stand-in",'
+                'scope="repository:repo:pull"').format(realm))])
+        elif url.path.startswith('/v2/') and '/manifests/' in url.path:
+            repository, _, tag = url.path[len('/v2/'):].partition(
+                '/manifests/')
+            digest = self.server.manifests.get(repository + ':' + tag)
+            if digest:
+                self._send(200, [('Docker-Content-Digest', digest)])
+            else:
+                self._send(404)
+        else:
+            self._send(404)
+
+    do_GET = do_HEAD = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class RegistryServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RegistryHandler)
+        self.manifests = {}
+        self.token = None
+        self.requests = []
+        self.token_queries = []
+
+    @property
+    def address(self):
+        return '{}:{}'.format(*self.server_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestRegistryClient(TestCase):
+    def setUp(self):
+        self.server = RegistryServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.server.manifests['repo/app:latest'] = 'sha256:latest'
+        self.server.manifests['repo/app:1.0'] = 'sha256:one'
+        self.client = RegistryClient(self.server.address, allow_insecure=True)
+
+    def test_split_tag(self):
+        self.assertEqual(split_tag('repo/app'), ('repo/app', 'latest'))
+        self.assertEqual(split_tag('repo/app:1.0'), ('repo/app', '1.0'))
+        self.assertEqual(
+            split_tag('localhost:5000/app'), ('localhost:5000/app', 'latest'))
+
+    def test_get_digest(self):
+        self.assertEqual(self.client.get_digest('repo/app'), 'sha256:latest')
+        self.assertEqual(self.client.get_digest('repo/app:1.0'), 'sha256:one')
+        self.assertIsNone(self.client.get_digest('repo/other'))
+        # Having found HTTPS doesn't work, we stick to HTTP:
+        self.assertEqual(
+            [method for method, _ in self.server.requests], ['HEAD'] * 3)
+
+    def test_bearer_token(self):
+        self.server.token = 'secret'
+        self.assertEqual(self.client.get_digest('repo/app'), 'sha256:latest')
+        self.assertEqual(self.server.token_queries, [
+            {'service': ['stand-in'], 'scope': ['repository:repo:pull']}])
+
+    def test_unreachable(self):
+        client = RegistryClient(self.server.address)
+        # The stand-in doesn't speak HTTPS, and we aren't allowed HTTP:
+        self.assertIsNone(client.get_digest('repo/app'))
+        self.assertEqual(self.server.requests, [])
+
+    def test_official_images(self):
+        client = RegistryClient()
+        self.assertEqual(client.registry, DEFAULT_REGISTRY)
+        self.assertEqual(
+            client._get_repository_path('ubuntu'), 'library/ubuntu')
+        self.assertEqual(client._get_repository_path('repo/app'), 'repo/app')
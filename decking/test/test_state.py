@@ -0,0 +1,97 @@
+from unittest import TestCase
+from mock import MagicMock, patch
+
+import docker
+
+from decking.components import Image, Container, Cluster
+from decking.runner import Decking
+from decking.state import ContainerStateCache
+
+
+class TestContainerStateCache(TestCase):
+    def setUp(self):
+        self.docker_client = MagicMock(spec=docker.Client)
+        image = Image(self.docker_client, 'image_name', 'some/path')
+        self.alice = Container(self.docker_client, 'alice', image)
+        self.bob = Container(self.docker_client, 'bob', image)
+        self.decking = Decking(
+            {'images': {}, 'containers': {}, 'clusters': {}},
+            docker_client=self.docker_client)
+        self.decking.containers = {'alice': self.alice, 'bob': self.bob}
+        self.decking.clusters = {
+            'cluster': Cluster(
+                self.docker_client, 'cluster', [self.alice, self.bob])}
+        self.listed = {
+            'alice': {
+                'Id': 'alice_id', 'Names': ['/alice'], 'Status': 'Exited',
+                'Ports': []},
+            'bob': {
+                'Id': 'bob_id', 'Names': ['/bob'], 'Status': 'Up',
+                'Ports': []},
+        }
+        self.docker_client.containers.side_effect = self.containers
+        self.cache = ContainerStateCache(
+            self.decking, [self.alice, self.bob], retry_interval=0)
+
+    def containers(self, all, filters):
+        if 'id' in filters:
+            return [
+                info for info in self.listed.values()
+                if info['Id'] == filters['id']]
+        elif 'name' in filters:
+            return [
+                self.listed[name] for name in ('alice', 'bob')
+                if name in self.listed and
+                '^/{}$'.format(name) in filters['name']]
+        return []
+
+    def test_apply(self):
+        self.cache.resync()
+        self.assertEqual(self.bob._docker_container_info['Status'], 'Up')
+        self.cache.apply({'status': 'die', 'id': 'bob_id'})
+        self.assertEqual(self.bob._docker_container_info['Status'], 'Exited')
+        self.cache.apply(
+            {'Type': 'container', 'Action': 'destroy', 'id': 'bob_id'})
+        self.assertFalse(self.bob.created)
+        self.listed['bob'] = {
+            'Id': 'new_bob_id', 'Names': ['/bob'], 'Status': 'Created',
+            'Ports': []}
+        self.cache.apply({'status': 'create', 'id': 'new_bob_id'})
+        self.assertEqual(self.bob.id, 'new_bob_id')
+        self.cache.apply({'status': 'start', 'id': 'new_bob_id'})
+        self.assertEqual(self.bob._docker_container_info['Status'], 'Up')
+        # Other containers' events are ignored:
+        self.cache.apply({'status': 'die', 'id': 'someone_elses'})
+        self.assertEqual(self.alice._docker_container_info['Status'], 'Exited')
+
+    def test_resyncs_after_reconnect(self):
+        streams = [
+            iter([{'status': 'die', 'id': 'bob_id'}]),
+            IOError('connection refused'),
+            iter([{'status': 'start', 'id': 'alice_id'}])]
+        def events(decode, filters):
+            self.assertEqual(filters, {'container': ['alice', 'bob']})
+            stream = streams.pop(0)
+            if isinstance(stream, Exception):
+                # While we can't connect, alice is started:
+                self.listed['alice'] = dict(self.listed['alice'], Status='Up')
+                raise stream
+            if not streams:
+                self.cache.stop()
+            return stream
+        self.docker_client.events.side_effect = events
+        with patch('decking.state.term') as term:
+            self.cache.run()
+        self.assertEqual(self.cache.resyncs, 2)
+        self.assertTrue(term.print_warning.called)
+        # Found by resyncing, rather than from the final event, which arrived
+        # after we were stopped:
+        self.assertEqual(self.alice._docker_container_info['Status'], 'Up')
+        self.assertEqual(self.bob._docker_container_info['Status'], 'Up')
+
+    def test_resync_forgets_removed_containers(self):
+        self.cache.resync()
+        del self.listed['bob']
+        self.cache.resync()
+        self.assertTrue(self.alice.created)
+        self.assertFalse(self.bob.created)
@@ -0,0 +1,39 @@
+from unittest import TestCase
+from mock import Mock
+
+from decking.terminal import Terminal
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPrefixedTerminal(TestCase):
+    def setUp(self):
+        self.term = Mock(spec=Terminal)
+        self.clock = FakeClock()
+        self.prefixed = Terminal.prefixed(self.term, 'image')
+        self.prefixed._clock = self.clock
+
+    def printed(self):
+        return [args[0] for args, _ in self.term.print_line.call_args_list]
+
+    def test_prefixes(self):
+        self.prefixed.print_line('hello', 'world')
+        self.prefixed.prefixed('inner').print_line('hello')
+        self.assertEqual(
+            self.printed(), ['image: hello world', 'image: inner: hello'])
+
+    def test_throttles_progress(self):
+        for i in range(5):
+            self.prefixed.replace_line('Pushing (abc): {}'.format(i))
+        self.clock.now = 2
+        self.prefixed.replace_line('Pushing (abc): 5')
+        self.prefixed.replace_line('Pushed (abc): 6')
+        self.assertEqual(self.printed(), [
+            'image: Pushing (abc): 0', 'image: Pushing (abc): 5',
+            'image: Pushed (abc): 6'])
@@ -0,0 +1,111 @@
+from unittest import TestCase
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from mock import MagicMock
+
+from decking import tracing
+from decking.tracing import (
+    Tracer, TracingClient, span, traced, trace_client, start_tracing,
+    stop_tracing)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        self.now += 0.5
+        return self.now
+
+
+class Thing(object):
+    name = 'thing'
+
+    @traced
+    def work(self, result):
+        with span('inner', size=3):
+            return result
+
+    @traced
+    def fail(self):
+        raise ValueError('oops')
+
+
+class TestTracing(TestCase):
+    def setUp(self):
+        self.tracer = start_tracing(Tracer(clock=Clock()))
+        self.addCleanup(stop_tracing)
+
+    def get_events(self):
+        return [
+            event for event in self.tracer.get_trace()['traceEvents']
+            if event['ph'] == 'X']
+
+    def test_spans(self):
+        self.assertEqual(Thing().work(42), 42)
+        outer, inner = self.get_events()
+        self.assertEqual(outer['name'], 'Thing.work')
+        self.assertEqual(outer['args'], {'name': 'thing'})
+        self.assertEqual(outer['ts'], 100.5e6)
+        self.assertEqual(outer['dur'], 1.5e6)
+        self.assertEqual(inner['name'], 'inner')
+        self.assertEqual(inner['args'], {'size': 3})
+        self.assertEqual(inner['ts'], 101e6)
+        self.assertEqual(inner['dur'], 0.5e6)
+        self.assertEqual(outer['tid'], threading.current_thread().ident)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, Thing().fail)
+        event, = self.get_events()
+        self.assertEqual(event['args']['error'], "ValueError('oops')")
+
+    def test_threads(self):
+        thread = threading.Thread(target=Thing().work, args=(1,), name='t1')
+        thread.start()
+        thread.join()
+        Thing().work(2)
+        thread_names = {
+            event['tid']: event['args']['name']
+            for event in self.tracer.get_trace()['traceEvents']
+            if event['ph'] == 'M'}
+        self.assertEqual(thread_names, {
+            thread.ident: 't1',
+            threading.current_thread().ident:
+                threading.current_thread().name})
+
+    def test_client(self):
+        docker_client = MagicMock()
+        docker_client.inspect_container.return_value = {'Id': 'abc'}
+        docker_client.base_url = 'http://example'
+        client = trace_client(docker_client)
+        self.assertIsInstance(client, TracingClient)
+        self.assertEqual(client.base_url, 'http://example')
+        self.assertEqual(client.inspect_container('web'), {'Id': 'abc'})
+        event, = self.get_events()
+        self.assertEqual(event['name'], 'docker.inspect_container')
+        self.assertEqual(event['cat'], 'docker')
+        self.assertEqual(event['args'], {'target': 'web'})
+
+    def test_save(self):
+        Thing().work(1)
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        filename = os.path.join(temp_dir, 'trace.json')
+        self.tracer.save(filename)
+        with open(filename) as trace_file:
+            self.assertEqual(json.load(trace_file), self.tracer.get_trace())
+
+
+class TestNotTracing(TestCase):
+    def test_nothing_recorded(self):
+        self.assertIsNone(tracing._tracer)
+        docker_client = MagicMock()
+        self.assertIs(trace_client(docker_client), docker_client)
+        self.assertIs(span('a'), span('b'))
+        self.assertEqual(Thing().work(42), 42)
+        self.assertIsNone(stop_tracing())
@@ -0,0 +1,103 @@
+from unittest import TestCase, skipIf
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+
+import requests
+
+from decking.transport import PooledClient
+
+
+class VersionHandler(BaseHTTPRequestHandler):
+    '''Stands in for the Docker daemon's version endpoint, after the
+    server's 'delay', counting the connections made to it.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        data = json.dumps({'Version': '1.7.1'}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class VersionServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        UnixStreamServer.__init__(self, path, VersionHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.delay = 0
+
+
+@skipIf(not hasattr(socket, 'AF_UNIX'), 'needs unix sockets')
+class TestPooledClient(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.server = VersionServer(os.path.join(temp_dir, 'docker.sock'))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = PooledClient(
+            base_url='unix://' + self.server.server_address,
+            version='1.19', pool_size=4)
+
+    def call_concurrently(self, threads, calls):
+        def call():
+            for _ in range(calls):
+                self.client.version()
+        workers = [threading.Thread(target=call) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def test_connections_are_reused(self):
+        self.call_concurrently(1, 20)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_concurrent_calls_share_the_pool(self):
+        self.server.delay = 0.01
+        self.call_concurrently(4, 10)
+        self.assertLessEqual(self.server.connections, 4)
+        self.assertGreater(self.server.connections, 1)
+
+    def test_call_timeout(self):
+        self.server.delay = 0.5
+        with self.client.call_timeout(0.1):
+            self.assertRaises(requests.Timeout, self.client.version)
+        # Only for the calls we make within the block:
+        self.assertEqual(self.client.version()['Version'], '1.7.1')
+        kwargs = {}
+        with self.client.call_timeout(5):
+            other_thread = threading.Thread(
+                target=self.client._set_request_timeout, args=(kwargs,))
+            other_thread.start()
+            other_thread.join()
+        self.assertEqual(kwargs['timeout'], self.client.timeout)
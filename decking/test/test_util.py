@@ -1,9 +1,24 @@
 from unittest import TestCase
 
-from decking.util import undelimit_mapping, iter_dependencies
+import json
+
+from mock import Mock
+
+from decking.terminal import Terminal
+from decking.util import (
+    undelimit_mapping, iter_dependencies, iter_dependency_levels, make_pool,
+    call_concurrently, call_by_dependency, consume_stream, JSONStreamDecoder)
 
 
 class TestUtil(TestCase):
+    def assertCountEqual(self, *args, **kwargs):
+        try:
+            method = super(TestUtil, self).assertCountEqual
+        except AttributeError:
+            # Python <3
+            method = super(TestUtil, self).assertItemsEqual
+        return method(*args, **kwargs)
+
     def test_undelimit_mapping(self):
         self.assertEqual(
             undelimit_mapping(['a:b', 'c:d']),
@@ -30,3 +45,154 @@ class TestUtil(TestCase):
         with self.assertRaisesRegexp(RuntimeError, 'circular'):
             for item in iter_dependencies(data, get_item_dependencies):
                 pass
+
+    def test_iter_dependency_levels(self):
+        data = {
+            'a': ['b', 'c'],
+            'b': ['d'],
+            'c': ['d'],
+            'd': [],
+            'e': [],
+        }
+        self.assertEqual(
+            list(iter_dependency_levels(data, data.__getitem__)),
+            [{'d', 'e'}, {'b', 'c'}, {'a'}])
+
+    def test_call_by_dependency_critical_path_first(self):
+        data = {'x': [], 'y': [], 'a': [], 'b': ['a'], 'c': ['b']}
+        processed = []
+        results, errors = call_by_dependency(
+            processed.append, ['x', 'y', 'a', 'b', 'c'], data.__getitem__)
+        # Ties are broken by the order the items were given in:
+        self.assertEqual(processed, ['a', 'b', 'x', 'y', 'c'])
+
+    def test_dependency_diagnostics(self):
+        data = {'a': ['b'], 'b': ['c'], 'c': ['b'], 'd': ['a']}
+        with self.assertRaisesRegexp(
+                RuntimeError, "circular dependency: 'b' -> 'c' -> 'b'"):
+            list(iter_dependency_levels(sorted(data), data.__getitem__))
+        data = {'a': ['b'], 'b': ['nope']}
+        with self.assertRaisesRegexp(
+                RuntimeError, "Missing dependency 'nope' required by 'b'"):
+            list(iter_dependencies(data, data.__getitem__))
+
+    def test_iter_dependencies_long_chain(self):
+        length = 10000
+        order = list(iter_dependencies(
+            range(length), lambda i: [i + 1] if i + 1 < length else []))
+        self.assertEqual(order, list(reversed(range(length))))
+
+    def test_call_concurrently(self):
+        def func(item):
+            if item % 2:
+                raise ValueError(item)
+            return item * 10
+        for jobs in 1, 4:
+            with make_pool(jobs) as pool:
+                results, errors = call_concurrently(pool, func, range(6))
+            self.assertEqual(list(results.items()), [(0, 0), (2, 20), (4, 40)])
+            self.assertEqual(list(errors), [1, 3, 5])
+            self.assertIsInstance(errors[1], ValueError)
+
+    def test_make_pool(self):
+        with make_pool(1) as pool:
+            self.assertIsNone(pool)
+        with make_pool(3) as pool:
+            self.assertEqual(
+                sorted(pool.map(lambda i: i * 2, range(3))), [0, 2, 4])
+        self.assertRaises(ValueError, pool.apply_async, len, ('',))
+
+    def test_call_by_dependency(self):
+        data = {
+            'a': ['b'],
+            'b': ['c'],
+            'c': [],
+            'd': ['c'],
+            'e': [],
+        }
+        processed = []
+        def func(item):
+            if item == 'b':
+                raise ValueError(item)
+            for dependency in data[item]:
+                self.assertIn(dependency, processed)
+            processed.append(item)
+            return item.upper()
+        for jobs in 1, 4:
+            del processed[:]
+            results, errors = call_by_dependency(
+                func, sorted(data), data.__getitem__, jobs)
+            self.assertEqual(
+                dict(results), {'c': 'C', 'd': 'D', 'e': 'E'})
+            self.assertCountEqual(errors, ['a', 'b'])
+            self.assertIsInstance(errors['b'], ValueError)
+            self.assertIn("'b' failed", str(errors['a']))
+
+
+class TestConsumeStream(TestCase):
+    messages = [
+        {'stream': 'Step 1 : FROM ubuntu\n'},
+        {'status': 'Pulling fs layer', 'id': 'abc'},
+        {'status': 'Downloading', 'id': 'abc', 'progress': '[=>  ] 1 MB'},
+        {'status': 'Downloading', 'id': 'abc',
+         'progress': u'[==> ] 2 MB \xb7'},
+        {'status': 'Downloading', 'id': 'abc', 'progress': '[===>] 3 MB'},
+        {'status': 'Download complete', 'id': 'abc'},
+    ]
+
+    def get_stream(self):
+        return b''.join(
+            json.dumps(message).encode('utf-8') + b'\r\n'
+            for message in self.messages)
+
+    def test_decoder(self):
+        stream = self.get_stream()
+        for chunk_size in 1, 7, len(stream):
+            decoder = JSONStreamDecoder()
+            documents = []
+            for offset in range(0, len(stream), chunk_size):
+                documents.extend(
+                    decoder.feed(stream[offset:offset + chunk_size]))
+            documents.extend(decoder.flush())
+            self.assertEqual(documents, self.messages)
+
+    def test_decoder_incomplete(self):
+        decoder = JSONStreamDecoder()
+        self.assertEqual(decoder.feed(b'{"a": 1}{"b": [1, '), [{'a': 1}])
+        self.assertRaisesRegexp(ValueError, 'incomplete', decoder.flush)
+
+    def consume(self, chunks):
+        term = Mock(spec=Terminal)
+        consume_stream(chunks, term)
+        return term.method_calls
+
+    def test_one_message_per_chunk(self):
+        calls = self.consume(
+            json.dumps(message).encode('utf-8') for message in self.messages)
+        self.assertEqual([name for name, _, _ in calls], [
+            'print_line', 'print_line', 'replace_line', 'replace_line',
+            'replace_line', 'replace_line'])
+        self.assertEqual(calls[0][1], ('Step 1 : FROM ubuntu',))
+        self.assertEqual(
+            calls[3][1], (u'Downloading (abc): [==> ] 2 MB \xb7',))
+
+    def test_coalesced_and_split_messages(self):
+        stream = self.get_stream()
+        # Partway through the second progress update:
+        middle = stream.index(b'2 MB')
+        calls = self.consume([stream[:middle], stream[middle:]])
+        # Only progress immediately replaced within a chunk is skipped:
+        self.assertEqual([args for _, args, _ in calls], [
+            ('Step 1 : FROM ubuntu',),
+            ('Pulling fs layer (abc) ',),
+            ('Downloading (abc): [=>  ] 1 MB',),
+            ('Downloading (abc): [===>] 3 MB',),
+            ('Download complete (abc) ',)])
+        self.assertEqual(
+            [name for name, _, _ in self.consume([stream])],
+            ['print_line', 'print_line', 'replace_line', 'replace_line'])
+
+    def test_error(self):
+        self.assertRaisesRegexp(
+            RuntimeError, 'no space', self.consume,
+            [b'{"status": "Extracting", "id": "abc"}{"error": "no space"}'])
@@ -0,0 +1,163 @@
+'''Records how long each phase of an operation, and each call to the Docker
+daemon, takes, as Chrome trace events that can be opened in chrome://tracing
+or Perfetto. Tracing is off unless :func:`start_tracing` has been called, in
+which case it costs little more than checking that.
+'''
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+_tracer = None
+
+
+class Tracer(object):
+    '''Collects timed spans from every thread.'''
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._events = []
+        self._thread_names = {}
+        self._pid = os.getpid()
+
+    def span(self, name, category='decking', args=None):
+        ''':returns: a context manager recording a span named 'name', with
+            the given mapping of 'args', covering the code within it.
+        '''
+        return _Span(self, name, category, dict(args or {}))
+
+    def _record(self, name, category, args, start, end):
+        thread = threading.current_thread()
+        event = {
+            'name': name, 'cat': category, 'ph': 'X',
+            'ts': start * 1e6, 'dur': (end - start) * 1e6,
+            'pid': self._pid, 'tid': thread.ident}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+            self._thread_names.setdefault(thread.ident, thread.name)
+
+    def get_trace(self):
+        ''':returns: the spans recorded so far in Chrome's trace event
+            format.
+        '''
+        with self._lock:
+            events = sorted(self._events, key=lambda event: event['ts'])
+            thread_names = dict(self._thread_names)
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid,
+             'args': {'name': name}}
+            for tid, name in thread_names.items()]
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def save(self, filename):
+        with open(filename, 'w') as trace_file:
+            json.dump(self.get_trace(), trace_file)
+
+
+class _Span(object):
+    def __init__(self, tracer, name, category, args):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = self._tracer._clock()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is not None:
+            self._args['error'] = repr(error)
+        self._tracer._record(
+            self._name, self._category, self._args, self._start,
+            self._tracer._clock())
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        pass
+
+_null_span = _NullSpan()
+
+
+def start_tracing(tracer=None):
+    '''Starts recording spans with 'tracer', or a new :class:`Tracer`.
+
+    :returns: the tracer.
+    '''
+    global _tracer
+    _tracer = tracer or Tracer()
+    return _tracer
+
+
+def stop_tracing():
+    ''':returns: the tracer that was recording spans, if any.'''
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def span(name, category='decking', **args):
+    ''':returns: a context manager recording a span for the code within it,
+        if we're tracing.
+    '''
+    if _tracer is None:
+        return _null_span
+    return _tracer.span(name, category, args)
+
+
+def traced(method):
+    '''Decorates a method so that each call is recorded as a span, named for
+    the class of the object it's called on and the method, along with the
+    object's name if it has one.
+    '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _tracer is None:
+            return method(self, *args, **kwargs)
+        name = '{}.{}'.format(type(self).__name__, method.__name__)
+        span_args = {}
+        if isinstance(getattr(self, 'name', None), str):
+            span_args['name'] = self.name
+        with _tracer.span(name, args=span_args):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class TracingClient(object):
+    '''Wraps a Docker client, recording a span for every API call made
+    through it while we're tracing.
+    '''
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        def call(*args, **kwargs):
+            if _tracer is None:
+                return attribute(*args, **kwargs)
+            span_args = {}
+            if args and isinstance(args[0], str):
+                span_args['target'] = args[0]
+            with _tracer.span('docker.' + name, 'docker', span_args):
+                return attribute(*args, **kwargs)
+        return call
+
+
+def trace_client(client):
+    ''':returns: 'client', wrapped to record its API calls if we're
+        tracing.
+    '''
+    if _tracer is None:
+        return client
+    return TracingClient(client)
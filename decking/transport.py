@@ -0,0 +1,114 @@
+'''A Docker client that keeps a pool of connections to the daemon alive, so
+that concurrent operations can share it without setting up a connection for
+every request or queueing for a single one.
+'''
+import numbers
+import socket
+import threading
+from contextlib import contextmanager
+
+import docker
+import requests.adapters
+try:
+    import requests.packages.urllib3 as urllib3
+except ImportError:
+    import urllib3
+
+# Connections kept alive for each endpoint of the daemon we talk to. More
+# are made if more requests than this are in flight at once, e.g. when
+# attached to many containers, but only this many are kept:
+DEFAULT_POOL_SIZE = 10
+
+
+class _UnixConnection(urllib3.connection.HTTPConnection):
+    def __init__(self, socket_path, **kwargs):
+        super(_UnixConnection, self).__init__('localhost', **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, numbers.Number):
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+
+class _UnixConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    def __init__(self, socket_path, **kwargs):
+        super(_UnixConnectionPool, self).__init__('localhost', **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        return _UnixConnection(
+            self.socket_path, timeout=self.timeout.connect_timeout)
+
+
+class UnixAdapter(requests.adapters.HTTPAdapter):
+    '''Sends requests over a single pool of keep-alive connections to the
+    unix socket at 'socket_path'.
+    '''
+    def __init__(self, socket_path, pool_size=DEFAULT_POOL_SIZE):
+        super(UnixAdapter, self).__init__()
+        self.socket_path = socket_path
+        self.pool = _UnixConnectionPool(socket_path, maxsize=pool_size)
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def get_connection_with_tls_context(self, request, *args, **kwargs):
+        # What newer versions of requests call instead:
+        return self.pool
+
+    def request_url(self, request, proxies):
+        # The socket takes the place of the host:
+        return request.path_url
+
+    def close(self):
+        self.pool.close()
+
+
+class PooledClient(docker.Client):
+    '''A :class:`docker.Client` whose connections to the daemon are kept in
+    a pool of up to 'pool_size', shared by every thread using the client.
+    Timeouts may also be set for the calls made by one thread in a block of
+    code, with :meth:`call_timeout`.
+    '''
+    def __init__(self, base_url=None, pool_size=DEFAULT_POOL_SIZE, **kwargs):
+        super(PooledClient, self).__init__(base_url=base_url, **kwargs)
+        self.pool_size = pool_size
+        self._local = threading.local()
+        adapter = getattr(self, '_custom_adapter', None)
+        if hasattr(adapter, 'socket_path'):
+            self._custom_adapter = UnixAdapter(adapter.socket_path, pool_size)
+            for prefix, mounted in list(self.adapters.items()):
+                if mounted is adapter:
+                    self.mount(prefix, self._custom_adapter)
+            adapter.close()
+        else:
+            for prefix in 'http://', 'https://':
+                adapter = self.adapters.get(prefix)
+                if isinstance(adapter, requests.adapters.HTTPAdapter):
+                    # Keep more connections to the daemon than the default:
+                    adapter._pool_maxsize = pool_size
+                    adapter.init_poolmanager(
+                        adapter._pool_connections, pool_size,
+                        adapter._pool_block)
+
+    @contextmanager
+    def call_timeout(self, seconds):
+        '''Context manager within which the calls this thread makes time out
+        after 'seconds', rather than the client's default timeout.
+        '''
+        previous = getattr(self._local, 'timeout', None)
+        self._local.timeout = seconds
+        try:
+            yield
+        finally:
+            self._local.timeout = previous
+
+    def _set_request_timeout(self, kwargs):
+        # Calls that work out their own timeouts, like stop, keep them:
+        timeout = getattr(self._local, 'timeout', None)
+        if timeout is not None:
+            kwargs.setdefault('timeout', timeout)
+        return super(PooledClient, self)._set_request_timeout(kwargs)
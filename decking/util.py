@@ -1,4 +1,16 @@
+import codecs
+import heapq
+import itertools
 import json
+import re
+import struct
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 from decking.terminal import term
 
@@ -16,51 +28,409 @@ def undelimit_mapping(mapping_as_sequence, delimiter=':'):
     return dict(item.split(delimiter, 1) for item in mapping_as_sequence)
 
 
-def consume_stream(stream):
+def format_size(size):
+    ''':returns: 'size' in bytes, in the largest unit that keeps it above
+        one.
+    '''
+    for unit in 'B', 'KB', 'MB', 'GB':
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = 'TB'
+    if unit == 'B':
+        return '{} B'.format(size)
+    return '{:.1f} {}'.format(size, unit)
+
+
+def _is_superseded(item, next_item):
+    '''Whether 'item' is a progress update that 'next_item' replaces before
+    it could be seen.
+    '''
+    return (
+        'progress' in item and 'progress' in next_item and
+        item.get('status') == next_item.get('status') and
+        item.get('id') == next_item.get('id'))
+
+
+def consume_stream(stream, term=term):
+    '''Displays the JSON messages streamed by a build, push or pull. The
+    daemon may send several messages in one chunk, or split one across
+    chunks. Progress updates that the next message in the same chunk would
+    replace are skipped without being formatted.
+
+    :raises RuntimeError: if the daemon reports an error.
+    '''
+    decoder = JSONStreamDecoder()
     prev_status_id = None
-    for item in stream:
-        item = json.loads(item.decode('utf-8'))
-        if 'stream' in item:
-            for line in item['stream'].strip().splitlines():
-                term.print_line(line)
-        elif 'status' in item:
-            status = item.pop('status')
-            status_id = item.pop('id', None)
-            msg = status
-            if status_id:
-                msg += ' ({})'.format(status_id)
-            if prev_status_id == status_id:
-                call = term.replace_line
-            else:
-                call = term.print_line
-            if 'progress' in item:
-                msg += ': ' + item['progress']
+    for chunk in itertools.chain(stream, [None]):
+        items = decoder.feed(chunk) if chunk is not None else decoder.flush()
+        last = len(items) - 1
+        for i, item in enumerate(items):
+            if i < last and _is_superseded(item, items[i + 1]):
+                continue
+            if 'stream' in item:
+                for line in item['stream'].strip().splitlines():
+                    term.print_line(line)
+            elif 'status' in item:
+                status = item.pop('status')
+                status_id = item.pop('id', None)
+                msg = status
+                if status_id:
+                    msg += ' ({})'.format(status_id)
+                if prev_status_id == status_id:
+                    call = term.replace_line
+                else:
+                    call = term.print_line
+                if 'progress' in item:
+                    msg += ': ' + item['progress']
+                else:
+                    msg += ' ' + ' '.join(
+                        '{}: {}'.format(k, v)
+                        for k, v in item.items()
+                        if v)
+                call(msg)
+                prev_status_id = status_id
+
+            elif 'error' in item:
+                raise RuntimeError(item['error'])
+
+
+class JSONStreamDecoder(object):
+    '''Incrementally decodes a stream of concatenated JSON documents, like
+    those the Docker daemon streams for builds, pushes and pulls, from chunks
+    of bytes (or text) that may hold several documents, or part of one.
+    '''
+    _decoder = json.JSONDecoder()
+    _whitespace = re.compile(r'\s*')
+
+    def __init__(self):
+        # The start of any character split across chunks:
+        self._undecoded = b''
+        # Text we haven't yet decoded into documents, which we only join when
+        # it may hold a complete one:
+        self._pending = []
+
+    def _decode_text(self, data, final=False):
+        if self._undecoded:
+            data = self._undecoded + data
+        text, consumed = codecs.utf_8_decode(data, 'strict', final)
+        self._undecoded = data[consumed:]
+        return text
+
+    def feed(self, data):
+        '''Decodes another chunk of the stream.
+
+        :returns: list of the documents completed by the chunk.
+        '''
+        if isinstance(data, bytes):
+            data = self._decode_text(data)
+        # Docker's documents are objects, so one can only have been
+        # completed by a chunk with a closing brace:
+        if '}' not in data and ']' not in data:
+            self._pending.append(data)
+            return []
+        if self._pending:
+            self._pending.append(data)
+            text = ''.join(self._pending)
+        else:
+            text = data
+        documents = []
+        end = len(text)
+        skip_whitespace = self._whitespace.match
+        raw_decode = self._decoder.raw_decode
+        offset = skip_whitespace(text).end()
+        while offset < end:
+            try:
+                document, offset = raw_decode(text, offset)
+            except ValueError:
+                # Incomplete, we hope:
+                break
+            documents.append(document)
+            offset = skip_whitespace(text, offset).end()
+        self._pending = [text[offset:]] if offset < end else []
+        return documents
+
+    def flush(self):
+        ''':returns: list of any documents left at the end of the stream.
+
+        :raises ValueError: if the stream ended partway through a document.
+        '''
+        documents = self.feed(self._decode_text(b'', final=True))
+        text = ''.join(self._pending).strip()
+        self._pending = []
+        if text:
+            raise ValueError(
+                'Stream ended with incomplete JSON: {!r}'.format(text[:100]))
+        return documents
+
+
+class LogStreamDecoder(object):
+    '''Incrementally decodes the raw bytes of a container's attach or logs
+    stream into lines of text. Unless the container has a TTY, Docker
+    multiplexes stdout and stderr into frames, each with an eight byte header
+    giving the stream and length of the frame, which we strip out.
+    '''
+    _header = struct.Struct('>BxxxL')
+
+    def __init__(self, multiplexed=True):
+        self.multiplexed = multiplexed
+        self._frame_buffer = b''
+        self._frame_remaining = 0
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._partial_line = ''
+
+    def _iter_payloads(self, data):
+        if not self.multiplexed:
+            yield data
+            return
+        data = self._frame_buffer + data
+        offset = 0
+        while offset < len(data):
+            if self._frame_remaining:
+                payload = data[offset:offset + self._frame_remaining]
+                offset += len(payload)
+                self._frame_remaining -= len(payload)
+                yield payload
+            elif len(data) - offset >= self._header.size:
+                _, self._frame_remaining = self._header.unpack_from(
+                    data, offset)
+                offset += self._header.size
             else:
-                msg += ' ' + ' '.join(
-                    '{}: {}'.format(k, v)
-                    for k, v in item.items()
-                    if v)
-            call(msg)
-            prev_status_id = status_id
+                break
+        self._frame_buffer = data[offset:]
 
-        elif 'error' in item:
-            raise RuntimeError(item['error'])
+    def feed(self, data):
+        '''Decodes another chunk of the stream.
 
+        :returns: list of the lines completed by the chunk, without their line
+            endings.
+        '''
+        text = self._partial_line + ''.join(
+            self._text_decoder.decode(payload)
+            for payload in self._iter_payloads(data))
+        lines = text.split('\n')
+        self._partial_line = lines.pop()
+        return [line.rstrip('\r') for line in lines]
 
-def iter_dependencies(to_process, get_item_dependencies):
+    def flush(self):
+        ''':returns: list containing any final, unterminated line.'''
+        line = self._partial_line + self._text_decoder.decode(b'', final=True)
+        self._partial_line = ''
+        return [line] if line else []
+
+
+def _name(item):
+    return getattr(item, 'name', item)
+
+
+class _DependencyGraph(object):
+    '''Indexes the dependencies between 'items' so that they can be ordered
+    in time linear in the number of items and dependencies.
+    '''
+    def __init__(self, items, get_item_dependencies):
+        self.items = list(OrderedDict.fromkeys(items))
+        self.dependencies = OrderedDict(
+            (item, list(OrderedDict.fromkeys(get_item_dependencies(item))))
+            for item in self.items)
+        self.dependents = {item: [] for item in self.items}
+        for item, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                if dependency not in self.dependents:
+                    raise RuntimeError(
+                        'Missing dependency {!r} required by {!r}'.format(
+                            _name(dependency), _name(item)))
+                self.dependents[dependency].append(item)
+
+    def iter_levels(self):
+        '''Yields lists of items, in the order they were given, such that
+        every item's dependencies are in earlier lists.
+        '''
+        remaining = {
+            item: len(dependencies)
+            for item, dependencies in self.dependencies.items()}
+        level = [item for item in self.items if not remaining[item]]
+        while level:
+            yield level
+            next_level = []
+            for item in level:
+                del remaining[item]
+                for dependent in self.dependents[item]:
+                    remaining[dependent] -= 1
+                    if not remaining[dependent]:
+                        next_level.append(dependent)
+            level = next_level
+        if remaining:
+            raise RuntimeError(self._describe_cycle(remaining))
+
+    def get_chain_lengths(self):
+        '''Returns a mapping of each item to the length of the longest chain
+        of items that (transitively) depend on it, including itself.
+        '''
+        ordered = [item for level in self.iter_levels() for item in level]
+        lengths = {}
+        for item in reversed(ordered):
+            lengths[item] = 1 + max(
+                [lengths[dependent] for dependent in self.dependents[item]] or
+                [0])
+        return lengths
+
+    def _describe_cycle(self, remaining):
+        '''Every item left 'remaining' depends on at least one other remaining
+        item, so by following those dependencies we must come across a cycle.
+        '''
+        path = []
+        positions = {}
+        item = next(item for item in self.items if item in remaining)
+        while item not in positions:
+            positions[item] = len(path)
+            path.append(item)
+            item = next(
+                dependency for dependency in self.dependencies[item]
+                if dependency in remaining)
+        cycle = path[positions[item]:] + [item]
+        return 'Unresolvable circular dependency: {}'.format(
+            ' -> '.join(repr(_name(i)) for i in cycle))
+
+
+def iter_dependency_levels(to_process, get_item_dependencies):
     '''Generator that yields sets of objects from 'to_process' such that each
     object in each set has already had its dependency objects yielded (and
-    therefore 'processed') in a previous set.
+    therefore 'processed') in a previous set. The objects within a single set
+    don't depend on each other, so may be processed concurrently.
+
+    :raises RuntimeError: naming the missing dependency or the items forming
+        a dependency cycle, if the objects can't be ordered.
     '''
-    to_process = set(to_process)
-    processed = set()
-    while to_process:
-        pending = set()
-        for item in list(to_process):
-            if all(dep in processed for dep in get_item_dependencies(item)):
-                to_process.remove(item)
-                pending.add(item)
-                yield item
-        if not pending:
-            raise RuntimeError('Missing or circular dependencies')
-        processed |= pending
+    graph = _DependencyGraph(to_process, get_item_dependencies)
+    for level in graph.iter_levels():
+        yield set(level)
+
+
+def iter_dependencies(to_process, get_item_dependencies):
+    '''Generator that yields objects from 'to_process' such that each object
+    has already had its dependency objects yielded before it.
+    '''
+    graph = _DependencyGraph(to_process, get_item_dependencies)
+    for level in graph.iter_levels():
+        for item in level:
+            yield item
+
+
+@contextmanager
+def make_pool(jobs):
+    '''Context manager giving a pool of 'jobs' worker threads suitable for
+    passing to :func:`call_concurrently`, or None if we should just work
+    serially. The pool is shut down, once its work is done, on exit.
+    '''
+    if jobs is None or jobs <= 1:
+        yield None
+        return
+    pool = ThreadPool(jobs)
+    try:
+        yield pool
+    finally:
+        pool.close()
+        pool.join()
+
+
+def call_concurrently(pool, func, items):
+    '''Calls 'func' for each of 'items', using the worker threads of 'pool'
+    if given. Every item is processed regardless of failures.
+
+    :returns: tuple of (results, errors) where 'results' maps each item that
+        was processed successfully to its return value, and 'errors' maps each
+        item that failed to the exception it raised. Both preserve the order of
+        'items'.
+    '''
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+    mapper = pool.imap if pool else map
+    results = OrderedDict()
+    errors = OrderedDict()
+    for item, result, error in mapper(call, items):
+        if error is None:
+            results[item] = result
+        else:
+            errors[item] = error
+    return results, errors
+
+
+def call_by_dependency(func, items, get_item_dependencies, jobs=1):
+    '''Calls 'func' for each of 'items', using up to 'jobs' worker threads.
+    Each item is started as soon as all of its dependencies have been
+    processed successfully, rather than waiting for a whole dependency level
+    to finish. Items are skipped if any of their dependencies fail.
+
+    When more items are ready than there are workers free, those at the head
+    of the longest chains of dependents are started first, so that the total
+    time taken tends towards that of the critical path through the items.
+
+    :returns: tuple of (results, errors) as for :func:`call_concurrently`,
+        except that they are ordered by completion. Skipped items are included
+        in 'errors'.
+    '''
+    graph = _DependencyGraph(items, get_item_dependencies)
+    # Also fails early on missing or circular dependencies:
+    chain_lengths = graph.get_chain_lengths()
+    positions = {item: i for i, item in enumerate(graph.items)}
+    dependents = graph.dependents
+    remaining = {
+        item: len(dependencies)
+        for item, dependencies in graph.dependencies.items()}
+    ready = []
+
+    def make_ready(item):
+        heapq.heappush(ready, (-chain_lengths[item], positions[item], item))
+
+    for item in graph.items:
+        if not remaining[item]:
+            make_ready(item)
+    done = Queue()
+    # Only hand the pool as many items as it has threads, so that it can't
+    # queue up items ahead of more important ones that become ready later:
+    max_outstanding = max(jobs or 1, 1)
+
+    def call(item):
+        try:
+            done.put((item, func(item), None))
+        except Exception as e:
+            done.put((item, None, e))
+
+    def skip_dependents(failed_item):
+        to_skip = [failed_item]
+        while to_skip:
+            item = to_skip.pop()
+            for dependent in dependents[item]:
+                if dependent not in errors:
+                    errors[dependent] = RuntimeError(
+                        'dependency {!r} failed'.format(_name(item)))
+                    to_skip.append(dependent)
+
+    results = OrderedDict()
+    errors = OrderedDict()
+    outstanding = 0
+    with make_pool(jobs) as pool:
+        while ready or outstanding:
+            while ready and outstanding < max_outstanding:
+                _, _, item = heapq.heappop(ready)
+                outstanding += 1
+                if pool:
+                    pool.apply_async(call, (item,))
+                else:
+                    call(item)
+            item, result, error = done.get()
+            outstanding -= 1
+            if error is None:
+                results[item] = result
+                for dependent in dependents[item]:
+                    remaining[dependent] -= 1
+                    if not remaining[dependent]:
+                        make_ready(dependent)
+            else:
+                errors[item] = error
+                skip_dependents(item)
+    return results, errors
@@ -59,7 +59,7 @@ setup(
     packages=find_packages(),
     install_requires=(
         'PyYaml',
-        'docker-py>=0.5.0',
+        'docker-py>=1.4.0',
         'docopt',
         'blessings',
         'cerberus<0.9',